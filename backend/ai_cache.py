@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Content-addressed cache for model responses, so a re-uploaded screenshot or a
+# repeated chat prompt doesn't cost another model call.
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", 24 * 3600))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", 1000))
+# Set to a directory to keep entries across restarts (and share them between workers)
+AI_CACHE_DIR = os.getenv("AI_CACHE_DIR")
+
+def make_key(*parts):
+    """sha256 over the given str/bytes parts, separated so ('ab', 'c') != ('a', 'bc')."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+class ResponseCache:
+    """
+    TTL + LRU cache of JSON-serializable values. Values are stored serialized,
+    so callers always get their own copy and can mutate it freely.
+    """
+
+    def __init__(self, ttl=AI_CACHE_TTL, max_entries=AI_CACHE_MAX_ENTRIES, directory=AI_CACHE_DIR):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()  # key -> (expires_at, serialized value)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        self._disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return json.loads(entry[1])
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._store_memory(key, entry)
+        return json.loads(entry[1])
+
+    def set(self, key, value):
+        entry = (time.time() + self.ttl, json.dumps(value))
+        with self._lock:
+            self._store_memory(key, entry)
+        if self.directory:
+            self._write_disk(key, entry)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _store_memory(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    # --- Disk ---
+
+    def _read_disk(self, key, now):
+        if not self.directory:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get("expires", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return (stored["expires"], stored["value"])
+
+    def _write_disk(self, key, entry):
+        path = self._disk_path(key)
+        # mkstemp gives every writer its own temp file, across processes as well as threads
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=".json.tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires": entry[0], "value": entry[1]}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            log.error("Error writing AI cache entry %s: %s", path, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._disk_writes += 1
+        if self._disk_writes % 50 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Drops expired files, then the oldest ones beyond max_entries."""
+        now = time.time()
+        files = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json"):
+                    files.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            return
+        files.sort()
+        excess = len(files) - self.max_entries
+        for index, (mtime, path) in enumerate(files):
+            if index < excess or mtime + self.ttl <= now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Returns the process-wide ResponseCache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
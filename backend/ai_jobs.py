@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from storage import DATA_DIR, atomic_write_json
+
+log = logging.getLogger(__name__)
+
+# Slow model calls run here instead of on the Flask worker that received them.
+AI_WORKERS = int(os.getenv("AI_WORKERS", 4))
+AI_QUEUE_MAX = int(os.getenv("AI_QUEUE_MAX", 100))
+AI_MAX_JOBS_PER_USER = int(os.getenv("AI_MAX_JOBS_PER_USER", 3))
+AI_JOB_RESULT_TTL = int(os.getenv("AI_JOB_RESULT_TTL", 600))
+# Every job's public record is also written here, so a poll that lands on
+# another worker process still finds it. Set to "" to keep jobs in memory only,
+# which is only correct with a single worker process.
+AI_JOB_DIR = os.getenv("AI_JOB_DIR", os.path.join(DATA_DIR, "ai_jobs"))
+# How often a wait() on another process's job re-reads its file
+AI_JOB_POLL_INTERVAL = 0.5
+
+JOB_ID_PATTERN = re.compile(r"^job-[0-9a-f-]{36}$")
+
+class QueueFullError(Exception):
+    """Raised when the queue (or one user's share of it) has no room for another job."""
+
+class JobQueue:
+    """
+    Bounded worker pool for AI jobs with per-user fairness: each user has their
+    own FIFO, and workers take the next job from users in round-robin order, so
+    one user queueing many screenshots can't starve everyone else.
+    Jobs run in the process that queued them; with a directory, their status
+    and result can be read from any process sharing it.
+    """
+
+    def __init__(self, workers=AI_WORKERS, max_queued=AI_QUEUE_MAX,
+                 max_per_user=AI_MAX_JOBS_PER_USER, result_ttl=AI_JOB_RESULT_TTL, directory=AI_JOB_DIR):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.result_ttl = result_ttl
+        self.directory = directory or None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # user_id -> deque of job ids, in round-robin order
+        self._jobs = {}                 # job_id -> job dict
+        self._threads = []
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._running = 0
+
+    # --- Submitting / reading ---
+
+    def submit(self, user_id, kind, fn, *args):
+        """Queues fn(*args) for user_id and returns the job id straight away."""
+        with self._cond:
+            expired = self._expire_finished()
+            queued = sum(len(q) for q in self._pending.values())
+            if queued >= self.max_queued:
+                self._counters["rejected"] += 1
+                raise QueueFullError("The AI queue is full, please try again shortly.")
+            active = sum(1 for job in self._jobs.values()
+                         if job["userId"] == user_id and job["status"] in ("queued", "running"))
+            if active >= self.max_per_user:
+                self._counters["rejected"] += 1
+                raise QueueFullError("You already have AI requests in progress, please wait for them to finish.")
+
+            job_id = f"job-{uuid.uuid4()}"
+            self._jobs[job_id] = {
+                "id": job_id,
+                "userId": user_id,
+                "kind": kind,
+                "status": "queued",
+                "result": None,
+                "statusCode": None,
+                "createdAt": time.time(),
+                "finishedAt": None,
+                "_call": (fn, args),
+                "_done": threading.Event(),
+                "_version": 0,
+                "_written": 0,
+                "_write_lock": threading.Lock(),
+            }
+            self._pending.setdefault(user_id, deque()).append(job_id)
+            self._counters["submitted"] += 1
+            snapshot = self._snapshot(self._jobs[job_id])
+            live = set(self._jobs) if self._counters["submitted"] % 50 == 0 else None
+            self._start_workers()
+            self._cond.notify()
+
+        # Disk I/O happens after the lock is released, so it never holds up other users
+        self._write_job(snapshot)
+        self._remove_files(expired)
+        if live is not None:
+            self._prune_disk(live)
+        return job_id
+
+    def get(self, job_id, user_id):
+        """Public view of a job, or None if it doesn't exist or belongs to someone else."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._public(job) if job["userId"] == user_id else None
+        # Queued by another worker process
+        return self._read_job(job_id, user_id)
+
+    def wait(self, job_id, user_id, timeout):
+        """Like get(), but blocks up to timeout seconds for the job to finish (long-poll)."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job["userId"] != user_id:
+                    return None
+                done = job["_done"]
+            else:
+                done = None
+        if done is not None:
+            done.wait(timeout)
+            return self.get(job_id, user_id)
+
+        deadline = time.time() + timeout
+        while True:
+            view = self._read_job(job_id, user_id)
+            if view is None or view["status"] in ("done", "failed") or time.time() >= deadline:
+                return view
+            time.sleep(min(AI_JOB_POLL_INTERVAL, max(deadline - time.time(), 0)))
+
+    def stats(self):
+        """Queue depth and throughput counters."""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "queued": sum(len(q) for q in self._pending.values()),
+                "running": self._running,
+                "users_waiting": len(self._pending),
+                "max_queued": self.max_queued,
+                **self._counters,
+            }
+
+    @staticmethod
+    def _public(job):
+        view = {key: value for key, value in job.items() if not key.startswith("_")}
+        view.pop("userId", None)
+        return view
+
+    def _expire_finished(self):
+        """Forgets finished jobs past their TTL; returns their ids. Caller holds _cond."""
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finishedAt"] is not None and job["finishedAt"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return expired
+
+    # --- Disk ---
+    # <directory>/<job_id>.json holds the public view plus the owner's user id,
+    # rewritten on every status change by the process running the job. Records
+    # are copied under _cond and written after it is released; each job's
+    # version number keeps a slow write from overwriting a newer status.
+
+    def _disk_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _snapshot(self, job):
+        """The job's record as of now, for _write_job. Caller holds _cond."""
+        if not self.directory:
+            return None
+        job["_version"] += 1
+        return job, job["_version"], {**self._public(job), "userId": job["userId"]}
+
+    def _write_job(self, snapshot):
+        """Writes a _snapshot() record unless a newer one was written already. Call without _cond."""
+        if snapshot is None:
+            return
+        job, version, record = snapshot
+        with job["_write_lock"]:
+            if version <= job["_written"]:
+                return
+            job["_written"] = version
+            try:
+                atomic_write_json(self._disk_path(job["id"]), record, kind="ai_job")
+            except (OSError, TypeError, ValueError) as e:
+                log.error("Error writing AI job %s: %s", job["id"], e)
+
+    def _remove_files(self, job_ids):
+        if not self.directory:
+            return
+        for job_id in job_ids:
+            try:
+                os.remove(self._disk_path(job_id))
+            except OSError:
+                pass
+
+    def _read_job(self, job_id, user_id):
+        if not self.directory or not JOB_ID_PATTERN.match(str(job_id)):
+            return None
+        try:
+            with open(self._disk_path(job_id), "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.pop("userId", None) != user_id:
+            return None
+        return stored
+
+    def _prune_disk(self, live):
+        """
+        Drops job files not rewritten for result_ttl seconds: finished jobs
+        past their TTL, and jobs whose process died before finishing them.
+        live is the set of this process's job ids, copied under _cond.
+        """
+        if not self.directory:
+            return
+        cutoff = time.time() - self.result_ttl
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json") and entry.name[:-5] not in live \
+                        and entry.stat().st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    # --- Workers ---
+
+    def _start_workers(self):
+        # Started lazily, so importing this module never spawns threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"ai-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_job(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            user_id, queue = self._pending.popitem(last=False)
+            job_id = queue.popleft()
+            if queue:
+                # Back of the line for this user's next job
+                self._pending[user_id] = queue
+            job = self._jobs[job_id]
+            job["status"] = "running"
+            self._running += 1
+            snapshot = self._snapshot(job)
+        self._write_job(snapshot)
+        return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            fn, args = job["_call"]
+            try:
+                result, status_code = fn(*args)
+                status = "done"
+            except Exception:
+                log.exception("AI job %s (%s) failed", job['id'], job['kind'])
+                result, status_code = {"status": "error", "message": "Internal AI communication error."}, 500
+                status = "failed"
+            with self._cond:
+                self._running -= 1
+                self._counters["completed" if status == "done" else "failed"] += 1
+                job.update(status=status, result=result, statusCode=status_code, finishedAt=time.time())
+                job["_call"] = None
+                snapshot = self._snapshot(job)
+            self._write_job(snapshot)
+            job["_done"].set()
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Returns the process-wide JobQueue."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
@@ -1,13 +1,68 @@
 import litellm
 import json
+import base64
 from datetime import datetime
 import os
+import time
+import logging
+from functools import lru_cache
 from dotenv import load_dotenv
+from ai_cache import get_response_cache, make_key
+import metrics
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# Retries are ours rather than litellm's num_retries, so each one is counted
+# and logged. Only errors that can pass on their own are retried.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 0.5))
+_TRANSIENT_ERRORS = tuple(
+    error for error in (
+        getattr(litellm, name, None) for name in (
+            "RateLimitError", "APIConnectionError", "Timeout",
+            "ServiceUnavailableError", "InternalServerError",
+        )
+    ) if isinstance(error, type)
+)
+
 # Set your API keys in your environment variables
-os.environ["GEMINI_API_KEY"] = os.getenv('gemini_api')
+# (a missing key only fails the model calls, not the import)
+if os.getenv('gemini_api'):
+    os.environ["GEMINI_API_KEY"] = os.getenv('gemini_api')
+
+def _completion(call, **kwargs):
+    """
+    litellm.completion() with retries on transient errors, recording the call
+    time, retries and token usage under the `call` label.
+    """
+    started = time.perf_counter()
+    attempt = 0
+    outcome = "error"
+    try:
+        while True:
+            try:
+                response = litellm.completion(num_retries=0, **kwargs)
+                break
+            except _TRANSIENT_ERRORS as e:
+                if attempt >= LLM_MAX_RETRIES:
+                    raise
+                attempt += 1
+                metrics.LLM_RETRIES.inc(call=call)
+                log.warning("LLM %s call failed (%s), retry %d of %d", call, type(e).__name__,
+                            attempt, LLM_MAX_RETRIES)
+                time.sleep(LLM_RETRY_BACKOFF * 2 ** (attempt - 1))
+        outcome = "ok"
+    finally:
+        metrics.LLM_SECONDS.observe(time.perf_counter() - started, call=call, outcome=outcome)
+
+    usage = getattr(response, "usage", None)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, kind, None)
+        if count:
+            metrics.LLM_TOKENS.inc(count, call=call, type=kind.split("_")[0])
+    return response
 
 def get_schedule_agent_prompt():
     """
@@ -16,7 +71,11 @@ def get_schedule_agent_prompt():
     
     # Get today's date to use as a default
     today_str = datetime.now().strftime("%Y-%m-%d")
+    return _schedule_agent_prompt(today_str)
 
+# The prompt only changes with the date, so it is built once a day rather than per turn
+@lru_cache(maxsize=2)
+def _schedule_agent_prompt(today_str):
     return f"""
     You are an expert calendar scheduling assistant with a **friendly, casual, and encouraging tone**. 
     Your goal is to parse a user's text prompt and extract event details. You MUST respond in one of two JSON formats:
@@ -68,14 +127,19 @@ def get_schedule_agent_prompt():
     ---
     """
 
-def schedule_event_from_text(history_from_frontend):
+def schedule_event_from_text(history_from_frontend, summary=None, usage=None):
     """
-    Calls the Gemini model with the full conversation history.
+    Calls the Gemini model with the conversation: `history_from_frontend` is
+    the turns to send verbatim ({sender, text}), `summary` an optional digest
+    of earlier ones (see chat_sessions). If `usage` is a dict, it is filled
+    with the provider's token counts and whether the response cache answered.
     """
     system_prompt = get_schedule_agent_prompt()
     
     # --- BUILD THE MESSAGE LIST ---
     messages_for_ai = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages_for_ai.append({"role": "system", "content": f"Earlier in this conversation (condensed):\n{summary}"})
     
     # Map frontend keys (sender/text) to backend keys (role/content)
     for msg in history_from_frontend:
@@ -83,39 +147,58 @@ def schedule_event_from_text(history_from_frontend):
         messages_for_ai.append({"role": role, "content": msg["text"]})
     # --- END BUILD ---
 
+    # The prompt embeds today's date, so the same chat on another day is a different request.
+    # Whitespace is normalized so near-identical retypes share an entry.
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    normalized = [(m["role"], " ".join(str(m["content"]).split())) for m in messages_for_ai[1:]]
+    cache_key = make_key("schedule", today_str, json.dumps(normalized))
+    cached = get_response_cache().get(cache_key)
+    if usage is not None:
+        usage.update(cached=cached is not None, promptTokens=0, completionTokens=0)
+    if cached is not None:
+        return cached
+
     try:
-        response = litellm.completion(
+        response = _completion(
+            "schedule",
             model="gemini/gemini-2.5-flash", # or gemini-2.5-flash
-            messages=messages_for_ai, # Pass the full history
-            response_format={"type": "json_object"},
-            num_retries = 3
+            messages=messages_for_ai,
+            response_format={"type": "json_object"}
         )
+        if usage is not None:
+            reported = getattr(response, "usage", None)
+            usage["promptTokens"] = getattr(reported, "prompt_tokens", None) or 0
+            usage["completionTokens"] = getattr(reported, "completion_tokens", None) or 0
         
         raw_content = response.choices[0].message.content
         parsed_json = json.loads(raw_content)
+        get_response_cache().set(cache_key, parsed_json)
         return parsed_json
 
     except Exception as e:
-        print(f"Litellm error in schedule_event_from_text: {e}")
+        log.warning("LLM error in schedule_event_from_text: %s", e)
         return {
             "status": "question",
             "message": "Sorry, I had trouble understanding that. Could you rephrase your request?"
         }
 
-def parse_image_data(base64_image, prompt):
+def parse_image_bytes(image_bytes, prompt, mime_type="image/jpeg"):
     """
     Parses an image (screenshot) and returns a list of suggested events.
     Optimized for Weekly Timetables (Horizontal and Vertical grids).
+    Expects bytes already shrunk by image_ingest.preprocess_image.
     """
-    # Clean the base64 string if needed
-    if "," in base64_image:
-        image_data = base64_image.split(",")[1]
-    else:
-        image_data = base64_image
-
     # Get today's date to help the AI calculate "Next Monday" etc.
     today_str = datetime.now().strftime("%Y-%m-%d")
 
+    # Cache on the image bytes, so the same screenshot hits regardless of how it was uploaded
+    cache_key = make_key("vision", today_str, prompt, image_bytes)
+    cached = get_response_cache().get(cache_key)
+    if cached is not None:
+        return cached
+
+    image_data = base64.b64encode(image_bytes).decode("ascii")
+
     system_prompt = f"""
     You are an advanced Data Extraction AI specialized in reading Calendar Timetables and Screenshots.
     Your task is to extract event details from the provided image.
@@ -156,7 +239,8 @@ def parse_image_data(base64_image, prompt):
     """
 
     try:
-        response = litellm.completion(
+        response = _completion(
+            "vision",
             # We use 1.5-flash as it has excellent vision capabilities for grids
             model="gemini/gemini-2.5-flash",
             messages=[
@@ -171,27 +255,23 @@ def parse_image_data(base64_image, prompt):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
+                                "url": f"data:{mime_type};base64,{image_data}"
                             }
                         }
                     ]
                 }
             ],
-            response_format={"type": "json_object"},
-            num_retries=3
+            response_format={"type": "json_object"}
         )
 
         raw_content = response.choices[0].message.content
-        
-        # --- DEBUGGING ---
-        print("\n============= AI RAW VISION RESPONSE =============")
-        print(raw_content)
-        print("==================================================\n")
-        # -----------------
-        
+        # The raw reply only at DEBUG: it holds whatever was on the user's screenshot
+        log.debug("Raw vision response (%d chars): %s", len(raw_content or ""), raw_content)
+
         parsed_json = json.loads(raw_content)
+        get_response_cache().set(cache_key, parsed_json)
         return parsed_json
 
     except Exception as e:
-        print(f"Litellm error in parse_image_data: {e}")
+        log.warning("LLM error in parse_image_bytes: %s", e)
         return {"suggested_events": []}
\ No newline at end of file
@@ -1,22 +1,43 @@
 import os
 import json
-from flask import Flask, jsonify, request, send_from_directory
+import time
+import logging
+from flask import Flask, Response, g, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, JWTManager
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from event_manager import get_all_events, save_all_events_split
-from ai_parser import parse_image_data, schedule_event_from_text # Import the new function
+import threading
 import uuid # Need this to create new event IDs
+from datetime import datetime, timedelta
 
 # Import your custom logic modules
-from auth import register_user, login_user
+from auth import register_user, login_user, get_user_id
 from event_manager import (
-    get_all_events, save_all_events_split,
-    get_tasks, save_tasks,
-    get_profile, save_profile
+    save_all_events_split, get_events_revision,
+    iter_all_events, iter_events_in_range,
+    get_events_overlapping, find_conflicts, find_next_free_slot, get_free_busy,
+    user_exists, shares_free_busy_with,
+    create_event, update_event, delete_event, update_recurrence, apply_event_ops, import_events,
+    get_changes, get_event_cache_stats, get_recurrence_cache_stats, search_events,
+    get_tasks, save_tasks, get_tasks_revision,
+    get_profile, update_profile,
+    user_lock, RevisionConflict
 )
-from ai_parser import parse_image_data
+from ai_jobs import get_job_queue, QueueFullError
+from ai_cache import get_response_cache
+from chat_sessions import get_session_store
+from image_ingest import read_image_upload, read_stream, preprocess_image, ImageTooLargeError, InvalidImageError
+from upload_store import UploadStore, parse_stored_name, UPLOAD_MAX_AGE, UPLOAD_MAX_BYTES
+from recurrence import parse_date
+from intervals import parse_time
+from compression import compress_response
+from streaming import json_array_response
+from logs import configure_logging
+import metrics
+import profiler
+
+configure_logging()
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
@@ -25,9 +46,97 @@ CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
 app.config["JWT_SECRET_KEY"] = "your-super-secret-key-change-this" # IMPORTANT
 app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "uploads")
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True) # Ensure uploads folder exists
+# Behind Apache/lighttpd, let the front server send upload files (X-Sendfile)
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE") == "1"
+upload_store = UploadStore(app.config["UPLOAD_FOLDER"])
 
 jwt = JWTManager(app)
 
+# --- Request timing and profiling ---
+# Registered before compress(), so it runs after it (Flask runs after_request
+# hooks in reverse) and the observed time includes compression. A streamed
+# body is timed to its first chunk: the rest is sent after the hook returns.
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if profiler.should_profile(request.headers):
+        g.profiler = profiler.SamplingProfiler()
+        g.profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    # The route template, not the path: /api/events/<event_id> is one series, not one per id
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                    route=route, status=response.status_code)
+    sampler = g.pop("profiler", None)
+    if sampler is not None:
+        sampler.stop()
+        response.headers["X-Profile-File"] = sampler.write(f"{request.method} {route}")
+    return response
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request)
+
+@app.route("/metrics", methods=["GET"])
+def handle_metrics():
+    """Prometheus scrape endpoint. With METRICS_TOKEN set it needs that bearer token."""
+    if metrics.METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        return jsonify({"msg": "Unauthorized"}), 401
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def _etag(user_id, store, revision, *parts):
+    # The user id is part of the tag, so two accounts in one browser never share a 304
+    return ":".join([user_id, store, str(revision), *parts])
+
+def _not_modified(tag):
+    """304 if the client already holds this version, else None."""
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+        _set_cache_headers(response, tag)
+        return response
+    return None
+
+def _if_match_revision(user_id, store):
+    """
+    The revision named by an If-Match header holding one of our ETags for
+    this store (as sent back from a GET or a previous save), or None without one.
+    Weak tags are accepted: ours are only weak because of compression.
+    A header naming none of this user's tags for this store (a malformed tag,
+    another store's or another user's) can't match, so it fails with 412.
+    """
+    if not request.headers.get("If-Match") or request.if_match.star_tag:
+        return None
+    for tag in request.if_match.as_set(include_weak=True):
+        parts = tag.split(":")
+        if len(parts) >= 3 and parts[0] == user_id and parts[1] == store and parts[2].isdigit():
+            return int(parts[2])
+    if store.startswith("tasks-"):
+        current = get_tasks_revision(user_id, store[len("tasks-"):])
+    else:
+        current = get_events_revision(user_id)
+    raise RevisionConflict(store, request.headers["If-Match"], current)
+
+@app.errorhandler(RevisionConflict)
+def handle_revision_conflict(error):
+    # 412: the client's copy is stale; it should refetch, reapply and retry
+    response = jsonify({"msg": str(error), "revision": error.current})
+    response.status_code = 412
+    return response
+
+def _set_cache_headers(response, tag):
+    # Weak: the same version may be sent gzipped, brotli'd or plain
+    response.set_etag(tag, weak=True)
+    # Browsers keep the body but revalidate every time, so a fetch() of an
+    # unchanged store is answered by a 304 and served from their cache
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 # --- Authentication Endpoints ---
 
 @app.route("/api/register", methods=["POST"])
@@ -54,9 +163,24 @@ def login():
 
 @app.route('/uploads/<user_id>/<filename>')
 def serve_user_upload(user_id, filename):
+    """
+    Content-addressed files (see upload_store.py) never change, so they are
+    cached for good, with their name as a strong ETag for clients that check
+    anyway. Older client-named files are revalidated on every use. Either
+    way the body goes out through the server's file wrapper (sendfile where
+    the server supports it), or X-Sendfile with USE_X_SENDFILE=1.
+    """
     # This securely serves files only from the specific user's upload directory
     user_upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], user_id)
-    return send_from_directory(user_upload_folder, filename)
+    stored = parse_stored_name(filename)
+    if stored is None:
+        return send_from_directory(user_upload_folder, filename, max_age=0)
+
+    etag = filename.rsplit(".", 1)[0]
+    response = send_from_directory(user_upload_folder, filename, etag=etag, max_age=UPLOAD_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 # --- Profile Endpoints ---
 
@@ -74,29 +198,58 @@ def handle_get_profile():
 def handle_update_profile():
     user_id = get_jwt_identity()
     
-    profile = get_profile(user_id)
-    if not profile:
+    if not get_profile(user_id):
         return jsonify({"msg": "Profile not found"}), 404
+    updates = {}
 
     # 1. Check for text data (username)
     if 'username' in request.form:
-        profile['username'] = request.form['username']
+        updates['username'] = request.form['username']
         # Note: In a real app, you'd also update the login 'users.json'
 
+    # Who may see this user's busy times in /api/freebusy: comma-separated
+    # usernames, "*" for everyone, or empty to stop sharing
+    if 'freeBusySharedWith' in request.form:
+        shared = request.form['freeBusySharedWith'].strip()
+        if shared == "*":
+            updates['freeBusySharedWith'] = "*"
+        else:
+            usernames = [name.strip() for name in shared.split(",") if name.strip()]
+            ids = [get_user_id(name) for name in usernames]
+            unknown = [name for name, shared_id in zip(usernames, ids) if shared_id is None]
+            if unknown:
+                return jsonify({"msg": "Unknown usernames", "unknownUsernames": unknown}), 400
+            updates['freeBusySharedWith'] = list(dict.fromkeys(ids))
+
     # 2. Check for file (photo)
+    photo_bytes = None
     if 'photo' in request.files:
         file = request.files['photo']
         if file.filename != '':
-            filename = secure_filename(file.filename)
-            user_upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], user_id)
-            os.makedirs(user_upload_folder, exist_ok=True)
-            save_path = os.path.join(user_upload_folder, filename)
-            file.save(save_path)
-            
-            profile['photoUrl'] = f"/uploads/{user_id}/{filename}"
-    
-    # 3. Save the updated profile.json
-    if save_profile(user_id, profile):
+            try:
+                photo_bytes = read_stream(file.stream, limit=UPLOAD_MAX_BYTES)
+            except ImageTooLargeError as e:
+                return jsonify({"msg": str(e)}), 413
+
+    # 3. Save the updated profile.json (read-merge-write under the user's lock).
+    # Storing, pointing the profile at the photo and dropping the old files all
+    # happen under the lock, so a concurrent upload can't lose its files.
+    with user_lock(user_id):
+        stored = None
+        if photo_bytes:
+            try:
+                stored = upload_store.save_photo(user_id, photo_bytes)
+            except ImageTooLargeError as e:
+                return jsonify({"msg": str(e)}), 413
+            except InvalidImageError as e:
+                return jsonify({"msg": str(e)}), 400
+            updates['photoUrl'] = stored["photoUrl"]
+            updates['photoThumbnails'] = stored["photoThumbnails"]
+
+        profile = update_profile(user_id, updates)
+        if profile and stored:
+            upload_store.prune(user_id, stored["hash"])
+    if profile:
         return jsonify(profile), 200
     return jsonify({"msg": "Error saving profile"}), 500
 
@@ -106,10 +259,62 @@ def handle_update_profile():
 @jwt_required()
 def handle_get_all_events():
     user_id = get_jwt_identity()
-    events = get_all_events(user_id)
-    if events is None:
-        return jsonify({"msg": "Data not found"}), 404
-    return jsonify(events)
+    # The revision is checked before anything is read, so an unchanged refetch
+    # costs a stat of the revisions file
+    tag = _etag(user_id, "events", get_events_revision(user_id))
+    not_modified = _not_modified(tag)
+    if not_modified is not None:
+        return not_modified
+
+    # Streamed from the storage a shard at a time once the body gets large
+    return _set_cache_headers(json_array_response(iter_all_events(user_id)), tag)
+
+@app.route("/api/events", methods=["GET"])
+@jwt_required()
+def handle_get_events_in_range():
+    """Returns only the event instances between ?start= and ?end= (YYYY-MM-DD, inclusive)."""
+    user_id = get_jwt_identity()
+    start_date = parse_date(request.args.get("start"))
+    end_date = parse_date(request.args.get("end"))
+    if not start_date or not end_date:
+        return jsonify({"msg": "start and end are required (YYYY-MM-DD)"}), 400
+    if end_date < start_date:
+        return jsonify({"msg": "end must not be before start"}), 400
+
+    tag = _etag(user_id, "events", get_events_revision(user_id), start_date.isoformat(), end_date.isoformat())
+    not_modified = _not_modified(tag)
+    if not_modified is not None:
+        return not_modified
+
+    return _set_cache_headers(json_array_response(iter_events_in_range(user_id, start_date, end_date)), tag)
+
+SEARCH_MAX_LIMIT = 200
+
+@app.route("/api/events/search", methods=["GET"])
+@jwt_required()
+def handle_search_events():
+    """?q= (words matched as prefixes), optional ?start=&end= (YYYY-MM-DD) and ?limit=."""
+    user_id = get_jwt_identity()
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"msg": "q is required"}), 400
+    start_date = parse_date(request.args.get("start")) if request.args.get("start") else None
+    end_date = parse_date(request.args.get("end")) if request.args.get("end") else None
+    if (request.args.get("start") and not start_date) or (request.args.get("end") and not end_date):
+        return jsonify({"msg": "start and end must be YYYY-MM-DD"}), 400
+    if start_date and end_date and end_date < start_date:
+        return jsonify({"msg": "end must not be before start"}), 400
+    limit = request.args.get("limit", 50, type=int)
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({"msg": f"limit must be between 1 and {SEARCH_MAX_LIMIT}"}), 400
+
+    results, total = search_events(user_id, query, start_date, end_date, limit)
+    return jsonify({"results": results, "total": total}), 200
+
+@app.route("/api/events/cache/stats", methods=["GET"])
+@jwt_required()
+def handle_event_cache_stats():
+    return jsonify({"events": get_event_cache_stats(), "recurrence": get_recurrence_cache_stats()}), 200
 
 @app.route("/api/events/save_all", methods=["POST"])
 @jwt_required()
@@ -120,124 +325,542 @@ def handle_save_all_events():
     # FIX: Ensure all_events is a list before passing it to the manager
     if not isinstance(all_events, list):
         # Log error and return a bad request response if the data format is wrong
-        print(f"Error: Received data is not a list. Type: {type(all_events)}")
+        log.warning("save_all: expected a list of events, got %s", type(all_events).__name__)
         return jsonify({"msg": "Invalid data format. Expected a list of events."}), 400
 
-    if save_all_events_split(user_id, all_events):
-        return jsonify({"msg": "Events saved successfully"}), 200
+    with user_lock(user_id):
+        written_shards = save_all_events_split(user_id, all_events, _if_match_revision(user_id, "events"))
+        revision = get_events_revision(user_id)
+    if written_shards is not None:
+        response = jsonify({"msg": "Events saved successfully", "shards": written_shards, "revision": revision})
+        response.set_etag(_etag(user_id, "events", revision), weak=True)
+        return response, 200
     return jsonify({"msg": "Failed to save events"}), 500
 
+def _event_write_response(user_id, response, status_code):
+    """jsonify()s an event mutation result, with the new events ETag on success."""
+    response_object = jsonify(response)
+    if "revision" in response:
+        response_object.set_etag(_etag(user_id, "events", response["revision"]), weak=True)
+    return response_object, status_code
+
+# --- Incremental Event Endpoints ---
+# Single-event changes, so an edit no longer re-posts the whole calendar.
+
+@app.route("/api/events", methods=["POST"])
+@jwt_required()
+def handle_create_event():
+    user_id = get_jwt_identity()
+    event = request.json
+    if not isinstance(event, dict):
+        return jsonify({"msg": "Invalid data format. Expected an event object."}), 400
+    with user_lock(user_id):
+        # Checked before saving, so the new event can't conflict with itself
+        conflicts = find_conflicts(user_id, event)
+        response, status_code = create_event(user_id, event, _if_match_revision(user_id, "events"))
+    if status_code == 201:
+        response["conflicts"] = [_conflict_summary(other) for other in conflicts]
+    return _event_write_response(user_id, response, status_code)
+
+def _conflict_summary(event):
+    return {key: event.get(key) for key in ("id", "title", "date", "startTime", "endTime", "recurrenceId")}
+
+def _parse_datetime(value):
+    """'YYYY-MM-DDTHH:MM' (or a bare date, meaning midnight) -> datetime, or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+@app.route("/api/events/overlaps", methods=["GET"])
+@jwt_required()
+def handle_get_overlapping_events():
+    """Instances overlapping ?start= to ?end= (YYYY-MM-DDTHH:MM), e.g. 'what's on Thursday 14:00-15:00'."""
+    user_id = get_jwt_identity()
+    start = _parse_datetime(request.args.get("start"))
+    end = _parse_datetime(request.args.get("end"))
+    if not start or not end or end <= start:
+        return jsonify({"msg": "start and end are required (YYYY-MM-DDTHH:MM), end after start"}), 400
+    return jsonify(get_events_overlapping(user_id, start, end)), 200
+
+@app.route("/api/events/next_free", methods=["GET"])
+@jwt_required()
+def handle_get_next_free_slot():
+    """
+    Earliest free slot of ?duration= minutes from ?after= (default now) until ?until=
+    (default two weeks later), optionally only between ?day_start= and ?day_end= (HH:MM).
+    """
+    user_id = get_jwt_identity()
+    duration = request.args.get("duration", type=int)
+    if not duration or duration <= 0:
+        return jsonify({"msg": "duration (minutes) is required"}), 400
+    after = _parse_datetime(request.args.get("after")) or datetime.now().replace(second=0, microsecond=0)
+    until = _parse_datetime(request.args.get("until")) or after + timedelta(days=14)
+    day_start = parse_time(request.args.get("day_start"))
+    day_end = parse_time(request.args.get("day_end"))
+    if until <= after:
+        return jsonify({"msg": "until must be after after"}), 400
+
+    slot = find_next_free_slot(user_id, timedelta(minutes=duration), after, until, day_start, day_end)
+    if slot is None:
+        return jsonify({"msg": "No free slot in the window", "slot": None}), 200
+    slot_end = slot + timedelta(minutes=duration)
+    return jsonify({"slot": {
+        "date": slot.date().isoformat(),
+        "startTime": slot.strftime("%H:%M"),
+        "endTime": slot_end.strftime("%H:%M"),
+        "start": slot.isoformat(timespec="minutes"),
+        "end": slot_end.isoformat(timespec="minutes"),
+    }}), 200
+
+@app.route("/api/events/<event_id>", methods=["PUT"])
+@jwt_required()
+def handle_update_event(event_id):
+    user_id = get_jwt_identity()
+    changes = request.json
+    if not isinstance(changes, dict):
+        return jsonify({"msg": "Invalid data format. Expected an event object."}), 400
+    response, status_code = update_event(user_id, event_id, changes, _if_match_revision(user_id, "events"))
+    return _event_write_response(user_id, response, status_code)
+
+@app.route("/api/events/<event_id>", methods=["DELETE"])
+@jwt_required()
+def handle_delete_event(event_id):
+    user_id = get_jwt_identity()
+    scope = request.args.get("scope", "series")
+    response, status_code = delete_event(user_id, event_id, scope, _if_match_revision(user_id, "events"))
+    return _event_write_response(user_id, response, status_code)
+
+@app.route("/api/events/recurrence", methods=["PUT"])
+@jwt_required()
+def handle_update_recurrence():
+    user_id = get_jwt_identity()
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({"msg": "Invalid data format. Expected an object."}), 400
+    response, status_code = update_recurrence(user_id, data, _if_match_revision(user_id, "events"))
+    return _event_write_response(user_id, response, status_code)
+
+@app.route("/api/events", methods=["PATCH"])
+@jwt_required()
+def handle_patch_events():
+    """Batch of ops, applied all-or-nothing: {"ops": [{"op": "create", "event": {...}}, ...]}"""
+    user_id = get_jwt_identity()
+    data = request.json
+    ops = data.get("ops") if isinstance(data, dict) else data
+    response, status_code = apply_event_ops(user_id, ops, _if_match_revision(user_id, "events"))
+    return _event_write_response(user_id, response, status_code)
+
+@app.route("/api/events/batch", methods=["POST"])
+@jwt_required()
+def handle_import_events():
+    """
+    Many new events in one write, e.g. confirmed suggestions from /api/chat/parse_image:
+    {"events": [...], "collapseWeekly": false, "skipDuplicates": true} (or just the list).
+    """
+    user_id = get_jwt_identity()
+    data = request.json
+    options = data if isinstance(data, dict) else {}
+    events = options.get("events") if isinstance(data, dict) else data
+    response, status_code = import_events(
+        user_id, events,
+        collapse_weekly=bool(options.get("collapseWeekly", False)),
+        skip_duplicates=bool(options.get("skipDuplicates", True)),
+        expected_revision=_if_match_revision(user_id, "events"))
+    return _event_write_response(user_id, response, status_code)
+
+# --- Free/Busy ---
+
+FREEBUSY_MAX_USERS = int(os.getenv("FREEBUSY_MAX_USERS", 50))
+FREEBUSY_MAX_DAYS = 366
+
+@app.route("/api/freebusy", methods=["POST"])
+@jwt_required()
+def handle_free_busy():
+    """
+    {"userIds": [...], "usernames": [...], "start": "YYYY-MM-DDTHH:MM", "end": ...,
+     "duration": minutes, "dayStart": "09:00", "dayEnd": "17:00", "limit": 5}
+    Returns busy blocks per user (times only, no event details) and the earliest
+    slots free for everyone. Without userIds/usernames it is just the caller.
+    Unknown users are left out and listed; 403 if any other user doesn't share
+    their free/busy times with the caller (see event_manager).
+    """
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({"msg": "Invalid data format. Expected an object."}), 400
+
+    start = _parse_datetime(data.get("start"))
+    end = _parse_datetime(data.get("end"))
+    if not start or not end or end <= start:
+        return jsonify({"msg": "start and end are required (YYYY-MM-DDTHH:MM), end after start"}), 400
+    if end - start > timedelta(days=FREEBUSY_MAX_DAYS):
+        return jsonify({"msg": f"The window can be at most {FREEBUSY_MAX_DAYS} days"}), 400
+    duration = data.get("duration", 30)
+    if not isinstance(duration, int) or isinstance(duration, bool) or duration <= 0:
+        return jsonify({"msg": "duration must be a positive number of minutes"}), 400
+    limit = data.get("limit", 5)
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= 100:
+        return jsonify({"msg": "limit must be a whole number from 1 to 100"}), 400
+
+    for field in ("userIds", "usernames"):
+        value = data.get(field)
+        if value is not None and (not isinstance(value, list) or not all(isinstance(item, str) for item in value)):
+            return jsonify({"msg": f"{field} must be a list of strings"}), 400
+
+    caller_id = get_jwt_identity()
+    user_ids, unknown_ids, unknown = [], [], []
+    for user_id in data.get("userIds") or []:
+        if user_id == caller_id or user_exists(user_id):
+            user_ids.append(user_id)
+        else:
+            unknown_ids.append(user_id)
+    for username in data.get("usernames") or []:
+        user_id = get_user_id(username)
+        if user_id is None:
+            unknown.append(username)
+        else:
+            user_ids.append(user_id)
+    user_ids = list(dict.fromkeys(user_ids)) or [caller_id]
+    if len(user_ids) > FREEBUSY_MAX_USERS:
+        return jsonify({"msg": f"At most {FREEBUSY_MAX_USERS} users per request"}), 400
+    not_shared = [user_id for user_id in user_ids if not shares_free_busy_with(user_id, caller_id)]
+    if not_shared:
+        return jsonify({"msg": "These users don't share their free/busy times with you",
+                        "notShared": not_shared}), 403
+
+    busy, slots = get_free_busy(user_ids, start, end, timedelta(minutes=duration),
+                                parse_time(data.get("dayStart")), parse_time(data.get("dayEnd")), limit)
+    as_json = lambda block: {"start": block[0].isoformat(timespec="minutes"), "end": block[1].isoformat(timespec="minutes")}
+    return jsonify({
+        "busy": {user_id: [as_json(block) for block in blocks] for user_id, blocks in busy.items()},
+        "free": [as_json(slot) for slot in slots],
+        "earliest": as_json((slots[0][0], slots[0][0] + timedelta(minutes=duration))) if slots else None,
+        "unknownUsernames": unknown,
+        "unknownUserIds": unknown_ids,
+    }), 200
+
+# --- Change Feed ---
+# Clients keep the last "cursor" they saw and ask for what changed since. On
+# resync=true they reload /api/events/all and /api/tasks/<year> and carry on from
+# the returned cursor. Start with since=0.
+
+@app.route("/api/changes", methods=["GET"])
+@jwt_required()
+def handle_get_changes():
+    """?since=N; ?wait=S long-polls up to S seconds (max 30) for the next change."""
+    user_id = get_jwt_identity()
+    since = request.args.get("since", type=int)
+    if since is None:
+        return jsonify({"msg": "since is required"}), 400
+    wait = min(max(request.args.get("wait", 0, type=float), 0), 30)
+    return jsonify(get_changes(user_id, since, wait)), 200
+
+@app.route("/api/changes/stream", methods=["GET"])
+@jwt_required()
+def handle_stream_changes():
+    """
+    Server-sent events: a 'changes' event per batch (its id is the cursor, so
+    EventSource resumes via Last-Event-ID), or one 'resync' event and the end.
+    """
+    user_id = get_jwt_identity()
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
+    if since is None:
+        return jsonify({"msg": "since is required"}), 400
+
+    def generate():
+        cursor = since
+        while True:
+            result = get_changes(user_id, cursor, 15)
+            if result["resync"]:
+                yield f"event: resync\ndata: {json.dumps(result)}\n\n"
+                return
+            if result["changes"]:
+                cursor = result["cursor"]
+                yield f"id: {cursor}\nevent: changes\ndata: {json.dumps(result)}\n\n"
+            else:
+                yield ": keepalive\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- Checklist Endpoints ---
 
 @app.route("/api/tasks/<int:year>", methods=["GET"])
 @jwt_required()
 def handle_get_tasks(year):
     user_id = get_jwt_identity()
+    tag = _etag(user_id, f"tasks-{year}", get_tasks_revision(user_id, year))
+    not_modified = _not_modified(tag)
+    if not_modified is not None:
+        return not_modified
+
     tasks = get_tasks(user_id, year)
     if tasks is None:
         return jsonify({"msg": "Error retrieving tasks"}), 500
-    return jsonify(tasks)
+    return _set_cache_headers(jsonify(tasks), tag)
 
 @app.route("/api/tasks/<int:year>", methods=["POST"])
 @jwt_required()
 def handle_save_tasks(year):
     user_id = get_jwt_identity()
     all_tasks = request.json 
-    if save_tasks(user_id, all_tasks):
-        return jsonify({"msg": "Tasks saved successfully"}), 200
+    revision = save_tasks(user_id, year, all_tasks, _if_match_revision(user_id, f"tasks-{year}"))
+    if revision is not None:
+        response = jsonify({"msg": "Tasks saved successfully", "revision": revision})
+        response.set_etag(_etag(user_id, f"tasks-{year}", revision), weak=True)
+        return response, 200
     return jsonify({"msg": "Error saving tasks"}), 500
 
 # --- AI Chatbot Endpoint ---
-@app.route("/api/chat/parse_image", methods=["POST"])
-@jwt_required()
-def handle_parse_image():
-    user_id = get_jwt_identity()
-    data = request.json
-    base64_image = data.get("image")
-    prompt = data.get("prompt", "Extract event details from this image.")
-
-    if not base64_image:
-        return jsonify({"msg": "No image data provided"}), 400
+# Each AI endpoint runs inline by default. With {"async": true} in the body (or
+# AI_ASYNC=1 server-wide) the work goes onto the ai_jobs worker pool instead, and
+# the client gets a job id to poll at /api/chat/jobs/<job_id>.
+
+AI_ASYNC_DEFAULT = os.getenv("AI_ASYNC", "0") == "1"
+
+# ai_parser pulls in litellm, which dominates cold start, so it is imported on the
+# first /api/chat/* request instead of at startup. AI_PREWARM=1 imports it on a
+# background thread right after startup instead.
+AI_PREWARM = os.getenv("AI_PREWARM", "0") == "1"
+_ai_parser = None
+_ai_parser_lock = threading.Lock()
+
+def get_ai_parser():
+    global _ai_parser
+    if _ai_parser is None:
+        with _ai_parser_lock:
+            if _ai_parser is None:
+                import ai_parser
+                _ai_parser = ai_parser
+    return _ai_parser
+
+if AI_PREWARM:
+    threading.Thread(target=get_ai_parser, name="ai-prewarm", daemon=True).start()
+
+def _wants_async(data):
+    return bool(data.get("async", AI_ASYNC_DEFAULT)) if isinstance(data, dict) else AI_ASYNC_DEFAULT
+
+def _run_ai(user_id, kind, job_fn, *args, run_async=False):
+    """Runs an AI job inline, or queues it and answers 202 with the job id."""
+    if not run_async:
+        response, status_code = job_fn(*args)
+        return jsonify(response), status_code
+    try:
+        job_id = get_job_queue().submit(user_id, kind, job_fn, *args)
+    except QueueFullError as e:
+        return jsonify({"status": "error", "message": str(e)}), 429, {"Retry-After": "5"}
+    return jsonify({"status": "queued", "jobId": job_id}), 202
 
+def _parse_image_job(image_bytes, prompt, mime_type):
     try:
         # Pass to the AI parser module
-        event_data = parse_image_data(base64_image, prompt)
+        event_data = get_ai_parser().parse_image_bytes(image_bytes, prompt, mime_type)
         # Event data is just suggestions, so we don't save.
         # We just return the suggestions to the user for confirmation.
-        return jsonify(event_data), 200
+        return event_data, 200
     except Exception as e:
-        return jsonify({"msg": f"Error parsing image: {str(e)}"}), 500
-
-# backend/app.py
+        return {"msg": f"Error parsing image: {str(e)}"}, 500
 
-@app.route("/api/chat/schedule_event", methods=["POST"])
+@app.route("/api/chat/parse_image", methods=["POST"])
 @jwt_required()
-def handle_schedule_event():
+def handle_parse_image():
+    """Takes a multipart 'image' file, a raw image body, or the JSON {"image": base64}."""
     user_id = get_jwt_identity()
-    
-    # 1. Get the full conversation history from the frontend
     try:
-        data = request.json
-        history_from_frontend = data.get("history") 
-    except Exception:
-        # If request.json fails (e.g., bad format), catch it here
-        return jsonify({"msg": "Invalid JSON or missing history in request"}), 400
-
-    if not history_from_frontend:
-        return jsonify({"msg": "No history provided"}), 400
-
-    # 2. Call the AI agent with the full conversation history
+        image_bytes, prompt, data = read_image_upload(request)
+        # Downscaled, re-encoded and metadata-free before it goes anywhere near the model
+        image_bytes, mime_type = preprocess_image(image_bytes)
+    except ImageTooLargeError as e:
+        return jsonify({"msg": str(e)}), 413
+    except InvalidImageError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    return _run_ai(user_id, "parse_image", _parse_image_job, image_bytes, prompt, mime_type,
+                   run_async=_wants_async(data) or request.args.get("async") == "1")
+
+def _schedule_event_job(user_id, session_id):
+    store = get_session_store()
+    context = store.context(user_id, session_id)
+    if context is None:
+        return {"msg": "Unknown or expired chat session", "sessionId": session_id}, 404
+    window, summary, accounting = context
+
+    # 2. Call the AI agent with the recent turns and a summary of the older ones
+    usage = {}
     try:
-        ai_response = schedule_event_from_text(history_from_frontend) 
-    except Exception as e:
-        print(f"Error calling AI agent: {e}")
-        return jsonify({
+        ai_response = get_ai_parser().schedule_event_from_text(window, summary, usage)
+    except Exception:
+        log.exception("Error calling AI agent")
+        return {
             "status": "error",
-            "message": "Internal AI communication error."
-        }), 500
-        
+            "message": "Internal AI communication error.",
+            "sessionId": session_id
+        }, 500
+
+    last_user_prompt = next((turn["text"] for turn in reversed(window) if turn["sender"] == "user"),
+                            "AI scheduled event")
+    response, status_code = _schedule_event_result(user_id, ai_response, last_user_prompt)
+    if response.get("message"):
+        store.add_turn(user_id, session_id, "ai", response["message"])
+
+    accounting.update(usage)
+    if not usage.get("cached"):
+        metrics.CHAT_CONTEXT_TOKENS.inc(accounting["contextTokens"], kind="sent")
+        metrics.CHAT_CONTEXT_TOKENS.inc(accounting["savedTokens"], kind="saved")
+    response.update(sessionId=session_id, usage=accounting)
+    return response, status_code
+
+def _schedule_event_result(user_id, ai_response, last_user_prompt):
     # 3. Process AI's response
     if ai_response.get("status") == "success":
         # --- SUCCESS PATH ---
         try:
             new_event = ai_response.get("event")
             new_event["id"] = f"evt-{uuid.uuid4()}"
-            
-            # Get the *last* user prompt for the description
-            # We must use history_from_frontend[-1]['text'] now that we have the array
-            last_user_prompt = history_from_frontend[-1].get("text", "AI scheduled event")
             new_event["description"] = f"Created by AI from prompt: '{last_user_prompt}'"
-            
-            all_events = get_all_events(user_id)
-            all_events.append(new_event)
-            save_all_events_split(user_id, all_events)
-            
-            return jsonify({
-                "status": "success",
-                "message": f"Event '{new_event['title']}' created!",
-                "newEvent": new_event
-            }), 200
 
-        except Exception as e:
-            print(f"Error saving event: {e}")
-            return jsonify({
+            with user_lock(user_id):
+                # Double-booking check against the interval index, not a scan of every event
+                conflicts = find_conflicts(user_id, new_event)
+                response, status_code = create_event(user_id, new_event)
+            if status_code != 201:
+                return {
+                    "status": "error",
+                    "message": response.get("msg", "Could not save the event.")
+                }, status_code
+            new_event = response["event"]
+
+            message = f"Event '{new_event['title']}' created!"
+            if conflicts:
+                first = conflicts[0]
+                message += (f" Heads up: it overlaps with '{first.get('title')}' on {first.get('date')}"
+                            f" at {first.get('startTime')}")
+                if len(conflicts) > 1:
+                    message += f" and {len(conflicts) - 1} other event(s)"
+                message += "."
+
+            return {
+                "status": "success",
+                "message": message,
+                "newEvent": new_event,
+                "conflicts": [_conflict_summary(other) for other in conflicts]
+            }, 200
+
+        except Exception:
+            log.exception("Error saving AI-scheduled event")
+            return {
                 "status": "error",
                 "message": "An error occurred while saving the event to the database."
-            }), 500
+            }, 500
             
     elif ai_response.get("status") == "question":
         # --- QUESTION PATH ---
-        return jsonify({
+        return {
             "status": "question",
             "message": ai_response.get("message")
-        }), 200
+        }, 200
         
     else:
         # --- FALLBACK ERROR ---
-        return jsonify({
+        return {
             "status": "question",
             "message": "Sorry, I had trouble understanding that. Could you rephrase your request?"
-        }), 200
+        }, 200
+
+@app.route("/api/chat/schedule_event", methods=["POST"])
+@jwt_required()
+def handle_schedule_event():
+    """
+    One chat turn. {"sessionId", "message"} continues a session kept on the
+    server; {"history": [{sender, text}, ...]} (or just {"message"}) starts a
+    new one. Every answer carries the sessionId for the next turn; a 404 means
+    the session expired and the client should start over with its history.
+    """
+    user_id = get_jwt_identity()
+    
+    # 1. Get the new message (or the full history, to start a session)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"msg": "Invalid JSON or missing history in request"}), 400
+    session_id = data.get("sessionId")
+    message = data.get("message")
+    history_from_frontend = data.get("history")
+    if message is not None and (not isinstance(message, str) or not message.strip()):
+        return jsonify({"msg": "message must be a non-empty string"}), 400
+
+    store = get_session_store()
+    if session_id:
+        if message is None:
+            return jsonify({"msg": "No message provided"}), 400
+        if not store.add_turn(user_id, str(session_id), "user", message):
+            return jsonify({"msg": "Unknown or expired chat session", "sessionId": session_id}), 404
+    else:
+        if not history_from_frontend and message is not None:
+            history_from_frontend = [{"sender": "user", "text": message}]
+        if not history_from_frontend:
+            return jsonify({"msg": "No history provided"}), 400
+        if not isinstance(history_from_frontend, list) or \
+                not all(isinstance(turn, dict) and isinstance(turn.get("text"), str) for turn in history_from_frontend):
+            return jsonify({"msg": "history must be a list of {sender, text} objects"}), 400
+        session_id = store.create(user_id, history_from_frontend).id
+
+    return _run_ai(user_id, "schedule_event", _schedule_event_job, user_id, str(session_id),
+                   run_async=_wants_async(data))
+
+# --- AI Job Endpoints ---
+
+@app.route("/api/chat/jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def handle_get_ai_job(job_id):
+    """Job status; ?wait=N long-polls up to N seconds (max 30) for the result."""
+    user_id = get_jwt_identity()
+    wait = min(max(request.args.get("wait", 0, type=float), 0), 30)
+    queue = get_job_queue()
+    job = queue.wait(job_id, user_id, wait) if wait else queue.get(job_id, user_id)
+    if job is None:
+        return jsonify({"msg": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route("/api/chat/jobs/<job_id>/stream", methods=["GET"])
+@jwt_required()
+def handle_stream_ai_job(job_id):
+    """Server-sent events: a 'status' event every few seconds, then one 'result' event."""
+    user_id = get_jwt_identity()
+    queue = get_job_queue()
+    if queue.get(job_id, user_id) is None:
+        return jsonify({"msg": "Job not found"}), 404
+
+    def generate():
+        while True:
+            job = queue.wait(job_id, user_id, 5)
+            if job is None:
+                return
+            event = "result" if job["status"] in ("done", "failed") else "status"
+            yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+            if event == "result":
+                return
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/chat/jobs/stats", methods=["GET"])
+@jwt_required()
+def handle_ai_job_stats():
+    return jsonify(get_job_queue().stats()), 200
+
+@app.route("/api/chat/cache/stats", methods=["GET"])
+@jwt_required()
+def handle_ai_cache_stats():
+    return jsonify(get_response_cache().stats()), 200
+
+@app.route("/api/chat/sessions/stats", methods=["GET"])
+@jwt_required()
+def handle_chat_session_stats():
+    return jsonify(get_session_store().stats()), 200
 
 # --- Main Runner ---
 
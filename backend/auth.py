@@ -1,62 +1,48 @@
-import os
-import json
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token
-
-DATA_DIR = "data"
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
+from storage import get_storage
+import metrics
 
 def get_users():
-    """Loads the users.json file."""
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'w') as f:
-            json.dump({}, f)
-        return {}
-    with open(USERS_FILE, 'r') as f:
-        return json.load(f)
+    """Loads the users registry (users.json or the users table)."""
+    return get_storage().get_users()
 
 def save_users(users):
-    """Saves the users dictionary back to the file."""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+    """Saves the users dictionary back to storage."""
+    get_storage().save_users(users)
+
+def _lookup_user(username):
+    """The user record for username (None if unknown), timed for /metrics."""
+    with metrics.USER_LOOKUP_SECONDS.time():
+        return get_storage().get_user(username)
+
+def get_user_id(username):
+    """The user id registered for username, or None."""
+    user = _lookup_user(username)
+    return user["id"] if user is not None else None
 
 def register_user(username, password):
     """Registers a new user."""
-    users = get_users()
-    if username in users:
+    storage = get_storage()
+    if _lookup_user(username) is not None:
         return {"msg": "Username already exists"}, 409
 
-    # Create new user ID
-    user_id = f"user_{len(users) + 1}"
-    users[username] = {
-        "id": user_id,
-        "password_hash": password
-    }
-    save_users(users)
-    
-    # Create user data directory and default files
-    user_data_path = os.path.join(DATA_DIR, user_id)
-    os.makedirs(user_data_path, exist_ok=True)
+    # Ids come from a persistent counter, so concurrent sign-ups never share one
+    user_id = storage.allocate_user_id()
+    if not storage.add_user(username, {"id": user_id, "password_hash": password}):
+        return {"msg": "Username already exists"}, 409
     
-    profile_path = os.path.join(user_data_path, "profile.json")
-    with open(profile_path, 'w') as f:
-        json.dump({"username": username, "photoUrl": ""}, f)
-
-    for year in ["2024", "2025", "2026"]: # Per your spec
-        with open(os.path.join(user_data_path, f"{year}_events.json"), 'w') as ef:
-            json.dump([], ef)
-        with open(os.path.join(user_data_path, f"{year}_tasks.json"), 'w') as tf:
-            json.dump({}, tf)
+    # Create the default profile and empty event/task stores
+    storage.init_user(user_id, username)
             
     return {"msg": "User created successfully", "userId": user_id}, 201
 
 def login_user(username, password):
     """Logs in an existing user."""
-    users = get_users()
-    if username not in users:
+    user_data = _lookup_user(username)
+    if user_data is None:
         return {"msg": "username not found :00"}, 401
 
-    user_data = users[username]
     if user_data["password_hash"] != password:
         return {"msg": "incorrect password brodah"}, 401
     
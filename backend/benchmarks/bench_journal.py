@@ -0,0 +1,108 @@
+"""
+Single-event edit throughput: full year-file rewrite (json) vs. append-only
+journal (journal).
+
+    python backend/benchmarks/bench_journal.py --sizes 500 5000 20000 --edits 300
+
+For each calendar size it builds a throwaway data dir holding one user with that
+many events in one year, then times apply_event_changes() updating a random
+event, the path every PUT /api/events/<id> takes. Bytes written per edit show
+the write amplification. For the journal it also times a cold load (snapshot +
+replay of the un-compacted journal) and one compaction.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import JsonStorage
+from journal_storage import JournalStorage
+
+USER_ID = "user_1"
+
+def build_calendar(data_dir, size):
+    os.makedirs(os.path.join(data_dir, USER_ID))
+    events = [
+        {"id": f"evt-{i}", "title": f"Event {i}", "date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}",
+         "startTime": "09:00", "endTime": "10:00", "recurrenceRule": "NONE", "color": "#3b82f6"}
+        for i in range(size)
+    ]
+    with open(os.path.join(data_dir, USER_ID, "2025_events.json"), "w") as f:
+        json.dump(events, f, indent=4)
+    return events
+
+def run_edits(store, events, edits, rng):
+    """Times edits; returns (samples, event-file bytes written per edit)."""
+    journal = isinstance(store, JournalStorage)
+    path = store.journal_path(USER_ID) if journal else store.user_data_path(USER_ID, "2025", "events")
+    samples = []
+    rewritten = 0
+    for n in range(edits):
+        event = dict(rng.choice(events))
+        event["title"] = f"Edited {n}"
+        start = time.perf_counter()
+        store.apply_event_changes(USER_ID, [event], [])
+        samples.append(time.perf_counter() - start)
+        if not journal:
+            rewritten += os.path.getsize(path)  # the whole year file, every edit
+    # The journal only ever grows by the appended lines
+    written = os.path.getsize(path) if journal else rewritten
+    return samples, written / edits
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "edits_per_sec": len(samples) / sum(samples),
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": samples[int(len(samples) * 0.99) - 1] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 5000, 20000])
+    parser.add_argument("--edits", type=int, default=300, help="timed edits per size and backend")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        row = {"events": size}
+        for name, factory in (("json", JsonStorage),
+                              ("journal", lambda d: JournalStorage(d, compact_ops=args.edits + 1))):
+            with tempfile.TemporaryDirectory() as data_dir:
+                events = build_calendar(data_dir, size)
+                store = factory(data_dir)
+                store.get_all_events(USER_ID)  # initial load, paid once per process
+                samples, bytes_per_edit = run_edits(store, events, args.edits, random.Random(size))
+                row[name] = summarize(samples)
+                row[name]["bytes_per_edit"] = bytes_per_edit
+
+                if name == "journal":
+                    start = time.perf_counter()
+                    JournalStorage(data_dir).get_all_events(USER_ID)
+                    row[name]["cold_load_ms"] = (time.perf_counter() - start) * 1000
+                    start = time.perf_counter()
+                    store.compact(USER_ID)
+                    row[name]["compact_ms"] = (time.perf_counter() - start) * 1000
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'events':>8} {'backend':>8} {'edits/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'bytes/edit':>11} {'cold load ms':>13} {'compact ms':>11}")
+    for row in results:
+        for name in ("json", "journal"):
+            r = row[name]
+            cold = f"{r['cold_load_ms']:.1f}" if "cold_load_ms" in r else "-"
+            compact = f"{r['compact_ms']:.1f}" if "compact_ms" in r else "-"
+            print(f"{row['events']:>8} {name:>8} {r['edits_per_sec']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                  f"{r['bytes_per_edit']:>11.0f} {cold:>13} {compact:>11}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Login latency vs. number of registered users.
+
+    python backend/benchmarks/bench_login.py --sizes 1000 10000 100000 1000000
+
+For each size it builds a throwaway data dir with that many users, then times
+auth.login_user (username lookup + password check + JWT) through the storage's
+in-memory username index. "legacy" is the old path: parse users.json per login.
+
+The "+reg" columns time the same logins while a second JsonStorage (standing in
+for another worker) registers a user every --register-every logins: via the
+users journal, and ("rewrite") the old way of rewriting users.json per sign-up,
+which makes the login worker re-parse the whole file.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager
+import auth
+import storage
+
+def build_users_file(data_dir, size):
+    users = {f"user{i}": {"id": f"user_{i}", "password_hash": f"pw{i}"} for i in range(1, size + 1)}
+    with open(os.path.join(data_dir, "users.json"), "w") as f:
+        json.dump(users, f)
+
+def summarize(samples, prefix=""):
+    samples = sorted(samples)
+    return {
+        f"{prefix}p50_us": statistics.median(samples),
+        f"{prefix}p99_us": samples[max(int(len(samples) * 0.99) - 1, 0)],
+        f"{prefix}mean_us": statistics.fmean(samples),
+    }
+
+def time_calls(fn, usernames, register=None, register_every=0):
+    """Times fn per username; with register, calls register(i) (timed separately) every register_every calls."""
+    samples, register_samples = [], []
+    for i, username in enumerate(usernames):
+        if register is not None and i % register_every == 0:
+            start = time.perf_counter()
+            register(i)
+            register_samples.append((time.perf_counter() - start) * 1e6)
+        start = time.perf_counter()
+        fn(username)
+        samples.append((time.perf_counter() - start) * 1e6)
+    if register is None:
+        return summarize(samples)
+    return {**summarize(samples), **summarize(register_samples, "register_")}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--logins", type=int, default=2000, help="timed logins per size")
+    parser.add_argument("--legacy-max", type=int, default=100000,
+                        help="skip the full-parse baseline above this many users")
+    parser.add_argument("--register-every", type=int, default=10,
+                        help="logins between registrations in the +reg runs")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "benchmark-secret-key-not-for-production"
+    JWTManager(app)
+
+    results = []
+    with app.app_context():
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as data_dir:
+                build_users_file(data_dir, size)
+                json_storage = storage.JsonStorage(data_dir)
+                storage.set_storage(json_storage)
+                json_storage.get_user("user1")  # initial index load, paid once per process
+
+                rng = random.Random(size)
+                usernames = [f"user{rng.randint(1, size)}" for _ in range(args.logins)]
+                login = lambda u: auth.login_user(u, "pw" + u[4:])
+                row = {"users": size}
+                row.update(time_calls(login, usernames))
+
+                # Another worker signs users up while this one serves logins
+                other_worker = storage.JsonStorage(data_dir)
+                def register(i):
+                    other_worker.add_user(f"journal{i}", {"id": f"user_j{i}", "password_hash": "pw"})
+                interleaved = time_calls(login, usernames, register, args.register_every)
+                row.update({f"reg_{key}": value for key, value in interleaved.items()})
+
+                if size <= args.legacy_max:
+                    def register_rewrite(i):
+                        users = other_worker.get_users()
+                        users[f"rewrite{i}"] = {"id": f"user_r{i}", "password_hash": "pw"}
+                        other_worker.save_users(users)
+                    rewrite = time_calls(login, usernames[: max(20, args.logins // 20)],
+                                         register_rewrite, args.register_every)
+                    row["rewrite_reg_p99_us"] = rewrite["p99_us"]
+                    row["rewrite_register_p50_us"] = rewrite["register_p50_us"]
+
+                if size <= args.legacy_max:
+                    def legacy_login(username):
+                        with open(json_storage.users_file) as f:
+                            users = json.load(f)
+                        return users.get(username)
+                    legacy = time_calls(legacy_login, usernames[: max(20, args.logins // 20)])
+                    row["legacy_p50_us"] = legacy["p50_us"]
+                results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'users':>10} {'p50 us':>10} {'p99 us':>10} {'legacy p50 us':>15} "
+          f"{'+reg p50 us':>12} {'+reg p99 us':>12} {'reg p50 us':>11} "
+          f"{'rewrite+reg p99 us':>19} {'rewrite reg p50 us':>19}")
+    for row in results:
+        legacy = f"{row['legacy_p50_us']:.0f}" if "legacy_p50_us" in row else "-"
+        rewrite_p99 = f"{row['rewrite_reg_p99_us']:.0f}" if "rewrite_reg_p99_us" in row else "-"
+        rewrite_reg = f"{row['rewrite_register_p50_us']:.0f}" if "rewrite_register_p50_us" in row else "-"
+        print(f"{row['users']:>10} {row['p50_us']:>10.1f} {row['p99_us']:>10.1f} {legacy:>15} "
+              f"{row['reg_p50_us']:>12.1f} {row['reg_p99_us']:>12.1f} {row['reg_register_p50_us']:>11.0f} "
+              f"{rewrite_p99:>19} {rewrite_reg:>19}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Worker cold-start benchmark: how long a fresh process takes to import app.py
+and to serve its first requests. Each run is a new interpreter, like a worker
+spawned by the autoscaler.
+
+    python backend/benchmarks/bench_startup.py --runs 10
+    python backend/benchmarks/bench_startup.py --runs 5 --chat   # also time the first /api/chat call
+
+Run from the repo root (it logs in as an existing user from data/users.json).
+Prints a summary table, or JSON with --json for comparing across commits.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter
+CHILD = r"""
+import sys, json, time
+start = time.perf_counter()
+sys.path.insert(0, BACKEND_DIR)
+import app as app_module
+imported = time.perf_counter()
+
+client = app_module.app.test_client()
+login = client.post("/api/login", json={"username": USERNAME, "password": PASSWORD})
+headers = {"Authorization": "Bearer " + login.get_json().get("access_token", "")}
+first_login = time.perf_counter()
+client.get("/api/events/all", headers=headers)
+first_events = time.perf_counter()
+
+result = {
+    "import_ms": (imported - start) * 1000,
+    "first_login_ms": (first_login - imported) * 1000,
+    "first_events_ms": (first_events - first_login) * 1000,
+    "litellm_loaded_at_startup": "litellm" in sys.modules,
+}
+if CHAT:
+    client.post("/api/chat/schedule_event", json={"history": [{"sender": "user", "text": "hi"}]}, headers=headers)
+    result["first_chat_ms"] = (time.perf_counter() - first_events) * 1000
+print(json.dumps(result))
+"""
+
+def run_once(username, password, chat):
+    code = (f"BACKEND_DIR = {BACKEND_DIR!r}\nUSERNAME = {username!r}\nPASSWORD = {password!r}\n"
+            f"CHAT = {chat!r}\n" + CHILD)
+    env = dict(os.environ)
+    env.pop("AI_PREWARM", None)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--username", default="amelia")
+    parser.add_argument("--password", default="237Patterning*")
+    parser.add_argument("--chat", action="store_true", help="also time the first chat request (loads litellm)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    runs = [run_once(args.username, args.password, args.chat) for _ in range(args.runs)]
+    metrics = [key for key in runs[0] if key.endswith("_ms")]
+    summary = {
+        key: {"median": statistics.median(r[key] for r in runs), "max": max(r[key] for r in runs)}
+        for key in metrics
+    }
+    summary["litellm_loaded_at_startup"] = any(r["litellm_loaded_at_startup"] for r in runs)
+    summary["runs"] = args.runs
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    for key in metrics:
+        print(f"{key:>18}: median {summary[key]['median']:8.1f} ms   max {summary[key]['max']:8.1f} ms")
+    print(f"litellm imported at startup: {summary['litellm_loaded_at_startup']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Peak memory of GET /api/events/all and GET /api/events?start&end vs. calendar size,
+buffered (the whole body built in memory, like jsonify) vs. streamed.
+
+    python backend/benchmarks/bench_streaming.py --sizes 1000 10000 50000 100000
+
+For each size it builds a throwaway data dir with one user whose events are
+spread over month shards (with some weekly series and their exceptions), then
+runs each request in a fresh interpreter and reports how far the request
+raised the process's peak RSS above where it stood just before. "buffered" is
+STREAM_MIN_BYTES set past any body size, so nothing streams.
+
+The parsed-events cache is turned off in the child (EVENT_CACHE_MAX_BYTES=0)
+so the numbers are the request's own memory; pass --cache to leave it on.
+Needs /proc (Linux) or the resource module (macOS).
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from storage import JsonStorage, atomic_write_json
+
+USER_ID = "user_1"
+
+# Runs inside the child interpreter
+CHILD = r"""
+import sys, json, resource
+sys.path.insert(0, BACKEND_DIR)
+import app as app_module
+
+def peak_kb():
+    try:
+        # Linux: this process image's own high-water mark (ru_maxrss carries the parent's over exec)
+        with open("/proc/self/status") as f:
+            return int(f.read().split("VmHWM:")[1].split()[0])
+    except (OSError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KB elsewhere
+
+client = app_module.app.test_client()
+login = client.post("/api/login", json={"username": "bench", "password": "bench"})
+headers = {"Authorization": "Bearer " + login.get_json()["access_token"]}
+client.get("/api/tasks/2025", headers=headers)  # warm up routing, JWT, storage
+before = peak_kb()
+response = client.get(PATH, headers=headers, buffered=False)
+size = 0
+for chunk in response.response:
+    size += len(chunk)
+response.close()
+print(json.dumps({"peak_kb": peak_kb() - before, "body_bytes": size, "streamed": "Content-Length" not in response.headers}))
+"""
+
+def build_calendar(data_dir, size, rng):
+    user_dir = os.path.join(data_dir, "data", USER_ID)
+    os.makedirs(user_dir)
+    with open(os.path.join(data_dir, "data", "users.json"), "w") as f:
+        json.dump({"bench": {"id": USER_ID, "password_hash": "bench"}}, f)
+    with open(os.path.join(user_dir, "profile.json"), "w") as f:
+        json.dump({"username": "bench", "photoUrl": ""}, f)
+
+    shards = {}
+    series = max(1, size // 100)
+    for i in range(size):
+        year, month, day = 2024 + i % 3, 1 + rng.randrange(12), 1 + rng.randrange(28)
+        event = {"id": f"evt-{i}", "title": f"Event {i}", "description": "x" * rng.randrange(40, 200),
+                 "date": f"{year}-{month:02d}-{day:02d}", "startTime": "09:00", "endTime": "10:00",
+                 "recurrenceRule": "NONE", "color": "#3b82f6"}
+        if i < series:
+            event.update(recurrenceId=f"rec-{i}", isBaseEvent=True, recurrenceRule="FREQ=WEEKLY")
+        elif i < series * 3:
+            # An exception of one of the series, at its own date
+            event.update(recurrenceId=f"rec-{i % series}", originalDate=event["date"], isException=True)
+        shards.setdefault(event["date"][:7], []).append(event)
+    for key, events in shards.items():
+        with open(os.path.join(user_dir, f"{key}_events.json"), "w") as f:
+            json.dump(events, f)
+    # The manifest the first write would have created, so reads don't rebuild it
+    store = JsonStorage(os.path.join(data_dir, "data"))
+    atomic_write_json(store.manifest_path(USER_ID), store._build_manifest(USER_ID))
+
+def measure(data_dir, path, streamed, cache):
+    env = dict(os.environ, STORAGE_BACKEND="json")
+    if not streamed:
+        env["STREAM_MIN_BYTES"] = str(1 << 62)
+    if not cache:
+        env["EVENT_CACHE_MAX_BYTES"] = "0"
+    code = CHILD.replace("BACKEND_DIR", repr(BACKEND_DIR)).replace("PATH", repr(path))
+    out = subprocess.run([sys.executable, "-c", code], cwd=data_dir, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000, 100000])
+    parser.add_argument("--cache", action="store_true", help="leave the parsed-events cache on in the child")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    endpoints = {"all": "/api/events/all", "range": "/api/events?start=2024-01-01&end=2026-12-31"}
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            build_calendar(data_dir, size, random.Random(size))
+            for name, path in endpoints.items():
+                row = {"events": size, "endpoint": name}
+                for mode in ("buffered", "streamed"):
+                    result = measure(data_dir, path, mode == "streamed", args.cache)
+                    row[f"{mode}_peak_kb"] = result["peak_kb"]
+                    row["body_bytes"] = result["body_bytes"]
+                results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'events':>8} {'endpoint':>9} {'body KB':>9} {'buffered peak KB':>17} {'streamed peak KB':>17}")
+    for row in results:
+        print(f"{row['events']:>8} {row['endpoint']:>9} {row['body_bytes'] // 1024:>9} "
+              f"{row['buffered_peak_kb']:>17} {row['streamed_peak_kb']:>17}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Backend benchmark suite: storage reads and writes, login, and the Flask
+endpoints through the test client, on synthetic data (see generate_data.py).
+
+    python backend/benchmarks/bench_suite.py --output before.json
+    ... change something ...
+    python backend/benchmarks/bench_suite.py --output after.json --compare before.json
+
+Every case is timed per call after a short warm-up and reported as
+throughput plus latency percentiles. --output writes the results as JSON
+(with the git commit and parameters) for comparing across commits; --compare
+prints each case's change against an earlier results file.
+
+litellm is replaced by a stub that answers instantly, so the chat cases
+measure our side of /api/chat/schedule_event (session windowing, prompt
+building, response cache, conflict check, event creation), never the network.
+Each call sends a different conversation, so the AI response cache always misses.
+"""
+import os
+import sys
+import json
+import time
+import types
+import contextlib
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import date
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def _stub_litellm():
+    """A litellm module whose completion() returns a fixed event, installed before ai_parser imports it."""
+    def completion(model=None, messages=None, **kwargs):
+        content = json.dumps({"status": "success", "event": {
+            "title": "Stubbed meeting", "date": "2025-06-02", "startTime": "10:00", "endTime": "11:00",
+            "recurrenceRule": "NONE",
+        }})
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    stub = types.ModuleType("litellm")
+    stub.completion = completion
+    sys.modules["litellm"] = stub
+
+_stub_litellm()
+
+import storage
+import auth
+import event_manager
+import app as app_module
+from generate_data import generate
+
+def time_case(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": iterations / sum(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[max(0, int(iterations * 0.95) - 1)] * 1000,
+        "p99_ms": samples[max(0, int(iterations * 0.99) - 1)] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+def make_storage(backend, data_dir):
+    if backend == "sqlite":
+        from sqlite_storage import SqliteStorage
+        from migrate_to_sqlite import migrate
+        db_path = os.path.join(data_dir, "calendar.db")
+        migrate(data_dir, db_path)
+        return lambda: SqliteStorage(db_path)
+    if backend == "journal":
+        from journal_storage import JournalStorage
+        return lambda: JournalStorage(data_dir)
+    return lambda: storage.JsonStorage(data_dir)
+
+def build_cases(new_storage, username, password, user_id):
+    """[(name, fn)] in run order. Write cases come after the reads they would disturb."""
+    client = app_module.app.test_client()
+    token = client.post("/api/login", json={"username": username, "password": password}).get_json()["access_token"]
+    headers = {"Authorization": "Bearer " + token}
+    etag = client.get("/api/events/all", headers=headers).headers["ETag"]
+    events = event_manager.get_all_events(user_id)
+    single = next(event for event in events if not event.get("recurrenceId"))
+    counter = {"n": 0}
+
+    def cold_get_all_events():
+        # A fresh storage: nothing parsed or cached yet
+        new_storage().get_all_events(user_id)
+
+    def save_unchanged():
+        event_manager.save_all_events_split(user_id, event_manager.get_all_events(user_id))
+
+    def save_one_changed():
+        counter["n"] += 1
+        changed = [dict(event, title=f"Edited {counter['n']}") if event.get("id") == single["id"] else event
+                   for event in event_manager.get_all_events(user_id)]
+        event_manager.save_all_events_split(user_id, changed)
+
+    def login():
+        with app_module.app.app_context():
+            auth.login_user(username, password)
+
+    def post_event():
+        client.post("/api/events", headers=headers, json={
+            "title": "Bench", "date": "2025-03-04", "startTime": "09:00", "endTime": "09:30"})
+
+    def put_event():
+        counter["n"] += 1
+        client.put(f"/api/events/{single['id']}", headers=headers, json={"title": f"Put {counter['n']}"})
+
+    def post_tasks():
+        counter["n"] += 1
+        client.post("/api/tasks/2025", headers=headers, json={"2025-01-01": [{"id": "t", "title": str(counter["n"])}]})
+
+    def schedule_event():
+        counter["n"] += 1
+        client.post("/api/chat/schedule_event", headers=headers, json={
+            "history": [{"sender": "user", "text": f"Meeting with Sam #{counter['n']} on June 2 at 10"}]})
+
+    # One long conversation: every call is another turn, so the context window stays full
+    session = {}
+
+    def schedule_event_turn():
+        counter["n"] += 1
+        text = f"Actually make it {counter['n'] % 12 + 1} o'clock, and bring the notes from last week"
+        body = {"sessionId": session["id"], "message": text} if session else {"history": [{"sender": "user", "text": text}]}
+        session["id"] = client.post("/api/chat/schedule_event", headers=headers, json=body).get_json()["sessionId"]
+
+    return [
+        ("storage.get_all_events (warm)", lambda: storage.get_storage().get_all_events(user_id)),
+        ("storage.get_all_events (cold)", cold_get_all_events),
+        ("event_manager.get_events_in_range (month)",
+         lambda: event_manager.get_events_in_range(user_id, date(2025, 3, 1), date(2025, 3, 31))),
+        ("auth.login_user", login),
+        ("GET /api/events/all", lambda: client.get("/api/events/all", headers=headers)),
+        ("GET /api/events/all (304)",
+         lambda: client.get("/api/events/all", headers={**headers, "If-None-Match": etag})),
+        ("GET /api/events?start&end (month)",
+         lambda: client.get("/api/events?start=2025-03-01&end=2025-03-31", headers=headers)),
+        ("GET /api/events/search?q=", lambda: client.get("/api/events/search?q=lect", headers=headers)),
+        ("event_manager.search_events (selective)", lambda: event_manager.search_events(user_id, "study group 12")),
+        ("GET /api/tasks/2025", lambda: client.get("/api/tasks/2025", headers=headers)),
+        ("POST /api/login", lambda: client.post("/api/login", json={"username": username, "password": password})),
+        ("event_manager.save_all_events_split (unchanged)", save_unchanged),
+        ("event_manager.save_all_events_split (one changed)", save_one_changed),
+        ("POST /api/events", post_event),
+        ("PUT /api/events/<id>", put_event),
+        ("POST /api/tasks/2025", post_tasks),
+        ("POST /api/chat/schedule_event (stubbed litellm)", schedule_event),
+        ("POST /api/chat/schedule_event (session turn)", schedule_event_turn),
+    ]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    before = {row["name"]: row for row in (baseline or {}).get("results", [])}
+    header = f"{'case':<52} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    if before:
+        header += f" {'ops/s vs base':>14} {'p50 vs base':>12}"
+    print(header)
+    for row in results:
+        line = (f"{row['name']:<52} {row['ops_per_sec']:>10.1f} {row['p50_ms']:>9.3f} "
+                f"{row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+        old = before.get(row["name"])
+        if old:
+            line += (f" {(row['ops_per_sec'] / old['ops_per_sec'] - 1) * 100:>+13.1f}%"
+                     f" {(row['p50_ms'] / old['p50_ms'] - 1) * 100:>+11.1f}%")
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="json", choices=["json", "journal", "sqlite"])
+    parser.add_argument("--singles", type=int, default=2000, help="single events in the benchmark user")
+    parser.add_argument("--series", type=int, default=100, help="recurring series in the benchmark user")
+    parser.add_argument("--exceptions", type=int, default=3, help="moved instances per series")
+    parser.add_argument("--ghosts", type=int, default=2, help="deleted instances per series")
+    parser.add_argument("--tasks", type=int, default=50, help="tasks per year")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per case")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed calls per case")
+    parser.add_argument("--only", nargs="+", help="run only cases whose name contains one of these")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier --output file to compare against")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # Whatever the code under test prints goes to stderr, keeping stdout for the results
+    with tempfile.TemporaryDirectory() as data_dir, contextlib.redirect_stdout(sys.stderr):
+        username, password, user_id = generate(
+            data_dir, users=1, singles=args.singles, series=args.series, exceptions=args.exceptions,
+            ghosts=args.ghosts, tasks=args.tasks)[0]
+        new_storage = make_storage(args.backend, data_dir)
+        storage.set_storage(new_storage())
+
+        results = []
+        for name, fn in build_cases(new_storage, username, password, user_id):
+            if args.only and not any(part in name for part in args.only):
+                continue
+            results.append({"name": name, **time_case(fn, args.iterations, args.warmup)})
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "json")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Synthetic data for benchmarks: users with configurable numbers of single
+events, recurring series, exceptions, ghosts and tasks, written in the JSON
+backend's layout (users.json, <user>/profile.json, <user>/<year>_events.json,
+<user>/<year>_tasks.json).
+
+    python backend/benchmarks/generate_data.py --data-dir /tmp/bench-data --users 10 \
+        --singles 2000 --series 100 --exceptions 3 --ghosts 2 --tasks 50
+
+Counts are per user; --exceptions and --ghosts are per series, --tasks per
+year. Users are bench1..benchN with password "<username>-pw". The same
+--seed always produces the same data.
+"""
+import os
+import sys
+import random
+import argparse
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import atomic_write_json, event_year
+from recurrence import parse_rrule, occurrences
+
+RULES = [
+    "FREQ=WEEKLY",
+    "FREQ=WEEKLY;BYDAY=MO,WE,FR",
+    "FREQ=WEEKLY;INTERVAL=2;BYDAY=TU",
+    "FREQ=DAILY;COUNT=30",
+    "FREQ=MONTHLY",
+    "FREQ=MONTHLY;BYDAY=1MO",
+    "FREQ=YEARLY",
+]
+COLORS = ["#3b82f6", "#ef4444", "#10b981", "#f59e0b", "#8b5cf6"]
+TITLES = ["Standup", "Lecture", "Gym", "Dentist", "1:1", "Lunch", "Review", "Lab", "Call", "Study group"]
+
+def _random_date(rng, years):
+    year = int(rng.choice(years))
+    return date(year, 1, 1) + timedelta(days=rng.randrange(365))
+
+def _timed(rng, event):
+    hour = rng.randrange(7, 20)
+    event["startTime"] = f"{hour:02d}:{rng.choice(['00', '15', '30', '45'])}"
+    event["endTime"] = f"{hour + 1:02d}:00"
+    return event
+
+def generate_events(rng, years, singles, series, exceptions, ghosts, prefix=""):
+    """One user's raw events: singles, then each series' base, exceptions and ghosts."""
+    events = []
+    for i in range(singles):
+        events.append(_timed(rng, {
+            "id": f"evt-{prefix}s{i}",
+            "title": f"{rng.choice(TITLES)} {i}",
+            "date": _random_date(rng, years).isoformat(),
+            "description": "x" * rng.randrange(0, 120),
+            "color": rng.choice(COLORS),
+            "recurrenceRule": "NONE",
+        }))
+
+    for i in range(series):
+        recurrence_id = f"rec-{prefix}{i}"
+        rule_str = rng.choice(RULES)
+        base = _timed(rng, {
+            "id": f"evt-{prefix}b{i}",
+            "title": f"{rng.choice(TITLES)} (series {i})",
+            "date": _random_date(rng, years).isoformat(),
+            "color": rng.choice(COLORS),
+            "recurrenceRule": rule_str,
+            "recurrenceId": recurrence_id,
+            "isBaseEvent": True,
+        })
+        events.append(base)
+
+        # Exceptions and ghosts sit on real occurrence dates of the series
+        dtstart = date.fromisoformat(base["date"])
+        dates = occurrences(parse_rrule(rule_str), dtstart, dtstart, date(int(max(years)), 12, 31))
+        picked = rng.sample(dates[1:], max(0, min(len(dates) - 1, exceptions + ghosts)))
+        for n, original in enumerate(picked):
+            original = original.isoformat()
+            if n < exceptions:
+                moved = date.fromisoformat(original) + timedelta(days=rng.choice([0, 0, 1, -1]))
+                events.append(_timed(rng, {
+                    **base,
+                    "id": f"evt-{prefix}x{i}-{n}",
+                    "title": base["title"] + " (moved)",
+                    "date": moved.isoformat(),
+                    "originalDate": original,
+                    "isBaseEvent": False,
+                    "isException": True,
+                }))
+            else:
+                events.append({
+                    "id": f"evt-{prefix}g{i}-{n}",
+                    "recurrenceId": recurrence_id,
+                    "originalDate": original,
+                    "isDeleted": True,
+                    "isBaseEvent": False,
+                })
+    return events
+
+def generate_tasks(rng, year, count):
+    """{date: [tasks]} for one year."""
+    tasks = {}
+    for i in range(count):
+        day = (date(int(year), 1, 1) + timedelta(days=rng.randrange(365))).isoformat()
+        tasks.setdefault(day, []).append({"id": f"task-{year}-{i}", "title": f"Task {i}", "completed": rng.random() < 0.3})
+    return tasks
+
+def generate(data_dir, users=1, singles=1000, series=50, exceptions=3, ghosts=2, tasks=20,
+             years=("2024", "2025", "2026"), seed=0):
+    """Writes the data dir; returns [(username, password, user_id)]."""
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    registry = {}
+    accounts = []
+    for n in range(1, users + 1):
+        username, user_id = f"bench{n}", f"user_{n}"
+        registry[username] = {"id": user_id, "password_hash": f"{username}-pw"}
+        accounts.append((username, f"{username}-pw", user_id))
+
+        user_dir = os.path.join(data_dir, user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        atomic_write_json(os.path.join(user_dir, "profile.json"), {"username": username, "photoUrl": ""})
+        by_year = {year: [] for year in years}
+        for event in generate_events(rng, years, singles, series, exceptions, ghosts, prefix=f"{n}-"):
+            by_year.setdefault(event_year(event), []).append(event)
+        for year, events in by_year.items():
+            atomic_write_json(os.path.join(user_dir, f"{year}_events.json"), events)
+        for year in years:
+            atomic_write_json(os.path.join(user_dir, f"{year}_tasks.json"), generate_tasks(rng, year, tasks))
+
+    atomic_write_json(os.path.join(data_dir, "users.json"), registry)
+    atomic_write_json(os.path.join(data_dir, "user_seq.json"), {"last_id": users})
+    return accounts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", required=True, help="directory to write (use a scratch dir, not data/)")
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--singles", type=int, default=1000, help="single events per user")
+    parser.add_argument("--series", type=int, default=50, help="recurring series per user")
+    parser.add_argument("--exceptions", type=int, default=3, help="moved instances per series")
+    parser.add_argument("--ghosts", type=int, default=2, help="deleted instances per series")
+    parser.add_argument("--tasks", type=int, default=20, help="tasks per user per year")
+    parser.add_argument("--years", nargs="+", default=["2024", "2025", "2026"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    accounts = generate(args.data_dir, args.users, args.singles, args.series, args.exceptions,
+                        args.ghosts, args.tasks, args.years, args.seed)
+    print(f"Wrote {len(accounts)} users to {args.data_dir}")
+
+if __name__ == "__main__":
+    main()
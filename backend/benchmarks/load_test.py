@@ -0,0 +1,203 @@
+"""
+Multi-worker load test: correctness and throughput of concurrent writes under
+N gunicorn workers.
+
+    pip install gunicorn
+    python backend/benchmarks/load_test.py --workers 1 2 4 8 --clients 16 --ops 50
+    python backend/benchmarks/load_test.py --url http://127.0.0.1:5000   # an already running server
+
+For each worker count it starts gunicorn on a throwaway data dir, registers
+one user and has --clients threads hammer that same user with a mix of:
+
+  - POST /api/events (a new event each time), and
+  - read-increment-write of a counter in /api/tasks/<year>, sent with
+    If-Match; a 412 means another client got there first, so it re-reads
+    and retries.
+
+Afterwards every create must be in /api/events/all and the counter must
+equal the number of successful increments; any lost write shows up as a
+FAIL. Throughput is completed ops per second (412 retries not counted).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TASKS_YEAR = 2030
+
+class Client:
+    """One keep-alive connection, like a browser tab."""
+
+    def __init__(self, url, token=None):
+        parsed = urllib.parse.urlsplit(url)
+        self.conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+        self.token = token
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = "Bearer " + self.token
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        self.conn.request(method, path, body, headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        return response.status, response.headers, json.loads(data) if data else None
+
+    def close(self):
+        self.conn.close()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_gunicorn(data_dir, workers, threads, backend):
+    port = free_port()
+    env = dict(os.environ, STORAGE_BACKEND=backend)
+    # --chdir: the app's data/ directory is relative to the working directory
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+         "-b", f"127.0.0.1:{port}", "--chdir", data_dir, "--pythonpath", BACKEND_DIR,
+         "--log-level", "warning", "app:app"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start listening within 60s")
+
+def login(url):
+    client = Client(url)
+    username, password = f"load{time.time_ns()}", "load-test"
+    client.request("POST", "/api/register", {"username": username, "password": password})
+    status, _, body = client.request("POST", "/api/login", {"username": username, "password": password})
+    client.close()
+    if status != 200:
+        raise RuntimeError(f"login failed: {status} {body}")
+    return body["access_token"]
+
+def run_client(url, token, index, ops):
+    """Returns (created, incremented, conflicts, errors, latencies)."""
+    client = Client(url, token)
+    created = incremented = conflicts = errors = 0
+    latencies = []
+    try:
+        for n in range(ops):
+            start = time.perf_counter()
+            if n % 2 == 0:
+                status, _, _ = client.request("POST", "/api/events", {
+                    "title": f"load {index}-{n}", "date": f"{TASKS_YEAR}-03-{1 + n % 28:02d}",
+                    "startTime": "09:00", "endTime": "10:00", "recurrenceRule": "NONE",
+                })
+                if status == 201:
+                    created += 1
+                else:
+                    errors += 1
+            else:
+                while True:
+                    _, headers, tasks = client.request("GET", f"/api/tasks/{TASKS_YEAR}")
+                    counter = (tasks or {}).get("counter", 0)
+                    status, _, _ = client.request("POST", f"/api/tasks/{TASKS_YEAR}", {"counter": counter + 1},
+                                                  {"If-Match": headers.get("ETag", "")})
+                    if status != 412:
+                        break
+                    conflicts += 1
+                if status == 200:
+                    incremented += 1
+                else:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+    finally:
+        client.close()
+    return created, incremented, conflicts, errors, latencies
+
+def run_load(url, clients, ops):
+    token = login(url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda index: run_client(url, token, index, ops), range(clients)))
+    elapsed = time.perf_counter() - start
+
+    created = sum(r[0] for r in results)
+    incremented = sum(r[1] for r in results)
+    latencies = sorted(latency for r in results for latency in r[4])
+
+    checker = Client(url, token)
+    _, _, events = checker.request("GET", "/api/events/all")
+    _, _, tasks = checker.request("GET", f"/api/tasks/{TASKS_YEAR}")
+    checker.close()
+    stored_events = len(events or [])
+    stored_counter = (tasks or {}).get("counter", 0)
+    return {
+        "ops": created + incremented,
+        "ops_per_sec": (created + incremented) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000,
+        "conflicts_412": sum(r[2] for r in results),
+        "errors": sum(r[3] for r in results),
+        "created": created,
+        "stored_events": stored_events,
+        "incremented": incremented,
+        "stored_counter": stored_counter,
+        "correct": stored_events == created and stored_counter == incremented,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="gunicorn worker counts")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--ops", type=int, default=50, help="ops per client")
+    parser.add_argument("--backend", default="json", choices=["json", "journal", "sqlite"])
+    parser.add_argument("--url", help="load this running server instead of starting gunicorn")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    if args.url:
+        results.append({"workers": "-", **run_load(args.url, args.clients, args.ops)})
+    else:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            sys.exit("gunicorn is not installed (pip install gunicorn), or pass --url")
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as data_dir:
+                os.makedirs(os.path.join(data_dir, "data"))
+                process, url = start_gunicorn(data_dir, workers, args.threads, args.backend)
+                try:
+                    results.append({"workers": workers, **run_load(url, args.clients, args.ops)})
+                finally:
+                    process.terminate()
+                    process.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'workers':>8} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'412s':>6} {'errors':>7} {'events':>13} {'counter':>13} {'result':>7}")
+    for row in results:
+        print(f"{row['workers']:>8} {row['ops_per_sec']:>8.0f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+              f"{row['conflicts_412']:>6} {row['errors']:>7} {row['stored_events']:>6}/{row['created']:<6} "
+              f"{row['stored_counter']:>6}/{row['incremented']:<6} {'ok' if row['correct'] else 'FAIL':>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import threading
+
+# Per-user change log behind GET /api/changes. Each write appends entries like
+#   {"seq": 12, "type": "event", "op": "update", "id": "evt-...", "data": {...}}
+#   {"seq": 13, "type": "event", "op": "delete", "id": "evt-...", "data": None}
+#   {"seq": 14, "type": "tasks", "op": "update", "id": "2025", "data": {...}}
+# "data" is always the full new state, so clients can treat create and update
+# alike (upsert) and only the latest entry per (type, id) ever matters.
+
+# Entries kept per user. Past this the log is folded to one entry per
+# (type, id), then the oldest are dropped and clients behind them must resync.
+CHANGE_LOG_MAX = int(os.getenv("CHANGE_LOG_MAX", 1000))
+# How often (in seqs) a writer checks whether the log needs compacting
+CHANGE_LOG_COMPACT_EVERY = 100
+# Long-poll re-check interval, so writes made by other worker processes are seen too
+CHANGE_POLL_INTERVAL = 1.0
+
+def event_changes(old_events, new_events):
+    """
+    Create/update/delete entries (without seq) turning old_events into new_events.
+    Events without an id can't be addressed by a client and are left out.
+    """
+    old_by_id = {e["id"]: e for e in old_events if isinstance(e, dict) and e.get("id")}
+    new_by_id = {e["id"]: e for e in new_events if isinstance(e, dict) and e.get("id")}
+    entries = []
+    for event_id, event in new_by_id.items():
+        old = old_by_id.get(event_id)
+        if old is None:
+            entries.append({"type": "event", "op": "create", "id": event_id, "data": event})
+        elif old != event:
+            entries.append({"type": "event", "op": "update", "id": event_id, "data": event})
+    for event_id in old_by_id:
+        if event_id not in new_by_id:
+            entries.append({"type": "event", "op": "delete", "id": event_id, "data": None})
+    return entries
+
+def tasks_change(year, tasks_data):
+    return {"type": "tasks", "op": "update", "id": str(year), "data": tasks_data}
+
+def fold(entries):
+    """Keeps only the latest entry per (type, id), in seq order."""
+    latest = {}
+    for entry in entries:
+        latest[(entry["type"], entry["id"])] = entry
+    return sorted(latest.values(), key=lambda entry: entry["seq"])
+
+def compact(entries, floor, max_entries=CHANGE_LOG_MAX):
+    """
+    Returns (entries, floor) bounded to max_entries. Folding never loses
+    anything a client needs; dropping old entries raises the floor, and any
+    cursor below the floor gets a resync instead of a partial delta.
+    """
+    if len(entries) <= max_entries:
+        return entries, floor
+    entries = fold(entries)
+    if len(entries) > max_entries:
+        # Leave headroom so the next compaction isn't one write away
+        keep = max_entries // 2
+        floor = max(floor, entries[-keep - 1]["seq"])
+        entries = entries[-keep:]
+    return entries, floor
+
+def select(entries, since, cursor, floor):
+    """Response body for ?since=: the folded delta, or a resync marker."""
+    if since < floor or since > cursor:
+        return {"cursor": cursor, "resync": True, "changes": []}
+    return {"cursor": cursor, "resync": False,
+            "changes": fold([entry for entry in entries if entry["seq"] > since])}
+
+# --- Long-poll wakeups (process-local) ---
+
+_cond = threading.Condition()
+_generation = {}  # user_id -> number of notify() calls
+
+def notify(user_id):
+    """Wakes this process's long-polls for user_id; called after each append."""
+    with _cond:
+        _generation[user_id] = _generation.get(user_id, 0) + 1
+        _cond.notify_all()
+
+def generation(user_id):
+    with _cond:
+        return _generation.get(user_id, 0)
+
+def wait(user_id, seen_generation, timeout):
+    """Blocks until notify(user_id) is called after seen_generation, or timeout passes."""
+    with _cond:
+        _cond.wait_for(lambda: _generation.get(user_id, 0) != seen_generation, timeout)
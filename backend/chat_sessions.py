@@ -0,0 +1,279 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from locks import file_lock
+from storage import DATA_DIR, atomic_write_json
+
+# Server-side state for the scheduling chat, so a turn posts just the new
+# message instead of the whole history. What the model sees is bounded: the
+# newest turns that fit CHAT_CONTEXT_TOKENS, plus a short extractive summary of
+# the turns that no longer fit. Turns only ever move from the window into the
+# summary, so consecutive requests share a stable prefix.
+#
+# Sessions are kept as one file each under CHAT_SESSION_DIR, so the next turn
+# can land on any worker process. Set it to "" to keep them in this process's
+# memory instead, which is only correct with a single worker process. A request
+# for an unknown or expired session gets a 404, and the client starts a new one
+# by re-sending its history.
+CHAT_SESSION_DIR = os.getenv("CHAT_SESSION_DIR", os.path.join(DATA_DIR, "chat_sessions"))
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", 6 * 3600))
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", 1000))
+# Token budgets (estimated, see estimate_tokens) for the verbatim turns and the summary
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 1500))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", 300))
+# Longest excerpt of a single turn kept in the summary
+SUMMARY_LINE_CHARS = 160
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Sessions sharing a lock file (by the first hex digits of their id)
+SESSION_LOCK_STRIPES = 256
+
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+def estimate_tokens(text):
+    """Rough token count: ~4 characters per token, which is close enough for budgeting."""
+    return (len(text) + 3) // 4 if text else 0
+
+def turn_tokens(turn):
+    return estimate_tokens(turn["text"]) + MESSAGE_OVERHEAD_TOKENS
+
+def _summary_line(turn):
+    text = " ".join(str(turn["text"]).split())
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 3].rstrip() + "..."
+    return f"{'Assistant' if turn['sender'] == 'ai' else 'User'}: {text}"
+
+class ChatSession:
+    """One conversation: its turns ({sender, text}) and the summary of folded ones. Guarded by the store's lock."""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.turns = []          # every turn, oldest first
+        self.folded = 0          # turns[:folded] are represented only by summary_lines
+        self.summary_lines = []
+        self.expires = 0
+
+    def to_dict(self):
+        return {"turns": self.turns, "folded": self.folded,
+                "summaryLines": self.summary_lines, "expires": self.expires}
+
+    @classmethod
+    def from_dict(cls, session_id, data):
+        session = cls(session_id)
+        session.turns = data["turns"]
+        session.folded = data["folded"]
+        session.summary_lines = data["summaryLines"]
+        session.expires = data["expires"]
+        return session
+
+    def append(self, sender, text):
+        self.turns.append({"sender": "ai" if sender == "ai" else "user", "text": str(text)})
+
+    def context(self):
+        """
+        (window, summary, accounting) for the next model call. The window is the
+        newest turns within CHAT_CONTEXT_TOKENS (always at least the last one);
+        older turns are folded into the summary for good.
+        """
+        budget = CHAT_CONTEXT_TOKENS
+        start = len(self.turns)
+        while start > self.folded:
+            cost = turn_tokens(self.turns[start - 1])
+            if cost > budget and start < len(self.turns):
+                break
+            budget -= cost
+            start -= 1
+        for turn in self.turns[self.folded:start]:
+            self._fold(turn)
+        self.folded = start
+
+        window = [dict(turn) for turn in self.turns[start:]]
+        summary = "\n".join(self.summary_lines) if self.summary_lines else None
+        window_tokens = sum(turn_tokens(turn) for turn in window)
+        summary_tokens = estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS if summary else 0
+        history_tokens = sum(turn_tokens(turn) for turn in self.turns)
+        accounting = {
+            "turns": len(self.turns),
+            "windowTurns": len(window),
+            "summarizedTurns": self.folded,
+            "historyTokens": history_tokens,
+            "contextTokens": window_tokens + summary_tokens,
+            "savedTokens": max(history_tokens - window_tokens - summary_tokens, 0),
+        }
+        return window, summary, accounting
+
+    def _fold(self, turn):
+        self.summary_lines.append(_summary_line(turn))
+        # Over budget: drop the oldest lines, but keep the first, which is usually the request itself
+        while len(self.summary_lines) > 2 and \
+                sum(estimate_tokens(line) + 1 for line in self.summary_lines) > CHAT_SUMMARY_TOKENS:
+            del self.summary_lines[1]
+
+class SessionStore:
+    """
+    (user_id, session_id) -> ChatSession, with a sliding TTL. In memory, the
+    least recently used sessions are evicted past max_sessions; with a
+    directory, every access reads and rewrites the session's file under a
+    lock, and files are pruned by TTL (then oldest first past max_sessions).
+    """
+
+    def __init__(self, ttl=CHAT_SESSION_TTL, max_sessions=CHAT_SESSION_MAX, directory=CHAT_SESSION_DIR):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.directory = directory or None
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "expired": 0, "evictions": 0}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def create(self, user_id, history=()):
+        """A new session, seeded with the given {sender, text} turns."""
+        session = ChatSession(uuid.uuid4().hex)
+        for turn in history:
+            session.append(turn.get("sender"), turn.get("text", ""))
+        session.expires = time.time() + self.ttl
+        if self.directory:
+            self._write(user_id, session)
+        with self._lock:
+            self._stats["created"] += 1
+            if self.directory:
+                prune = self._stats["created"] % 50 == 0
+            else:
+                prune = False
+                self._sessions[(user_id, session.id)] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self._stats["evictions"] += 1
+        if prune:
+            self._prune_disk()
+        return session
+
+    def add_turn(self, user_id, session_id, sender, text):
+        """Appends a turn and refreshes the TTL. False if the session is unknown or expired."""
+        with self._session(user_id, session_id) as session:
+            if session is None:
+                return False
+            session.append(sender, text)
+            return True
+
+    def context(self, user_id, session_id):
+        """ChatSession.context() for the session, or None if it is unknown or expired."""
+        with self._session(user_id, session_id) as session:
+            return None if session is None else session.context()
+
+    @contextmanager
+    def _session(self, user_id, session_id):
+        """
+        Yields the live session (None if unknown or expired) with exclusive
+        access, with its TTL refreshed; with a directory, changes made inside
+        the block are written back when it exits.
+        """
+        if not self.directory:
+            with self._lock:
+                yield self._live(user_id, session_id)
+            return
+        if not SESSION_ID_PATTERN.match(str(session_id)):
+            yield None
+            return
+        with file_lock(os.path.join(self.directory, ".locks", f"{int(session_id[:2], 16) % SESSION_LOCK_STRIPES}.lock")):
+            session = self._read(user_id, session_id)
+            yield session
+            if session is not None:
+                self._write(user_id, session)
+
+    def _live(self, user_id, session_id):
+        key = (user_id, session_id)
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        now = time.time()
+        if session.expires <= now:
+            del self._sessions[key]
+            self._stats["expired"] += 1
+            return None
+        session.expires = now + self.ttl
+        self._sessions.move_to_end(key)
+        return session
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+        if self.directory:
+            try:
+                stats["sessions"] = sum(1 for entry in os.scandir(self.directory) if entry.name.endswith(".json"))
+            except OSError:
+                pass
+        return stats
+
+    # --- Disk ---
+
+    def _disk_path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _read(self, user_id, session_id):
+        """The session from its file, with the TTL refreshed; None if missing, expired or someone else's."""
+        path = self._disk_path(session_id)
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get("userId") != user_id:
+            return None
+        now = time.time()
+        if stored["expires"] <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._stats["expired"] += 1
+            return None
+        session = ChatSession.from_dict(session_id, stored)
+        session.expires = now + self.ttl
+        return session
+
+    def _write(self, user_id, session):
+        atomic_write_json(self._disk_path(session.id), {"userId": user_id, **session.to_dict()}, kind="chat_session")
+
+    def _prune_disk(self):
+        """Drops expired session files, then the least recently used beyond max_sessions."""
+        now = time.time()
+        files = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json"):
+                    files.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            return
+        files.sort()
+        excess = len(files) - self.max_sessions
+        for index, (mtime, path) in enumerate(files):
+            # A session's file is rewritten on every access, so its mtime is its last use
+            if index < excess or mtime + self.ttl <= now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                if index < excess:
+                    with self._lock:
+                        self._stats["evictions"] += 1
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store():
+    """Returns the process-wide SessionStore."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
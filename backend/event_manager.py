@@ -1,159 +1,664 @@
 import os
-import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+import changes
+from datetime import timedelta
+from intervals import CalendarIndex, event_interval, merge_intervals, free_slots, parse_time
+from recurrence import expand_events, iter_instances, get_occurrence_cache, parse_date
+from search import SearchIndex
+from storage import event_year, get_storage
 
-DATA_DIR = "data"
-SUPPORTED_YEARS = ["2024", "2025", "2026"]
+log = logging.getLogger(__name__)
 
-def get_user_data_path(user_id, year, data_type="events"):
-    filename = f"{year}_{data_type}.json"
-    return os.path.join(DATA_DIR, user_id, filename)
+# The actual reads and writes live in storage.py (JSON files or SQLite, picked by
+# STORAGE_BACKEND). This module keeps the calendar rules on top of them.
+
+# --- Concurrency ---
+# Every read-modify-write below runs under the user's lock (threads and worker
+# processes alike), so concurrent saves can't interleave and lose writes. Saves
+# also take an optional expected_revision: if the store has moved on since the
+# client read it, RevisionConflict is raised instead of overwriting newer data.
+
+class RevisionConflict(Exception):
+    """A save named a revision the store is no longer at."""
+
+    def __init__(self, store, expected, current):
+        super().__init__(f"{store} changed: expected revision {expected}, now at {current}")
+        self.store = store
+        self.expected = expected
+        self.current = current
+
+def user_lock(user_id):
+    """Re-entrant lock around one user's read-modify-write sequences."""
+    return get_storage().user_lock(user_id)
+
+def _check_revision(user_id, store, expected_revision):
+    """Raises RevisionConflict unless expected_revision is None or current. Call under user_lock."""
+    if expected_revision is None:
+        return
+    current = get_storage().get_revision(user_id, store)
+    if current != expected_revision:
+        raise RevisionConflict(store, expected_revision, current)
+
+# --- Events ---
 
 def get_events(user_id, year):
-    path = get_user_data_path(user_id, year, "events")
-    try:
-        with open(path, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return [] # Return empty list if no file
-    except Exception:
-        return None # General error
-    
+    """Events stored under one year (see storage.event_year)."""
+    return [event for event in get_all_events(user_id) if event_year(event) == str(year)]
+
 def get_all_events(user_id):
-    """Fetches all events from all supported year files for a user."""
-    all_events = []
-    for year in SUPPORTED_YEARS:
-        path = get_user_data_path(user_id, year, "events")
-        try:
-            with open(path, 'r') as f:
-                events_in_file = json.load(f)
-                all_events.extend(events_in_file)
-        except FileNotFoundError:
-            continue  # It's okay if a year file doesn't exist
-        except Exception as e:
-            print(f"Error loading {path}: {e}")
-            continue
-    return all_events
+    """Fetches all of a user's events, from every shard."""
+    return get_storage().get_all_events(user_id)
+
+def get_events_in_range(user_id, start_date, end_date):
+    """
+    Returns the expanded event instances (single events, recurring instances
+    and exceptions) that fall between start_date and end_date, inclusive.
+    """
+    rows = get_storage().get_events_for_range(user_id, start_date, end_date)
+    return expand_events(rows, start_date, end_date)
+
+def iter_all_events(user_id):
+    """get_all_events, read lazily (a shard at a time) for streaming responses."""
+    return get_storage().iter_all_events(user_id)
+
+def iter_events_in_range(user_id, start_date, end_date):
+    """get_events_in_range as a generator, for streaming responses."""
+    rows = get_storage().iter_events_for_range(user_id, start_date, end_date)
+    return iter_instances(rows, start_date, end_date)
+
+def get_events_revision(user_id):
+    """Bumped on every write to the user's events; the ETag of the event endpoints."""
+    return get_storage().get_revision(user_id, "events")
+
+def get_event_cache_stats():
+    """Hit/miss counters of the JSON storage's parsed-events cache ({} for other backends)."""
+    storage = get_storage()
+    return storage.cache_stats() if hasattr(storage, "cache_stats") else {}
+
+def get_recurrence_cache_stats():
+    """Hit/miss counters of the materialized occurrence cache."""
+    return get_occurrence_cache().stats()
+
+# --- Interval index ---
+
+# Users whose CalendarIndex is kept in memory (least recently used dropped first)
+INTERVAL_INDEX_MAX_USERS = int(os.getenv("INTERVAL_INDEX_MAX_USERS", 256))
+
+_indexes = OrderedDict()  # user_id -> (events revision, CalendarIndex)
+_indexes_lock = threading.Lock()
+
+def get_calendar_index(user_id):
+    """
+    The user's CalendarIndex, rebuilt only when their events revision changes,
+    so overlap and free-slot queries don't re-read or re-scan the calendar.
+    """
+    revision = get_events_revision(user_id)
+    with _indexes_lock:
+        cached = _indexes.get(user_id)
+        if cached is not None and cached[0] == revision:
+            _indexes.move_to_end(user_id)
+            return cached[1]
+
+    index = CalendarIndex(get_all_events(user_id))
+    with _indexes_lock:
+        _indexes[user_id] = (revision, index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > INTERVAL_INDEX_MAX_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+def get_events_overlapping(user_id, start, end):
+    """Event instances overlapping [start, end) (datetimes)."""
+    return get_calendar_index(user_id).overlapping(start, end)
+
+def find_conflicts(user_id, event):
+    """Existing instances that a new or moved event would double-book."""
+    own_series = event.get("recurrenceId")
+    return [
+        other for other in get_calendar_index(user_id).conflicts(event)
+        if other.get("id") != event.get("id") and not (own_series and other.get("recurrenceId") == own_series)
+    ]
+
+def find_next_free_slot(user_id, duration, after, until, day_start=None, day_end=None):
+    """Earliest datetime >= after with `duration` free (optionally within day_start-day_end hours)."""
+    return get_calendar_index(user_id).next_free_slot(duration, after, until, day_start, day_end)
+
+# --- Free/busy ---
+# Busy times are private by default. A user opts in through the profile field
+# "freeBusySharedWith": a list of user ids allowed to see them, or "*" for
+# every signed-in user. The blocks never carry event details either way.
+
+def user_exists(user_id):
+    return isinstance(user_id, str) and get_storage().user_exists(user_id)
+
+def shares_free_busy_with(owner_id, viewer_id):
+    """Whether viewer_id may see owner_id's busy blocks."""
+    if owner_id == viewer_id:
+        return True
+    shared = (get_profile(owner_id) or {}).get("freeBusySharedWith") or []
+    return shared == "*" or viewer_id in shared
+
+def get_busy_blocks(user_id, start, end):
+    """
+    One user's merged busy (start, end) blocks inside [start, end). Only the rows
+    the window needs are read (see Storage.get_events_for_range), starting a day
+    early to catch instances that run past midnight into the window.
+    """
+    first_day, last_day = start.date() - timedelta(days=1), end.date()
+    rows = get_storage().get_events_for_range(user_id, first_day, last_day)
+    intervals = []
+    for instance in expand_events(rows, first_day, last_day):
+        interval = event_interval(instance)
+        if interval is not None and interval[0] < end and interval[1] > start:
+            intervals.append((max(interval[0], start), min(interval[1], end)))
+    return merge_intervals(intervals)
 
-def save_all_events_split(user_id, all_events):
+def get_free_busy(user_ids, start, end, duration, day_start=None, day_end=None, limit=5):
+    """
+    Busy blocks per user, and the earliest free ranges (at least `duration`
+    long) that everyone shares. The common ranges come from one sweep over
+    the union of all users' blocks.
+    """
+    busy = {user_id: get_busy_blocks(user_id, start, end) for user_id in user_ids}
+    combined = merge_intervals(block for blocks in busy.values() for block in blocks)
+    return busy, free_slots(combined, start, end, duration, day_start, day_end, limit)
+
+def save_all_events_split(user_id, all_events, expected_revision=None):
     """
     Saves a master list of events back into their respective year files.
     Filters out any non-dictionary items in the input list for robustness.
+    Only year files whose contents changed are rewritten.
+
+    Returns the list of years that were written (possibly empty), or None on failure.
+    Raises RevisionConflict if expected_revision is given and stale.
     """
-    events_by_year = {year: [] for year in SUPPORTED_YEARS}
-    
+    valid_events = []
+
     for event in all_events:
         # CRITICAL FIX: Ensure the item is a dictionary before attempting to call .get()
         if not isinstance(event, dict):
-            print(f"Skipping invalid event entry (Type: {type(event).__name__}). Expected dictionary.")
+            log.warning("Skipping invalid event entry (Type: %s). Expected dictionary.", type(event).__name__)
             continue
-            
-        # We store base recurring events in their START year.
-        # We store exceptions in their *modified* date's year.
-        # We store deleted instances (ghosts) in their *original* date's year.
-        
-        date_key = event.get('date', event.get('originalDate'))
-        if not date_key:
-            print(f"Skipping event with no date: {event.get('title', 'Untitled Event')}")
+
+        if event_year(event) is None:
+            log.warning("Skipping event with no date: %s", event.get('title', 'Untitled Event'))
+        else:
+            valid_events.append(event)
+
+    with user_lock(user_id):
+        _check_revision(user_id, "events", expected_revision)
+
+        # Series whose base, exceptions or ghosts differ from what is stored
+        before = {event.get("id"): event for event in get_all_events(user_id) if isinstance(event, dict)}
+        after = {event.get("id"): event for event in valid_events}
+        touched_series = {
+            event.get("recurrenceId")
+            for event_id in before.keys() | after.keys()
+            for event in (before.get(event_id), after.get(event_id))
+            if event is not None and before.get(event_id) != after.get(event_id) and event.get("recurrenceId")
+        }
+
+        written = get_storage().save_all_events(user_id, valid_events)
+    if written is not None:
+        _invalidate_series(touched_series)
+    return written
+
+def save_events(user_id, year, events_data):
+    """Replaces the events stored under one year."""
+    with user_lock(user_id):
+        others = [event for event in get_all_events(user_id) if event_year(event) != str(year)]
+        return save_all_events_split(user_id, others + list(events_data)) is not None
+
+# --- Incremental Event Mutations ---
+# These touch only the events (and shards) an operation actually changes,
+# instead of re-partitioning and rewriting the user's whole calendar like save_all.
+# Like auth.py, they return (response_dict, status_code) for the routes.
+
+class _EventChangeSet:
+    """Pending upserts/deletes layered over storage, so later ops in a batch see earlier ones."""
+
+    def __init__(self, storage, user_id):
+        self.storage = storage
+        self.user_id = user_id
+        self.upserts = {}
+        self.deleted = set()
+        self.touched_series = set()
+
+    def get(self, event_id):
+        if event_id in self.deleted:
+            return None
+        if event_id in self.upserts:
+            return self.upserts[event_id]
+        return self.storage.get_event(self.user_id, event_id)
+
+    def series(self, recurrence_id):
+        stored = [
+            event for event in self.storage.find_series(self.user_id, recurrence_id)
+            if event.get("id") not in self.deleted and event.get("id") not in self.upserts
+        ]
+        pending = [event for event in self.upserts.values() if event.get("recurrenceId") == recurrence_id]
+        return stored + pending
+
+    def put(self, event):
+        if event_year(event) is None:
+            raise ValueError("Event has no date")
+        self.deleted.discard(event["id"])
+        self.upserts[event["id"]] = event
+        if event.get("recurrenceId"):
+            self.touched_series.add(event["recurrenceId"])
+
+    def delete(self, event):
+        self.upserts.pop(event["id"], None)
+        self.deleted.add(event["id"])
+        if event.get("recurrenceId"):
+            self.touched_series.add(event["recurrenceId"])
+
+    def commit(self):
+        written = self.storage.apply_event_changes(self.user_id, list(self.upserts.values()), sorted(self.deleted))
+        if written is not None:
+            _invalidate_series(self.touched_series)
+        return written
+
+def _invalidate_series(recurrence_ids):
+    cache = get_occurrence_cache()
+    for recurrence_id in recurrence_ids:
+        cache.invalidate_series(recurrence_id)
+
+def _op_create(changes, data):
+    event = dict(data.get("event") or {})
+    if not event:
+        raise ValueError("No event provided")
+    event.setdefault("id", f"evt-{uuid.uuid4()}")
+    if changes.get(event["id"]):
+        raise ValueError(f"Event {event['id']} already exists")
+    if event.get("recurrenceRule", "NONE") != "NONE" and not event.get("recurrenceId"):
+        event["recurrenceId"] = f"rec-{uuid.uuid4()}"
+        event["isBaseEvent"] = True
+    changes.put(event)
+    return event
+
+def _op_update(changes, data):
+    event_id = data.get("id")
+    existing = changes.get(event_id)
+    if not existing:
+        raise LookupError(f"Event {event_id} not found")
+    event = {**existing, **(data.get("event") or {}), "id": event_id}
+    changes.put(event)
+    return event
+
+def _op_delete(changes, data):
+    event_id = data.get("id")
+    event = changes.get(event_id)
+    if not event:
+        raise LookupError(f"Event {event_id} not found")
+    if data.get("scope", "series") == "series" and event.get("recurrenceId"):
+        # Base event plus all its exceptions and ghosts
+        for member in changes.series(event["recurrenceId"]):
+            changes.delete(member)
+    else:
+        changes.delete(event)
+    return {"id": event_id}
+
+def _op_recurrence(changes, data):
+    """
+    Edits one recurring series.
+    mode 'instance': save writes an exception, delete writes a ghost, both keyed by originalDate.
+    mode 'series': save updates the base event, delete removes the base and all its exceptions.
+    """
+    recurrence_id = data.get("recurrenceId")
+    mode = data.get("mode", "instance")
+    action = data.get("action", "save")
+    if not recurrence_id:
+        raise ValueError("recurrenceId is required")
+
+    series = changes.series(recurrence_id)
+    bases = [event for event in series if event.get("isBaseEvent")]
+    if not bases:
+        raise LookupError(f"Series {recurrence_id} not found")
+
+    if mode == "series":
+        if action == "delete":
+            for member in series:
+                changes.delete(member)
+            return {"recurrenceId": recurrence_id}
+        base = bases[0]
+        event = {**base, **(data.get("event") or {}),
+                 "id": base["id"], "recurrenceId": recurrence_id, "isBaseEvent": True}
+        for key in ("isInstance", "isException", "originalDate"):
+            event.pop(key, None)
+        changes.put(event)
+        return event
+
+    original_date = data.get("originalDate")
+    if not original_date:
+        raise ValueError("originalDate is required for instance edits")
+
+    # An instance has at most one exception or ghost
+    for member in series:
+        if not member.get("isBaseEvent") and member.get("originalDate") == original_date:
+            changes.delete(member)
+    if action == "delete":
+        event = {
+            "id": f"evt-{uuid.uuid4()}",
+            "recurrenceId": recurrence_id,
+            "originalDate": original_date,
+            "isDeleted": True,
+            "isBaseEvent": False,
+        }
+    else:
+        event = {
+            **(data.get("event") or {}),
+            "id": f"evt-{uuid.uuid4()}",
+            "recurrenceId": recurrence_id,
+            "originalDate": original_date,
+            "isBaseEvent": False,
+            "isException": True,
+        }
+        event.pop("isInstance", None)
+        event.setdefault("date", original_date)
+    changes.put(event)
+    return event
+
+_EVENT_OPS = {
+    "create": _op_create,
+    "update": _op_update,
+    "delete": _op_delete,
+    "recurrence": _op_recurrence,
+}
+
+def apply_event_ops(user_id, ops, expected_revision=None):
+    """
+    Applies a list of ops ({"op": "create" | "update" | "delete" | "recurrence", ...})
+    all-or-nothing, then writes each affected shard once. The ops read and
+    write under the user's lock, so two batches never merge into stale events.
+    Success responses carry the events revision the write produced.
+    Raises RevisionConflict if expected_revision is given and stale.
+    """
+    if not isinstance(ops, list) or not ops:
+        return {"msg": "Expected a non-empty list of ops"}, 400
+
+    with user_lock(user_id):
+        _check_revision(user_id, "events", expected_revision)
+        changes = _EventChangeSet(get_storage(), user_id)
+        results = []
+        for position, op in enumerate(ops):
+            handler = _EVENT_OPS.get(op.get("op")) if isinstance(op, dict) else None
+            if handler is None:
+                return {"msg": f"Unknown op at position {position}"}, 400
+            try:
+                results.append(handler(changes, op))
+            except LookupError as e:
+                return {"msg": str(e), "position": position}, 404
+            except ValueError as e:
+                return {"msg": str(e), "position": position}, 400
+
+        written_shards = changes.commit()
+        if written_shards is None:
+            return {"msg": "Failed to save events"}, 500
+        # Read before the lock is released, so it is this write's revision
+        revision = get_events_revision(user_id)
+    return {"msg": "Events saved successfully", "results": results, "shards": written_shards,
+            "revision": revision}, 200
+
+def _apply_single(user_id, op, success_status=200, expected_revision=None):
+    response, status_code = apply_event_ops(user_id, [op], expected_revision)
+    if status_code != 200:
+        return response, status_code
+    return {"msg": response["msg"], "event": response["results"][0], "shards": response["shards"],
+            "revision": response["revision"]}, success_status
+
+def create_event(user_id, event, expected_revision=None):
+    """Adds one event (assigning an id, and a recurrenceId for recurring events)."""
+    return _apply_single(user_id, {"op": "create", "event": event}, 201, expected_revision)
+
+def update_event(user_id, event_id, changes, expected_revision=None):
+    """Merges changes into an existing event, moving it between shards if its date moves."""
+    return _apply_single(user_id, {"op": "update", "id": event_id, "event": changes}, 200, expected_revision)
+
+def delete_event(user_id, event_id, scope="series", expected_revision=None):
+    """Deletes one event; scope 'series' also removes a recurring series' exceptions and ghosts."""
+    return _apply_single(user_id, {"op": "delete", "id": event_id, "scope": scope}, 200, expected_revision)
+
+def update_recurrence(user_id, data, expected_revision=None):
+    """Saves or deletes one instance of a recurring series, or the whole series."""
+    return _apply_single(user_id, {**data, "op": "recurrence"}, 200, expected_revision)
+
+# --- Batch import ---
+# Many new events in one pass, e.g. the suggested_events of a scanned timetable:
+# validated up front, de-duplicated, optionally folded into weekly series, and
+# committed as one change set, so each affected shard is written once.
+
+IMPORT_MAX_EVENTS = int(os.getenv("IMPORT_MAX_EVENTS", 500))
+
+def _dedupe_key(event):
+    """Title (case and spacing ignored), date and times: what makes two events 'the same'."""
+    title = " ".join(str(event.get("title") or "").split()).casefold()
+    return (title, str(event.get("date"))[:10], str(event.get("startTime") or "")[:5],
+            str(event.get("endTime") or "")[:5])
+
+def _validate_import(event):
+    """The event to import (without any client id or series fields), or raises ValueError."""
+    if not isinstance(event, dict):
+        raise ValueError("Expected an event object")
+    if parse_date(event.get("date")) is None:
+        raise ValueError("Event needs a date (YYYY-MM-DD)")
+    for key in ("startTime", "endTime"):
+        if event.get(key) and parse_time(event[key]) is None:
+            raise ValueError(f"Invalid {key} (HH:MM)")
+    event = {key: value for key, value in event.items()
+             if key not in ("id", "recurrenceId", "isBaseEvent", "isException", "isInstance",
+                            "originalDate", "isDeleted")}
+    event["date"] = event["date"][:10]
+    return event
+
+def _weekly_groups(candidates):
+    """
+    Groups (position, event) pairs of single events that are the same slot
+    (identical apart from the date, on the same weekday) and fall at a
+    regular 1+ week spacing. Returns [(rule, [(position, event)])] for the
+    groups to collapse, oldest first, and the leftover pairs.
+    """
+    groups = {}
+    for position, event in candidates:
+        if event.get("recurrenceRule", "NONE") != "NONE":
+            groups[("recurring", position)] = [(position, event)]
             continue
-        
+        slot = sorted((key, repr(value)) for key, value in event.items() if key != "date")
+        groups.setdefault((tuple(slot), parse_date(event["date"]).weekday()), []).append((position, event))
+
+    series, leftover = [], []
+    for key, members in groups.items():
+        members.sort(key=lambda pair: pair[1]["date"])
+        days = [parse_date(event["date"]) for _, event in members]
+        gaps = {(later - earlier).days for earlier, later in zip(days, days[1:])}
+        gap = gaps.pop() if len(gaps) == 1 else 0
+        # A gap of 0 means same-date copies, which a weekly rule would spread out
+        if key[0] == "recurring" or len(members) < 2 or gap <= 0 or gap % 7:
+            leftover.extend(members)
+            continue
+        weeks = gap // 7
+        rule = "FREQ=WEEKLY" + (f";INTERVAL={weeks}" if weeks > 1 else "") + f";COUNT={len(members)}"
+        series.append((rule, members))
+    return series, sorted(leftover)
+
+def import_events(user_id, events, collapse_weekly=False, skip_duplicates=True, expected_revision=None):
+    """
+    Creates many events in one write. Every event gets a new id. With
+    skip_duplicates, events matching an existing event instance (or an
+    earlier one in the batch) by title/date/start/end are skipped. With
+    collapse_weekly, single events repeating the same slot every N weeks
+    become one series with a counted weekly RRULE.
+    All-or-nothing: any invalid event fails the batch with its position.
+    """
+    if not isinstance(events, list) or not events:
+        return {"msg": "Expected a non-empty list of events"}, 400
+    if len(events) > IMPORT_MAX_EVENTS:
+        return {"msg": f"At most {IMPORT_MAX_EVENTS} events per batch"}, 400
+
+    candidates = []
+    for position, event in enumerate(events):
         try:
-            # Safely extract the year from the date string (e.g., '2025-11-20' -> '2025')
-            event_year = date_key.split('-')[0]
-            
-            if event_year in events_by_year:
-                events_by_year[event_year].append(event)
-            else:
-                # If event is outside our 3-year scope, just log it
-                print(f"Event for year {event_year} is outside supported range.")
-        except Exception as e:
-            # Catch errors like date_key not being a valid string for splitting
-            print(f"Error processing event (ID: {event.get('id')}): {e}. Date key: {date_key}")
-            
-    # Now, save each year's file
-    try:
-        for year, events_list in events_by_year.items():
-            # Assuming get_user_data_path returns a file path for the current year
-            path = get_user_data_path(user_id, year, "events")
-            with open(path, 'w') as f:
-                json.dump(events_list, f, indent=4)
-        return True
-    except Exception as e:
-        print(f"Error saving all events: {e}")
-        return False
+            candidates.append((position, _validate_import(event)))
+        except ValueError as e:
+            return {"msg": str(e), "position": position}, 400
 
-def save_events(user_id, year, events_data):
-    path = get_user_data_path(user_id, year, "events")
-    try:
-        with open(path, 'w') as f:
-            json.dump(events_data, f, indent=4)
-        return True
-    except Exception:
-        return False
+    with user_lock(user_id):
+        _check_revision(user_id, "events", expected_revision)
+
+        skipped = []
+        if skip_duplicates:
+            days = [parse_date(event["date"]) for _, event in candidates]
+            existing = {_dedupe_key(instance): instance.get("id")
+                        for instance in get_events_in_range(user_id, min(days), max(days))}
+            unique = []
+            for position, event in candidates:
+                key = _dedupe_key(event)
+                if key in existing:
+                    skipped.append({"position": position, "reason": "duplicate", "id": existing[key]})
+                    continue
+                existing[key] = None
+                unique.append((position, event))
+            candidates = unique
+
+        series, singles = _weekly_groups(candidates) if collapse_weekly else ([], candidates)
+
+        changes = _EventChangeSet(get_storage(), user_id)
+        created, collapsed = [], []
+        for rule, members in series:
+            base = {**members[0][1], "id": f"evt-{uuid.uuid4()}", "recurrenceRule": rule,
+                    "recurrenceId": f"rec-{uuid.uuid4()}", "isBaseEvent": True}
+            changes.put(base)
+            created.append(base)
+            collapsed.append({"recurrenceId": base["recurrenceId"], "positions": [p for p, _ in members]})
+        for _, event in singles:
+            event = {**event, "id": f"evt-{uuid.uuid4()}"}
+            if event.get("recurrenceRule", "NONE") != "NONE":
+                event["recurrenceId"] = f"rec-{uuid.uuid4()}"
+                event["isBaseEvent"] = True
+            changes.put(event)
+            created.append(event)
+
+        written_shards = changes.commit() if created else []
+        if written_shards is None:
+            return {"msg": "Failed to save events"}, 500
+        revision = get_events_revision(user_id)
+    return {"msg": f"Imported {len(created)} event(s)", "created": created, "skipped": skipped,
+            "collapsed": collapsed, "shards": written_shards, "revision": revision}, 201 if created else 200
+
+# --- Search ---
+# One SearchIndex per user in memory (least recently used dropped first). Before
+# each query it replays the change-log entries written since its cursor, so it
+# follows saves from every code path and worker process; a cursor the log has
+# been compacted past (or no index yet) means a rebuild from the user's events.
+
+SEARCH_INDEX_MAX_USERS = int(os.getenv("SEARCH_INDEX_MAX_USERS", 64))
+# Replayed changes after which the persisted snapshot is rewritten
+SEARCH_INDEX_SAVE_EVERY = int(os.getenv("SEARCH_INDEX_SAVE_EVERY", 50))
+
+_search_indexes = OrderedDict()  # user_id -> SearchIndex
+_search_indexes_lock = threading.Lock()
+
+def _get_search_index(user_id):
+    with _search_indexes_lock:
+        index = _search_indexes.get(user_id)
+        if index is not None:
+            _search_indexes.move_to_end(user_id)
+            return index
+
+    index = SearchIndex.from_dict(get_storage().load_search_index(user_id)) or SearchIndex()
+    with _search_indexes_lock:
+        # Another thread may have loaded it meanwhile; keep theirs
+        index = _search_indexes.setdefault(user_id, index)
+        _search_indexes.move_to_end(user_id)
+        while len(_search_indexes) > SEARCH_INDEX_MAX_USERS:
+            _search_indexes.popitem(last=False)
+    return index
+
+def _refresh_search_index(user_id, index):
+    """Brings index up to the change log's cursor. Call with index.lock held."""
+    storage = get_storage()
+    feed = storage.get_changes(user_id, index.cursor)
+    if feed["resync"]:
+        # The cursor is read before the events, so a write in between is replayed next time
+        index.rebuild(storage.get_all_events(user_id), feed["cursor"])
+    elif feed["changes"]:
+        index.apply(feed["changes"])
+        index.cursor = feed["cursor"]
+        if index.unsaved < SEARCH_INDEX_SAVE_EVERY:
+            return
+    else:
+        return
+    storage.save_search_index(user_id, index.to_dict())
+    index.unsaved = 0
+
+def search_events(user_id, query, start_date=None, end_date=None, limit=50):
+    """
+    (results, total): events whose title, location or description has words
+    starting with every word of the query, optionally within start_date..end_date.
+    Recurring series come back once, with their next occurrence (see search.py).
+    """
+    index = _get_search_index(user_id)
+    with index.lock:
+        _refresh_search_index(user_id, index)
+        return index.search(query, start_date, end_date, limit)
+
+# --- Change feed ---
+
+def get_changes(user_id, since, wait=0):
+    """
+    Event/task changes after cursor `since` (see changes.py). With wait > 0 this
+    long-polls: it returns as soon as something changes, or after `wait` seconds.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        seen = changes.generation(user_id)
+        result = get_storage().get_changes(user_id, since)
+        remaining = deadline - time.monotonic()
+        if result["changes"] or result["resync"] or remaining <= 0:
+            return result
+        # Woken at once by writes in this process; the poll interval catches other workers'
+        changes.wait(user_id, seen, min(remaining, changes.CHANGE_POLL_INTERVAL))
+
+# --- Tasks ---
 
-# ... similar functions for get_tasks and save_tasks ...
-def get_tasks(user_id, year):
-    path = get_user_data_path(user_id, year, "tasks")
-    try:
-        with open(path, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {} # Return empty dict if no file
-    except Exception:
-        return None
-
-def save_tasks(user_id, year, tasks_data):
-    path = get_user_data_path(user_id, year, "tasks")
-    try:
-        with open(path, 'w') as f:
-            json.dump(tasks_data, f, indent=4)
-        return True
-    except Exception:
-        return False
-    
 def get_tasks(user_id, year):
-    path = get_user_data_path(user_id, year, "tasks")
-    try:
-        with open(path, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {} # Return empty dict if no file for the year
-    except Exception as e:
-        print(f"Error getting tasks for {user_id}, {year}: {e}")
-        return None
-
-def save_tasks(user_id, year, tasks_data):
-    path = get_user_data_path(user_id, year, "tasks")
-    try:
-        with open(path, 'w') as f:
-            json.dump(tasks_data, f, indent=4)
-        return True
-    except Exception as e:
-        print(f"Error saving tasks for {user_id}, {year}: {e}")
-        return False
-    
-def get_profile_path(user_id):
-    return os.path.join(DATA_DIR, user_id, "profile.json")
+    return get_storage().get_tasks(user_id, year)
+
+def save_tasks(user_id, year, tasks_data, expected_revision=None):
+    """
+    Replaces one year's tasks. Returns the new tasks revision, or None on failure.
+    Raises RevisionConflict if expected_revision is given and stale.
+    """
+    with user_lock(user_id):
+        _check_revision(user_id, f"tasks:{year}", expected_revision)
+        if not get_storage().save_tasks(user_id, year, tasks_data):
+            return None
+        return get_tasks_revision(user_id, year)
+
+def get_tasks_revision(user_id, year):
+    return get_storage().get_revision(user_id, f"tasks:{year}")
+
+# --- Profile ---
 
 def get_profile(user_id):
     """Reads profile data for a user."""
-    path = get_profile_path(user_id)
-    try:
-        with open(path, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # This shouldn't happen if registration worked
-        return {"username": "Error", "photoUrl": ""}
-    except Exception as e:
-        print(f"Error reading profile {path}: {e}")
-        return None
+    return get_storage().get_profile(user_id)
 
 def save_profile(user_id, profile_data):
     """Saves profile data for a user."""
-    path = get_profile_path(user_id)
-    try:
-        with open(path, 'w') as f:
-            json.dump(profile_data, f, indent=4)
-        return True
-    except Exception as e:
-        print(f"Error saving profile {path}: {e}")
-        return False
\ No newline at end of file
+    return get_storage().save_profile(user_id, profile_data)
+
+def update_profile(user_id, updates):
+    """Merges updates into the stored profile atomically. Returns the new profile, or None."""
+    with user_lock(user_id):
+        profile = get_profile(user_id)
+        if not profile:
+            return None
+        profile = {**profile, **updates}
+        if not save_profile(user_id, profile):
+            return None
+        return profile
@@ -0,0 +1,180 @@
+import os
+import io
+import base64
+import binascii
+
+_pillow = None
+
+def _load_pillow():
+    """
+    Imports Pillow on first use (it is only needed for chat images and profile photos).
+    Pillow is optional: without it images are passed through untouched.
+    """
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image, ImageOps
+            _pillow = (Image, ImageOps)
+        except ImportError:
+            _pillow = (None, None)
+    return _pillow
+
+# Images bigger than this (decoded) are rejected before we read the rest of the request
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+# Longest side sent to the vision model; timetables stay readable well below phone resolution
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 1600))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+
+CHUNK_SIZE = 64 * 1024
+
+class ImageTooLargeError(ValueError):
+    pass
+
+class InvalidImageError(ValueError):
+    pass
+
+def max_request_bytes():
+    """Largest request body worth reading: a base64 image at the cap, plus JSON/multipart overhead."""
+    return IMAGE_MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
+
+def read_stream(stream, limit=IMAGE_MAX_UPLOAD_BYTES):
+    """Reads a binary stream in chunks, giving up as soon as it passes limit."""
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if buffer.tell() > limit:
+            raise ImageTooLargeError("Image is too large")
+    return buffer.getvalue()
+
+def decode_base64_stream(chunks, limit=IMAGE_MAX_UPLOAD_BYTES):
+    """
+    Decodes base64 text arriving in pieces (str or bytes), with or without a
+    'data:image/...;base64,' prefix, without ever holding a second full copy
+    of the encoded text.
+    """
+    out = io.BytesIO()
+    pending = b""
+    seen_prefix = False
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("ascii", "ignore")
+        chunk = pending + b"".join(chunk.split())
+        if not seen_prefix:
+            if chunk.startswith(b"data:") and b"," not in chunk:
+                pending = chunk  # prefix split across chunks
+                continue
+            if chunk.startswith(b"data:"):
+                chunk = chunk.split(b",", 1)[1]
+            seen_prefix = True
+        usable = len(chunk) - len(chunk) % 4
+        pending = chunk[usable:]
+        try:
+            out.write(base64.b64decode(chunk[:usable], validate=True))
+        except (binascii.Error, ValueError):
+            raise InvalidImageError("Image is not valid base64")
+        if out.tell() > limit:
+            raise ImageTooLargeError("Image is too large")
+    if pending.strip(b"="):
+        raise InvalidImageError("Image is not valid base64")
+    return out.getvalue()
+
+def iter_text_chunks(text, size=CHUNK_SIZE):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+def read_image_upload(request):
+    """
+    Pulls the image bytes and prompt out of a parse_image request. Accepts:
+      - multipart/form-data with an 'image' file (and optional 'prompt' field)
+      - a raw image/* or application/octet-stream body (prompt in ?prompt=)
+      - a text/plain base64 body (prompt in ?prompt=)
+      - the original JSON {"image": "<base64 or data URL>", "prompt": "..."}
+    Returns (image_bytes, prompt, data). data is the parsed JSON body, or {} otherwise.
+    Raises ImageTooLargeError / InvalidImageError.
+    """
+    if request.content_length is not None and request.content_length > max_request_bytes():
+        # Rejected from the header alone, before the body is buffered
+        raise ImageTooLargeError("Image is too large")
+
+    default_prompt = "Extract event details from this image."
+    content_type = request.mimetype or ""
+
+    if content_type == "multipart/form-data":
+        upload = request.files.get("image")
+        if upload is None:
+            raise InvalidImageError("No image data provided")
+        return read_stream(upload.stream), request.form.get("prompt", default_prompt), {}
+
+    if content_type.startswith("image/") or content_type == "application/octet-stream":
+        return read_stream(request.stream), request.args.get("prompt", default_prompt), {}
+
+    if content_type == "text/plain":
+        chunks = iter(lambda: request.stream.read(CHUNK_SIZE), b"")
+        return decode_base64_stream(chunks), request.args.get("prompt", default_prompt), {}
+
+    data = request.get_json(silent=True) or {}
+    base64_image = data.get("image")
+    if not base64_image or not isinstance(base64_image, str):
+        raise InvalidImageError("No image data provided")
+    return decode_base64_stream(iter_text_chunks(base64_image)), data.get("prompt", default_prompt), data
+
+def _sniff_mime_type(image_bytes):
+    if image_bytes.startswith(b"\x89PNG"):
+        return "image/png"
+    if image_bytes.startswith(b"GIF8"):
+        return "image/gif"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+def preprocess_image(image_bytes, max_dimension=IMAGE_MAX_DIMENSION, quality=IMAGE_JPEG_QUALITY):
+    """
+    Downscales to max_dimension on the longest side, applies EXIF rotation, drops
+    all metadata and re-encodes as JPEG. Returns (bytes, mime_type).
+    Without Pillow the original bytes are returned with a sniffed mime type.
+    """
+    if not image_bytes:
+        raise InvalidImageError("No image data provided")
+    Image, ImageOps = _load_pillow()
+    if Image is None:
+        return image_bytes, _sniff_mime_type(image_bytes)
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "L"):
+                # Flatten transparency onto white, screenshots are often RGBA
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                rgba = img.convert("RGBA")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                img = background
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            out = io.BytesIO()
+            # No exif/icc arguments, so none of the original metadata is written back
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError("Image is too large")
+    except (OSError, ValueError, SyntaxError):
+        raise InvalidImageError("Could not read the image")
+
+    return out.getvalue(), "image/jpeg"
+
+def make_thumbnail(image_bytes, size, quality=IMAGE_JPEG_QUALITY):
+    """
+    A size x size JPEG of the image's centre (for avatars), or None without
+    Pillow. Expects bytes preprocess_image() has already normalized.
+    """
+    Image, ImageOps = _load_pillow()
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            thumb = ImageOps.fit(img.convert("RGB"), (size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            thumb.save(out, format="JPEG", quality=quality, optimize=True)
+    except (OSError, ValueError, SyntaxError):
+        raise InvalidImageError("Could not read the image")
+    return out.getvalue()
@@ -0,0 +1,228 @@
+import bisect
+import calendar
+from datetime import date, datetime, time, timedelta
+from recurrence import expand_series, parse_date
+
+# Time-of-day questions over a user's calendar ("what overlaps Thursday
+# 14:00-15:00", "when is the next free hour") without scanning every event.
+
+def parse_time(value):
+    """Parses 'HH:MM' into a time. Returns None if invalid."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value[:5], "%H:%M").time()
+    except ValueError:
+        return None
+
+def event_interval(event):
+    """
+    (start, end) datetimes of one event instance, or None without a date.
+    No start time means all day; an end at or before the start ends the next day.
+    """
+    day = parse_date(event.get("date"))
+    if day is None:
+        return None
+    start_time = parse_time(event.get("startTime"))
+    if start_time is None:
+        start = datetime.combine(day, time.min)
+        return start, start + timedelta(days=1)
+    start = datetime.combine(day, start_time)
+    end_time = parse_time(event.get("endTime"))
+    if end_time is None:
+        return start, start + timedelta(hours=1)
+    end = datetime.combine(day, end_time)
+    if end <= start:
+        end += timedelta(days=1)
+    return start, end
+
+def merge_intervals(intervals):
+    """Sweep-line union of (start, end) pairs; returns sorted, non-overlapping blocks."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+def free_gaps(busy, window_start, window_end):
+    """The gaps between merged busy blocks inside [window_start, window_end)."""
+    gaps = []
+    cursor = window_start
+    for start, end in busy:
+        if end <= cursor:
+            continue
+        if start >= window_end:
+            break
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < window_end:
+        gaps.append((cursor, window_end))
+    return gaps
+
+def free_slots(busy, window_start, window_end, duration, day_start=None, day_end=None, limit=None):
+    """
+    Free (start, end) ranges of at least `duration` between merged busy blocks,
+    earliest first. With day_start/day_end (times) each range is also cut to
+    those hours, day by day.
+    """
+    slots = []
+    for gap_start, gap_end in free_gaps(busy, window_start, window_end):
+        if day_start is None or day_end is None:
+            pieces = [(gap_start, gap_end)]
+        else:
+            pieces = []
+            day = gap_start.date()
+            while datetime.combine(day, time.min) < gap_end:
+                pieces.append((max(gap_start, datetime.combine(day, day_start)),
+                               min(gap_end, datetime.combine(day, day_end))))
+                day += timedelta(days=1)
+        for piece_start, piece_end in pieces:
+            if piece_end - piece_start >= duration:
+                slots.append((piece_start, piece_end))
+                if limit is not None and len(slots) >= limit:
+                    return slots
+    return slots
+
+def first_free_slot(busy, window_start, window_end, duration, day_start=None, day_end=None):
+    """Start of the earliest free range of at least `duration`, or None."""
+    slots = free_slots(busy, window_start, window_end, duration, day_start, day_end, limit=1)
+    return slots[0][0] if slots else None
+
+class IntervalIndex:
+    """
+    Static interval index: entries sorted by start, plus a running maximum of
+    their ends. An overlap query binary-searches both, so it only walks the
+    entries that can overlap rather than the whole calendar.
+    """
+
+    def __init__(self, entries):
+        # entries: iterable of (start, end, event)
+        self._entries = sorted(entries, key=lambda entry: (entry[0], entry[1]))
+        self._starts = [entry[0] for entry in self._entries]
+        self._max_ends = []
+        running = None
+        for _, end, _ in self._entries:
+            running = end if running is None or end > running else running
+            self._max_ends.append(running)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def overlapping(self, start, end):
+        """Entries with entry_start < end and entry_end > start, in start order."""
+        stop = bisect.bisect_left(self._starts, end)
+        # Everything before `first` ends at or before `start`
+        first = bisect.bisect_right(self._max_ends, start, 0, stop)
+        return [entry for entry in self._entries[first:stop] if entry[1] > start]
+
+class CalendarIndex:
+    """
+    One user's events as intervals. Single events and exceptions are indexed
+    up front; recurring series are expanded a month at a time, the first time
+    a query touches that month. Build a new one whenever the events change.
+    """
+
+    def __init__(self, events):
+        self._series = []
+        singles = []
+        bases = {}
+        for event in events:
+            if isinstance(event, dict) and event.get("recurrenceId") and event.get("isBaseEvent"):
+                bases[event["recurrenceId"]] = event
+        exceptions = {}
+        for event in events:
+            if not isinstance(event, dict) or event.get("isBaseEvent"):
+                continue
+            recurrence_id = event.get("recurrenceId")
+            if not recurrence_id:
+                singles.append(event)
+            elif event.get("originalDate") and recurrence_id in bases:
+                exceptions.setdefault(recurrence_id, {})[event["originalDate"]] = event
+                if not event.get("isDeleted"):
+                    # Indexed at its own (possibly moved) date, like a single event
+                    singles.append({**bases[recurrence_id], **event, "isInstance": True, "isException": True})
+        for recurrence_id, base in bases.items():
+            self._series.append((base, exceptions.get(recurrence_id, {})))
+
+        self._singles = IntervalIndex(self._entries(singles))
+        self._months = {}
+
+    @staticmethod
+    def _entries(events):
+        entries = []
+        for event in events:
+            interval = event_interval(event)
+            if interval is not None:
+                entries.append((interval[0], interval[1], event))
+        return entries
+
+    def _month(self, year, month):
+        key = (year, month)
+        index = self._months.get(key)
+        if index is None:
+            month_start = date(year, month, 1)
+            month_end = date(year, month, calendar.monthrange(year, month)[1])
+            instances = []
+            for base, exceptions in self._series:
+                instances.extend(
+                    instance for instance in expand_series(base, exceptions, month_start, month_end)
+                    if not instance.get("isException")  # exceptions are in self._singles
+                )
+            index = self._months[key] = IntervalIndex(self._entries(instances))
+        return index
+
+    def overlapping(self, start, end):
+        """Event instances overlapping [start, end), ordered by start."""
+        found = self._singles.overlapping(start, end)
+        if self._series:
+            # An instance can start the day before and run past midnight
+            day = (start - timedelta(days=1)).date().replace(day=1)
+            while day <= end.date():
+                found.extend(self._month(day.year, day.month).overlapping(start, end))
+                day = (day + timedelta(days=32)).replace(day=1)
+            found.sort(key=lambda entry: (entry[0], entry[1]))
+        return [event for _, _, event in found]
+
+    def busy(self, start, end):
+        """Merged busy blocks inside [start, end) (clipped to the window)."""
+        intervals = []
+        for event in self.overlapping(start, end):
+            event_start, event_end = event_interval(event)
+            intervals.append((max(event_start, start), min(event_end, end)))
+        return merge_intervals(intervals)
+
+    def conflicts(self, event, horizon_days=365, limit=20):
+        """
+        Existing instances that overlap `event` (a single event, or each of a
+        recurring event's occurrences over the next horizon_days).
+        """
+        if event.get("recurrenceRule") and event.get("recurrenceRule") != "NONE":
+            dtstart = parse_date(event.get("date"))
+            if dtstart is None:
+                return []
+            candidates = expand_series(event, {}, dtstart, dtstart + timedelta(days=horizon_days))
+        else:
+            candidates = [event]
+
+        conflicts = []
+        seen = set()
+        for candidate in candidates:
+            interval = event_interval(candidate)
+            if interval is None:
+                continue
+            for other in self.overlapping(*interval):
+                key = (other.get("id"), other.get("date"))
+                if key not in seen:
+                    seen.add(key)
+                    conflicts.append(other)
+                    if len(conflicts) >= limit:
+                        return conflicts
+        return conflicts
+
+    def next_free_slot(self, duration, after, until, day_start=None, day_end=None):
+        """Earliest start >= after where `duration` fits before `until`, or None."""
+        return first_free_slot(self.busy(after, until), after, until, duration, day_start, day_end)
@@ -0,0 +1,322 @@
+"""
+STORAGE_BACKEND=journal: events are kept as a per-user append-only journal of
+ops instead of whole year files, so an edit costs one short line on disk
+rather than a rewrite of the year it lives in.
+
+    data/<user_id>/events.journal        one compact JSON op per line
+    data/<user_id>/events.snapshot.json  {"seq": n, "events": [...]} as of op n
+
+A user's events are the snapshot with the journal replayed on top. A background
+thread compacts a journal once it grows past JOURNAL_COMPACT_OPS: it writes a new
+snapshot, refreshes the event shard files (so the data stays readable by the
+json backend and by hand) and starts an empty journal.
+
+Before switching a data dir back to STORAGE_BACKEND=json, run
+
+    python backend/journal_storage.py --data-dir data
+
+to fold every journal into the shard files.
+
+Tasks, profiles, users, revisions and the change log are stored exactly as in
+JsonStorage.
+"""
+import os
+import json
+import uuid
+import argparse
+import logging
+import tempfile
+import threading
+from storage import DATA_DIR, JsonStorage, event_year, events_for_range
+import changes
+
+log = logging.getLogger(__name__)
+
+# Ops in a journal before it is folded into a snapshot
+JOURNAL_COMPACT_OPS = int(os.getenv("JOURNAL_COMPACT_OPS", 500))
+
+class JournalStorage(JsonStorage):
+    """
+    JsonStorage with events in journal + snapshot files (see module docstring).
+    Each user's replayed events stay in memory; every read first stats the two
+    files, so writes made by other processes are picked up.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, compact_ops=JOURNAL_COMPACT_OPS):
+        super().__init__(data_dir)
+        self.compact_ops = compact_ops
+        # user_id -> {"events": {id: event}, "seq", "offset", "ops", "snapshot_sig", "journal_ino"}
+        self._states = {}
+        self._states_lock = threading.Lock()
+        self._compact_queue = set()
+        self._compact_cond = threading.Condition()
+        self._compactor = None
+
+    def journal_path(self, user_id):
+        return os.path.join(self.data_dir, user_id, "events.journal")
+
+    def snapshot_path(self, user_id):
+        return os.path.join(self.data_dir, user_id, "events.snapshot.json")
+
+    # --- Loading / replay ---
+
+    def _signature(self, path):
+        try:
+            st = os.stat(path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _load_snapshot(self, user_id):
+        """(seq, events). Without a snapshot the shard files are the starting point."""
+        try:
+            with open(self.snapshot_path(user_id), 'r') as f:
+                snapshot = json.load(f)
+            return snapshot["seq"], snapshot["events"]
+        except FileNotFoundError:
+            return 0, super().get_all_events(user_id)
+
+    def _replay(self, state, user_id):
+        """
+        Applies journal ops past state["offset"]. Stops at the first line that
+        isn't a complete JSON record: a crash mid-append leaves at most one torn
+        line at the tail, which the next write truncates away.
+        """
+        try:
+            with open(self.journal_path(user_id), 'rb') as f:
+                f.seek(state["offset"])
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        break
+                    state["offset"] += len(line)
+                    if op["seq"] <= state["seq"]:
+                        continue  # already in the snapshot (crash between snapshot and truncate)
+                    self._apply_op(state["events"], op)
+                    state["seq"] = op["seq"]
+                    state["ops"] += 1
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _apply_op(events, op):
+        if "put" in op:
+            event = op["put"]
+            # Re-inserted at the end, like a rewritten event in the year files
+            events.pop(event["id"], None)
+            events[event["id"]] = event
+        else:
+            events.pop(op["del"], None)
+
+    def _state(self, user_id):
+        """The user's replayed state, brought up to date with the files on disk."""
+        snapshot_sig = self._signature(self.snapshot_path(user_id))
+        journal_sig = self._signature(self.journal_path(user_id))
+        with self._states_lock:
+            state = self._states.get(user_id)
+            if state is not None and state["snapshot_sig"] == snapshot_sig:
+                if journal_sig is None or (journal_sig[0] == state["journal_ino"] and journal_sig[2] == state["offset"]):
+                    return state
+                if journal_sig[0] == state["journal_ino"] and journal_sig[2] > state["offset"]:
+                    # Another process appended: replay just the new tail
+                    self._replay(state, user_id)
+                    return state
+
+            seq, events = self._load_snapshot(user_id)
+            state = {
+                "events": {},
+                "seq": seq,
+                "offset": 0,
+                "ops": 0,
+                "snapshot_sig": snapshot_sig,
+                "journal_ino": journal_sig[0] if journal_sig else None,
+            }
+            for event in events:
+                if isinstance(event, dict):
+                    if not event.get("id"):
+                        # Ops address events by id; the next compaction writes this one out
+                        event = {**event, "id": f"evt-{uuid.uuid4()}"}
+                    state["events"][event["id"]] = event
+            self._replay(state, user_id)
+            self._states[user_id] = state
+            return state
+
+    # --- Reads ---
+
+    def get_all_events(self, user_id):
+        state = self._state(user_id)
+        with self._states_lock:
+            events = list(state["events"].values())
+        # Same order as the json backend: by year, then insertion order
+        return sorted(events, key=lambda event: event_year(event) or "")
+
+    def get_events_for_range(self, user_id, start_date, end_date):
+        # The shard files lag behind the journal, so filter the replayed events instead
+        return events_for_range(self.get_all_events(user_id), start_date, end_date)
+
+    # The replayed events are in memory already; iterate them, not the shard files
+    def iter_all_events(self, user_id):
+        return iter(self.get_all_events(user_id))
+
+    def iter_events_for_range(self, user_id, start_date, end_date):
+        return iter(self.get_events_for_range(user_id, start_date, end_date))
+
+    def get_event(self, user_id, event_id):
+        return self._state(user_id)["events"].get(event_id)
+
+    def find_series(self, user_id, recurrence_id):
+        return [event for event in self.get_all_events(user_id) if event.get("recurrenceId") == recurrence_id]
+
+    # --- Writes ---
+
+    def save_all_events(self, user_id, all_events):
+        new_events = {}
+        for event in all_events:
+            if event_year(event) is None:
+                log.warning("Skipping event with no date: %s", event.get('title', 'Untitled Event'))
+                continue
+            # A copy, so the caller's dicts aren't given ids behind their back
+            event = {"id": f"evt-{uuid.uuid4()}", **event} if "id" not in event else event
+            new_events[event["id"]] = event
+
+        with self._write_lock(user_id):
+            current = self._state(user_id)["events"]
+            upserts = [event for event_id, event in new_events.items() if current.get(event_id) != event]
+            delete_ids = [event_id for event_id in current if event_id not in new_events]
+            return self._append_ops(user_id, upserts, delete_ids)
+
+    def apply_event_changes(self, user_id, upserts, delete_ids):
+        with self._write_lock(user_id):
+            return self._append_ops(user_id, upserts, delete_ids)
+
+    def _append_ops(self, user_id, upserts, delete_ids):
+        """Journals the ops and applies them in memory. Caller holds _write_lock(user_id)."""
+        state = self._state(user_id)
+        current = state["events"]
+        delete_ids = [event_id for event_id in delete_ids if event_id in current]
+        if not upserts and not delete_ids:
+            return []
+
+        old_events = [current[event_id] for event_id in delete_ids]
+        old_events += [current[event["id"]] for event in upserts if event["id"] in current]
+        touched = {event_year(event) for event in old_events + list(upserts)}
+
+        ops = []
+        seq = state["seq"]
+        for event_id in delete_ids:
+            seq += 1
+            ops.append({"seq": seq, "del": event_id})
+        for event in upserts:
+            seq += 1
+            ops.append({"seq": seq, "put": event})
+        data = "".join(json.dumps(op, separators=(",", ":")) + "\n" for op in ops).encode("utf-8")
+
+        path = self.journal_path(user_id)
+        try:
+            with open(path, 'ab') as f:
+                if f.tell() > state["offset"]:
+                    f.truncate(state["offset"])  # drop a torn tail left by a crash
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._bump_revision(user_id, "events")
+        except OSError as e:
+            log.error("Error appending to journal %s: %s", path, e)
+            with self._states_lock:
+                self._states.pop(user_id, None)
+            return None
+
+        with self._states_lock:
+            # Replaying our own lines (rather than applying ops directly) stays
+            # correct even if a concurrent reader already replayed some of them
+            state["journal_ino"] = self._signature(path)[0]
+            self._replay(state, user_id)
+        self._append_changes(user_id, changes.event_changes(old_events, list(upserts)))
+        if state["ops"] >= self.compact_ops:
+            self._schedule_compaction(user_id)
+        return sorted(year for year in touched if year)
+
+    # --- Compaction ---
+
+    def _schedule_compaction(self, user_id):
+        with self._compact_cond:
+            self._compact_queue.add(user_id)
+            if self._compactor is None:
+                # Started lazily, like the AI workers, so importing never spawns threads
+                self._compactor = threading.Thread(target=self._compact_loop, name="journal-compactor", daemon=True)
+                self._compactor.start()
+            self._compact_cond.notify()
+
+    def _compact_loop(self):
+        while True:
+            with self._compact_cond:
+                while not self._compact_queue:
+                    self._compact_cond.wait()
+                user_id = self._compact_queue.pop()
+            try:
+                self.compact(user_id)
+            except Exception as e:
+                log.error("Error compacting journal for %s: %s", user_id, e)
+
+    def compact(self, user_id):
+        """
+        Folds the journal into a new snapshot and shard files, then empties it.
+        The snapshot records the last seq it covers, so a crash before the
+        journal is emptied only means those ops are skipped on the next replay.
+        """
+        with self._write_lock(user_id):
+            state = self._state(user_id)
+            events = self.get_all_events(user_id)
+
+            snapshot_path = self.snapshot_path(user_id)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(snapshot_path), prefix=".tmp-", suffix=".json")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({"seq": state["seq"], "events": events}, f, separators=(",", ":"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, snapshot_path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+            # Export: the shard files (and manifest) the json backend (and people) read.
+            # Already journaled, so no revision bump or change-log entries here.
+            shards = self._group_by_shard(user_id, events)
+            current = self._load_shards(user_id, list(shards))
+            self._store_shards(user_id, {key: shards[key] for key in shards if shards[key] != current.get(key)})
+
+            journal_path = self.journal_path(user_id)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(journal_path), prefix=".tmp-", suffix=".journal")
+            os.close(fd)
+            os.replace(tmp_path, journal_path)
+
+            with self._states_lock:
+                state["offset"] = 0
+                state["ops"] = 0
+                state["snapshot_sig"] = self._signature(snapshot_path)
+                state["journal_ino"] = self._signature(journal_path)[0]
+
+    def compact_all(self):
+        """Compacts every user with a journal; returns how many were compacted."""
+        compacted = 0
+        for user in self.get_users().values():
+            if os.path.exists(self.journal_path(user["id"])):
+                self.compact(user["id"])
+                compacted += 1
+        return compacted
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold every events journal into its snapshot and shard files.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    args = parser.parse_args()
+    print(f"Compacted {JournalStorage(args.data_dir).compact_all()} journals")
+
+if __name__ == "__main__":
+    main()
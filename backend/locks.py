@@ -0,0 +1,69 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.Lock()
+        return lock
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock shared by every thread and process that uses the same lock file.
+    flock/msvcrt locks are per open file, so a per-path thread lock is taken first.
+    Not re-entrant: never nest two file_lock calls on the same path.
+    """
+    path = os.path.abspath(path)
+    with _thread_lock(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+_held = threading.local()
+
+@contextmanager
+def reentrant_file_lock(path):
+    """
+    file_lock that the thread already holding it may take again (the inner
+    call is a no-op), so functions that lock can call other functions that lock.
+    """
+    path = os.path.abspath(path)
+    held = getattr(_held, "paths", None)
+    if held is None:
+        held = _held.paths = set()
+    if path in held:
+        yield
+        return
+    with file_lock(path):
+        held.add(path)
+        try:
+            yield
+        finally:
+            held.discard(path)
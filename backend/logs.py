@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+# Logging setup for the backend. Modules log through logging.getLogger(__name__);
+# configure_logging() (called once by app.py) decides the format and level.
+#   LOG_LEVEL       DEBUG / INFO / WARNING ... (default INFO)
+#   LOG_FORMAT      "json" (one object per line, for log shippers) or "text"
+#   LOG_RATE_LIMIT  records per minute allowed for each message template;
+#                   0 turns rate limiting off. A failing disk or provider
+#                   logs the same line per request, which would drown the rest.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", 60))
+
+# LogRecord attributes that are not user-supplied extra=... fields
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, msg, plus any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, with extra= fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extras = [f"{key}={value}" for key, value in vars(record).items()
+                  if key not in _RESERVED and not key.startswith("_")]
+        if extras:
+            line += " " + " ".join(extras)
+        return line
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `per_minute` records per (logger, level, message
+    template) each minute. The first record after a suppressed stretch
+    carries the number dropped as `suppressed`.
+    """
+
+    def __init__(self, per_minute):
+        super().__init__()
+        self.per_minute = per_minute
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.per_minute <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window["start"] >= 60:
+                suppressed = window["suppressed"] if window else 0
+                window = self._windows[key] = {"start": now, "count": 0, "suppressed": suppressed}
+            if window["count"] >= self.per_minute:
+                window["suppressed"] += 1
+                return False
+            window["count"] += 1
+            if window["suppressed"]:
+                record.suppressed = window["suppressed"]
+                window["suppressed"] = 0
+        return True
+
+_configured = False
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, rate_limit=LOG_RATE_LIMIT):
+    """Installs one stderr handler on the root logger. Safe to call more than once."""
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    handler.addFilter(RateLimitFilter(rate_limit))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    _configured = True
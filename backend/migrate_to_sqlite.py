@@ -0,0 +1,67 @@
+"""
+Imports an existing data/ tree (users.json + data/<user_id>/*.json) into a
+SQLite database for STORAGE_BACKEND=sqlite.
+
+    python backend/migrate_to_sqlite.py --data-dir data --db data/calendar.db
+
+Safe to re-run: users, profiles and tasks are replaced and each user's events
+are synced to match the JSON files.
+"""
+import os
+import re
+import json
+import glob
+import argparse
+from storage import JsonStorage
+from sqlite_storage import SqliteStorage
+
+TASKS_PATTERN = re.compile(r"^(\d{4})_tasks\.json$")
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading {path}: {e}")
+        return default
+
+def migrate(data_dir, db_path):
+    source = JsonStorage(data_dir)
+    target = SqliteStorage(db_path)
+
+    users = source.get_users()
+    target.save_users(users)
+    print(f"Imported {len(users)} users")
+
+    for username, user in users.items():
+        user_id = user["id"]
+        user_dir = os.path.join(data_dir, user_id)
+        if not os.path.isdir(user_dir):
+            print(f"No data directory for {username} ({user_id}), skipping")
+            continue
+
+        target.save_profile(user_id, source.get_profile(user_id))
+
+        # Every shard in the user's manifest (year or month files, any year)
+        all_events = [e for e in source.get_all_events(user_id) if isinstance(e, dict)]
+        task_years = 0
+        for path in sorted(glob.glob(os.path.join(user_dir, "*_tasks.json"))):
+            match = TASKS_PATTERN.match(os.path.basename(path))
+            if match:
+                target.save_tasks(user_id, match.group(1), _load_json(path, {}))
+                task_years += 1
+
+        if target.save_all_events(user_id, all_events) is None:
+            print(f"Failed to import events for {user_id}")
+            continue
+        print(f"{user_id}: {len(all_events)} events, {task_years} task years")
+
+def main():
+    parser = argparse.ArgumentParser(description="Import JSON data files into SQLite.")
+    parser.add_argument("--data-dir", default="data", help="JSON data directory (default: data)")
+    parser.add_argument("--db", default=os.path.join("data", "calendar.db"), help="SQLite database path")
+    args = parser.parse_args()
+    migrate(args.data_dir, args.db)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import random
+import threading
+from collections import Counter
+
+# Opt-in sampling profiler for single requests. When PROFILE_REQUESTS=1, a
+# request sent with "X-Profile: 1" (or picked at PROFILE_SAMPLE_RATE) has its
+# thread's stack sampled every PROFILE_INTERVAL_MS by a background thread. The
+# samples are written in the folded-stack format (one "frame;frame;frame count"
+# line per distinct stack) that flamegraph.pl and speedscope read, and the
+# file name comes back in the X-Profile-File response header.
+# Sampling only reads sys._current_frames(), so the profiled request runs at
+# nearly full speed; it is off unless asked for.
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("data", "profiles"))
+
+def should_profile(headers):
+    """Whether this request gets profiled; always False unless PROFILE_REQUESTS is on."""
+    if not PROFILE_REQUESTS:
+        return False
+    if headers.get("X-Profile") == "1":
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def _folded(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+class SamplingProfiler:
+    """Samples one thread's stack until stop(); start() from the thread being profiled."""
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.samples = Counter()
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                break
+            self.samples[_folded(frame)] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+
+    def write(self, label):
+        """Writes the folded stacks to PROFILE_DIR; returns the file name."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe = "".join(ch if ch.isalnum() else "_" for ch in label).strip("_")
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{safe}-{int(self.elapsed * 1000)}ms.folded"
+        with open(os.path.join(PROFILE_DIR, name), "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return name
@@ -0,0 +1,432 @@
+import os
+import calendar
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+# Mirrors frontend/src/services/recurrence.js so the backend can expand
+# recurring series itself and only send the instances a view needs.
+
+WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+
+# Guard against rules that never produce a date (e.g. BYMONTHDAY=30;BYMONTH=2)
+MAX_PERIODS = 100000
+
+# Year-long windows of occurrence dates kept by OccurrenceCache
+RECURRENCE_CACHE_MAX_WINDOWS = int(os.getenv("RECURRENCE_CACHE_MAX_WINDOWS", 50000))
+
+def parse_date(value):
+    """Parses a 'YYYY-MM-DD' string into a date. Returns None if invalid."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def _parse_until(value):
+    """UNTIL can be a DATE ('20251231') or a DATE-TIME ('20251231T235959Z')."""
+    value = value.rstrip("Z")
+    for fmt in ("%Y%m%dT%H%M%S", "%Y%m%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _parse_byday(value):
+    """'MO,-1FR,2TU' -> [(None, 0), (-1, 4), (2, 1)]"""
+    days = []
+    for part in value.split(","):
+        part = part.strip().upper()
+        if len(part) < 2 or part[-2:] not in WEEKDAYS:
+            continue
+        ordinal = part[:-2]
+        days.append((int(ordinal) if ordinal not in ("", "+") else None, WEEKDAYS[part[-2:]]))
+    return days
+
+def parse_rrule(rule_str):
+    """
+    Parses an RRULE string (with or without the 'RRULE:' prefix) into a dict.
+    Returns None for 'NONE', empty or unsupported rules.
+    """
+    if not rule_str or not isinstance(rule_str, str) or rule_str.upper() == "NONE":
+        return None
+    if rule_str.upper().startswith("RRULE:"):
+        rule_str = rule_str[6:]
+
+    rule = {"freq": None, "interval": 1, "count": None, "until": None,
+            "byday": [], "bymonthday": [], "bymonth": [], "wkst": 0}
+    try:
+        for part in rule_str.split(";"):
+            if "=" not in part:
+                continue
+            key, value = part.split("=", 1)
+            key = key.strip().upper()
+            value = value.strip()
+            if key == "FREQ":
+                rule["freq"] = value.upper()
+            elif key == "INTERVAL":
+                rule["interval"] = max(1, int(value))
+            elif key == "COUNT":
+                rule["count"] = int(value)
+            elif key == "UNTIL":
+                rule["until"] = _parse_until(value)
+            elif key == "BYDAY":
+                rule["byday"] = _parse_byday(value)
+            elif key == "BYMONTHDAY":
+                rule["bymonthday"] = [int(v) for v in value.split(",") if v]
+            elif key == "BYMONTH":
+                rule["bymonth"] = [int(v) for v in value.split(",") if v]
+            elif key == "WKST":
+                rule["wkst"] = WEEKDAYS.get(value.upper(), 0)
+    except ValueError:
+        return None
+
+    if rule["freq"] not in FREQUENCIES:
+        return None
+    return rule
+
+# --- Candidate generation per period ---
+
+def _add_months(year, month, n):
+    total = year * 12 + (month - 1) + n
+    return total // 12, total % 12 + 1
+
+def _nth_weekdays(days, byday):
+    """Picks days from an ordered list (a month or a year) matching BYDAY, honouring ordinals."""
+    picked = set()
+    for ordinal, weekday in byday:
+        matching = [d for d in days if d.weekday() == weekday]
+        if ordinal is None:
+            picked.update(matching)
+        elif 0 < ordinal <= len(matching):
+            picked.add(matching[ordinal - 1])
+        elif ordinal < 0 and -ordinal <= len(matching):
+            picked.add(matching[ordinal])
+    return picked
+
+def _month_candidates(year, month, rule, dtstart):
+    last_day = calendar.monthrange(year, month)[1]
+    month_days = [date(year, month, d) for d in range(1, last_day + 1)]
+
+    if rule["bymonthday"]:
+        by_monthday = set()
+        for d in rule["bymonthday"]:
+            day = d if d > 0 else last_day + d + 1
+            if 1 <= day <= last_day:
+                by_monthday.add(date(year, month, day))
+        if rule["byday"]:
+            return sorted(by_monthday & _nth_weekdays(month_days, rule["byday"]))
+        return sorted(by_monthday)
+
+    if rule["byday"]:
+        return sorted(_nth_weekdays(month_days, rule["byday"]))
+
+    # Default: same day of the month as DTSTART (months without it are skipped)
+    if dtstart.day <= last_day:
+        return [date(year, month, dtstart.day)]
+    return []
+
+def _period_candidates(rule, dtstart, k):
+    """Returns the sorted candidate dates of the k-th period after DTSTART."""
+    freq = rule["freq"]
+    step = k * rule["interval"]
+
+    if freq == "DAILY":
+        day = dtstart + timedelta(days=step)
+        if rule["bymonth"] and day.month not in rule["bymonth"]:
+            return []
+        if rule["bymonthday"] and day.day not in rule["bymonthday"]:
+            return []
+        if rule["byday"] and day.weekday() not in [wd for _, wd in rule["byday"]]:
+            return []
+        return [day]
+
+    if freq == "WEEKLY":
+        week_start = dtstart - timedelta(days=(dtstart.weekday() - rule["wkst"]) % 7)
+        week_start += timedelta(weeks=step)
+        weekdays = [wd for _, wd in rule["byday"]] or [dtstart.weekday()]
+        days = [week_start + timedelta(days=i) for i in range(7)]
+        days = [d for d in days if d.weekday() in weekdays]
+        if rule["bymonth"]:
+            days = [d for d in days if d.month in rule["bymonth"]]
+        return days
+
+    if freq == "MONTHLY":
+        year, month = _add_months(dtstart.year, dtstart.month, step)
+        if rule["bymonth"] and month not in rule["bymonth"]:
+            return []
+        return _month_candidates(year, month, rule, dtstart)
+
+    # YEARLY
+    year = dtstart.year + step
+    if rule["byday"] and not rule["bymonth"] and not rule["bymonthday"]:
+        # e.g. FREQ=YEARLY;BYDAY=20MO - ordinals count within the year
+        year_days = [date(year, 1, 1) + timedelta(days=i)
+                     for i in range(366 if calendar.isleap(year) else 365)]
+        return sorted(_nth_weekdays(year_days, rule["byday"]))
+    if rule["bymonth"] or rule["bymonthday"] or rule["byday"]:
+        days = []
+        for month in (rule["bymonth"] or [dtstart.month]):
+            days.extend(_month_candidates(year, month, rule, dtstart))
+        return sorted(days)
+    if dtstart.month == 2 and dtstart.day == 29 and not calendar.isleap(year):
+        return []
+    return [date(year, dtstart.month, dtstart.day)]
+
+def _first_period(rule, dtstart, range_start):
+    """Index of the first period that can reach range_start (only valid without COUNT)."""
+    if range_start <= dtstart:
+        return 0
+    freq, interval = rule["freq"], rule["interval"]
+    if freq == "DAILY":
+        periods = (range_start - dtstart).days
+    elif freq == "WEEKLY":
+        periods = (range_start - dtstart).days // 7 - 1
+    elif freq == "MONTHLY":
+        periods = (range_start.year - dtstart.year) * 12 + range_start.month - dtstart.month - 1
+    else:
+        periods = range_start.year - dtstart.year - 1
+    return max(0, periods // interval)
+
+def occurrences(rule, dtstart, range_start, range_end, start_time=None):
+    """
+    Returns every occurrence date of a parsed rule between range_start and
+    range_end (both inclusive). DTSTART itself always counts as the first occurrence.
+    """
+    if range_end < range_start:
+        return []
+
+    until = rule["until"]
+    if until is not None and start_time is not None and until.time() != datetime.min.time():
+        until_date = until.date() if datetime.combine(until.date(), start_time) <= until \
+            else until.date() - timedelta(days=1)
+    elif until is not None:
+        until_date = until.date()
+    else:
+        until_date = None
+
+    count = rule["count"]
+    seen = 0
+    k = 0 if count is not None else _first_period(rule, dtstart, range_start)
+    dates = []
+
+    for _ in range(MAX_PERIODS):
+        candidates = _period_candidates(rule, dtstart, k)
+        k += 1
+        for day in candidates:
+            if day < dtstart:
+                continue
+            if until_date is not None and day > until_date:
+                return dates
+            if day > range_end:
+                return dates
+            seen += 1
+            if day >= range_start:
+                dates.append(day)
+            if count is not None and seen >= count:
+                return dates
+        if not candidates and _period_start_past(rule, dtstart, k, range_end, until_date):
+            return dates
+    return dates
+
+def _period_start_past(rule, dtstart, k, range_end, until_date):
+    """Stops empty-period loops once the next period begins after the window/UNTIL."""
+    step = k * rule["interval"]
+    freq = rule["freq"]
+    if freq == "DAILY":
+        start = dtstart + timedelta(days=step)
+    elif freq == "WEEKLY":
+        start = dtstart - timedelta(days=(dtstart.weekday() - rule["wkst"]) % 7) + timedelta(weeks=step)
+    elif freq == "MONTHLY":
+        year, month = _add_months(dtstart.year, dtstart.month, step)
+        start = date(year, month, 1)
+    else:
+        start = date(dtstart.year + step, 1, 1)
+    limit = min(range_end, until_date) if until_date is not None else range_end
+    return start > limit
+
+def series_end(base_event):
+    """
+    Last date a series can occur on, or None if it is open-ended (or too
+    irregular to tell, which callers must treat the same way).
+    """
+    dtstart = parse_date(base_event.get("date"))
+    if dtstart is None:
+        return None
+    rule = parse_rrule(base_event.get("recurrenceRule"))
+    if rule is None:
+        return dtstart
+    if rule["count"] is not None:
+        try:
+            dates = occurrences(rule, dtstart, dtstart, date(9999, 12, 31), _parse_time(base_event.get("startTime")))
+        except (ValueError, OverflowError):
+            return None
+        return dates[-1] if dates else dtstart
+    if rule["until"] is not None:
+        return max(rule["until"].date(), dtstart)
+    return None
+
+# --- Materialized occurrences ---
+
+class OccurrenceCache:
+    """
+    LRU of occurrence dates per series and calendar year, keyed by
+    (recurrenceId, rule, DTSTART, start time, year). Exceptions and ghosts are
+    applied on top of the cached dates in expand_series, so editing them never
+    makes an entry wrong, and an edited rule or start date simply misses under
+    its new key. invalidate_series() frees a series' entries once it changes.
+    """
+
+    def __init__(self, max_windows=RECURRENCE_CACHE_MAX_WINDOWS):
+        self.max_windows = max_windows
+        self._windows = OrderedDict()  # key -> [dates in that year]
+        self._series_keys = {}         # recurrenceId -> set of keys
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def dates(self, base_event, dtstart, range_start, range_end):
+        """Occurrence dates of base_event's rule between range_start and range_end (inclusive)."""
+        rule_str = base_event.get("recurrenceRule")
+        start_time_str = base_event.get("startTime")
+        series_id = base_event.get("recurrenceId") or base_event.get("id")
+        rule = None
+        dates = []
+        for year in range(max(range_start.year, dtstart.year), range_end.year + 1):
+            key = (series_id, rule_str, dtstart, start_time_str, year)
+            with self._lock:
+                window = self._windows.get(key)
+                if window is not None:
+                    self._windows.move_to_end(key)
+                    self._stats["hits"] += 1
+            if window is None:
+                if rule is None:
+                    rule = parse_rrule(rule_str)
+                    if rule is None:
+                        # A base event without a usable rule only occurs on its own date
+                        return [dtstart] if range_start <= dtstart <= range_end else []
+                window = occurrences(rule, dtstart, date(year, 1, 1), date(year, 12, 31), _parse_time(start_time_str))
+                self._store(series_id, key, window)
+            dates.extend(day for day in window if range_start <= day <= range_end)
+        return dates
+
+    def _store(self, series_id, key, window):
+        with self._lock:
+            self._stats["misses"] += 1
+            self._windows[key] = window
+            self._series_keys.setdefault(series_id, set()).add(key)
+            while len(self._windows) > self.max_windows:
+                evicted, _ = self._windows.popitem(last=False)
+                self._stats["evictions"] += 1
+                keys = self._series_keys.get(evicted[0])
+                if keys is not None:
+                    keys.discard(evicted)
+                    if not keys:
+                        del self._series_keys[evicted[0]]
+
+    def invalidate_series(self, recurrence_id):
+        """Drops every cached window of one series (its base, exceptions or ghosts changed)."""
+        with self._lock:
+            for key in self._series_keys.pop(recurrence_id, ()):
+                if self._windows.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["windows"] = len(self._windows)
+            stats["series"] = len(self._series_keys)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value or "", "%H:%M").time()
+    except (TypeError, ValueError):
+        return None
+
+_occurrence_cache = OccurrenceCache()
+
+def get_occurrence_cache():
+    """Returns the process-wide OccurrenceCache."""
+    return _occurrence_cache
+
+# --- Base / exception / ghost merge ---
+
+def expand_events(all_events, range_start, range_end):
+    """
+    Generates all viewable event instances between range_start and range_end
+    (inclusive dates) from the raw list of base events, exceptions and ghosts.
+    Same rules as generateRecurringInstances on the frontend.
+    """
+    return list(iter_instances(all_events, range_start, range_end))
+
+def iter_instances(all_events, range_start, range_end):
+    """
+    expand_events as a generator, for streaming responses. all_events may be
+    any iterable and is read once: single events are yielded as they pass,
+    only bases and exceptions are held until the series are expanded at the end.
+    """
+    exceptions_by_recur_id = {}
+    base_events = []
+
+    # 1. Separate base events from simple events and map exceptions
+    for event in all_events:
+        if not isinstance(event, dict):
+            continue
+        if event.get("recurrenceId"):
+            if event.get("isBaseEvent"):
+                base_events.append(event)
+            elif event.get("originalDate"):
+                # Modified instance or deleted instance (ghost), keyed by its *original* date
+                exceptions_by_recur_id.setdefault(event["recurrenceId"], {})[event["originalDate"]] = event
+        else:
+            event_date = parse_date(event.get("date"))
+            if event_date and range_start <= event_date <= range_end:
+                yield event
+
+    # 2. Generate instances for each base event
+    for base_event in base_events:
+        yield from expand_series(
+            base_event, exceptions_by_recur_id.get(base_event["recurrenceId"], {}),
+            range_start, range_end
+        )
+
+def expand_series(base_event, exceptions, range_start, range_end):
+    """Expands one recurring series, applying its exceptions and ghosts."""
+    dtstart = parse_date(base_event.get("date"))
+    if dtstart is None:
+        return []
+
+    dates = _occurrence_cache.dates(base_event, dtstart, range_start, range_end)
+
+    instances = []
+    for day in dates:
+        date_string = day.isoformat()
+        exception = exceptions.get(date_string)
+
+        if exception is not None:
+            # This instance was either modified or deleted (ghosts are simply skipped)
+            if not exception.get("isDeleted"):
+                # Its `date` may differ from date_string if it was moved!
+                exception_date = parse_date(exception.get("date"))
+                if exception_date and range_start <= exception_date <= range_end:
+                    instances.append({
+                        **base_event,
+                        **exception,
+                        "isInstance": True,
+                        "isException": True,
+                    })
+        else:
+            instances.append({
+                **base_event,
+                "id": f"{base_event.get('id')}-{date_string}",
+                "date": date_string,
+                "originalDate": date_string,
+                "isInstance": True,
+                "isException": False,
+            })
+    return instances
@@ -0,0 +1,278 @@
+import re
+import heapq
+import bisect
+import threading
+from datetime import date, timedelta
+from recurrence import get_occurrence_cache, series_end
+
+# Per-user inverted index over event title, location and description, behind
+# GET /api/events/search. Tokens are lowercased runs of letters and digits
+# ("ERC-SR10" -> "erc", "sr10"); every query token matches as a prefix and all
+# must match. The index is built once from the user's events, then kept
+# current by replaying the change log (see changes.py) from its cursor, and
+# snapshots are persisted through Storage.save_search_index, so a restart only
+# replays what changed since the last snapshot.
+
+SEARCH_FIELDS = ("title", "location", "description")
+# Fields kept per event: enough to show a result and expand a series
+DOC_FIELDS = ("id", "title", "location", "date", "startTime", "endTime", "color", "recurrenceRule",
+              "recurrenceId", "isBaseEvent", "isException", "isDeleted", "originalDate")
+INDEX_VERSION = 1
+# How far past the range start (or today) a series' next occurrence is looked for
+NEXT_OCCURRENCE_HORIZON_DAYS = 2 * 366
+
+_TOKEN = re.compile(r"\w+")
+
+def tokenize(text):
+    return _TOKEN.findall(str(text).casefold()) if text else []
+
+def _event_tokens(event):
+    tokens = set()
+    for field in SEARCH_FIELDS:
+        tokens.update(tokenize(event.get(field)))
+    return tokens
+
+def _day(value):
+    # recurrence.parse_date goes through strptime, which dominates a query's time
+    try:
+        return date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        return None
+
+class SearchIndex:
+    """
+    token -> event ids, plus a compact copy of each event (DOC_FIELDS) and the
+    members of each recurring series. Not thread-safe by itself: callers hold `lock`.
+    """
+
+    def __init__(self, cursor=-1):
+        self.cursor = cursor     # change-log seq this index reflects (-1: never built)
+        self.docs = {}           # id -> doc
+        self.postings = {}       # token -> set of ids
+        self.doc_tokens = {}     # id -> its tokens, to unindex it without re-reading the event
+        self.tokens = []         # sorted keys of postings, for prefix lookups
+        self.singles = {}        # id -> (date, startTime, id) sort key of each dated non-recurring event
+        self.series = {}         # recurrenceId -> {"base", "start", "end", "members": {originalDate: id}, "next"}
+        self.unsaved = 0         # changes applied since the last snapshot
+        self.lock = threading.Lock()
+
+    # --- Maintenance ---
+
+    def add(self, event, keep_sorted=True):
+        """Indexes (or re-indexes) one event. keep_sorted=False leaves `tokens` for the caller to sort."""
+        if not isinstance(event, dict) or not event.get("id"):
+            return
+        self.remove(event["id"])
+        doc = {field: event[field] for field in DOC_FIELDS if field in event}
+        event_id = doc["id"]
+        self.docs[event_id] = doc
+        tokens = _event_tokens(event)
+        self.doc_tokens[event_id] = tokens
+        for token in tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                if keep_sorted:
+                    bisect.insort(self.tokens, token)
+            ids.add(event_id)
+        self._link(doc)
+
+    def remove(self, event_id):
+        doc = self.docs.pop(event_id, None)
+        if doc is None:
+            return
+        for token in self.doc_tokens.pop(event_id, ()):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            ids.discard(event_id)
+            if not ids:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+        self._unlink(doc)
+
+    def _link(self, doc):
+        recurrence_id = doc.get("recurrenceId")
+        if not recurrence_id:
+            if _day(doc.get("date")) is not None:
+                self.singles[doc["id"]] = (doc["date"][:10], doc.get("startTime") or "", doc["id"])
+            return
+        entry = self.series.setdefault(recurrence_id, {"base": None, "start": None, "end": None, "members": {}})
+        entry["next"] = None
+        if doc.get("isBaseEvent"):
+            entry.update(base=doc["id"], start=_day(doc.get("date")), end=series_end(doc))
+        elif doc.get("originalDate"):
+            entry["members"][doc["originalDate"]] = doc["id"]
+
+    def _unlink(self, doc):
+        self.singles.pop(doc["id"], None)
+        entry = self.series.get(doc.get("recurrenceId"))
+        if entry is None:
+            return
+        entry["next"] = None
+        if entry["base"] == doc["id"]:
+            entry.update(base=None, start=None, end=None)
+        if entry["members"].get(doc.get("originalDate")) == doc["id"]:
+            del entry["members"][doc["originalDate"]]
+        if entry["base"] is None and not entry["members"]:
+            del self.series[doc["recurrenceId"]]
+
+    def apply(self, entries):
+        """Replays change-log entries (full new state per event, None on delete)."""
+        for entry in entries:
+            if entry.get("type") != "event":
+                continue
+            if entry.get("data") is None:
+                self.remove(entry["id"])
+            else:
+                self.add(entry["data"])
+            self.unsaved += 1
+
+    def rebuild(self, events, cursor):
+        """Replaces the whole index with the given events, as of change-log seq `cursor`."""
+        self.docs, self.postings, self.doc_tokens, self.singles, self.series = {}, {}, {}, {}, {}
+        for event in events:
+            self.add(event, keep_sorted=False)
+        self.tokens = sorted(self.postings)
+        self.cursor = cursor
+        self.unsaved = 0
+
+    # --- Persistence ---
+
+    def to_dict(self):
+        return {
+            "version": INDEX_VERSION,
+            "cursor": self.cursor,
+            "docs": self.docs,
+            "postings": {token: sorted(ids) for token, ids in self.postings.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """The index from a to_dict() snapshot, or None if it is unusable."""
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return None
+        try:
+            index = cls(int(data["cursor"]))
+            index.docs = dict(data["docs"])
+            index.postings = {token: set(ids) for token, ids in data["postings"].items()}
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None
+        index.tokens = sorted(index.postings)
+        for token, ids in index.postings.items():
+            for event_id in ids:
+                index.doc_tokens.setdefault(event_id, set()).add(token)
+        for doc in index.docs.values():
+            index._link(doc)
+        return index
+
+    # --- Queries ---
+
+    def _prefix_ids(self, prefix):
+        ids = set()
+        position = bisect.bisect_left(self.tokens, prefix)
+        while position < len(self.tokens) and self.tokens[position].startswith(prefix):
+            ids |= self.postings[self.tokens[position]]
+            position += 1
+        return ids
+
+    def match(self, query):
+        """Ids of events whose fields contain a token starting with every query token."""
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)  # longest first: usually rarest
+        if not terms:
+            return set()
+        ids = None
+        for term in terms:
+            found = self._prefix_ids(term)
+            ids = found if ids is None else ids & found
+            if not ids:
+                break
+        return ids
+
+    def _next_occurrence(self, entry, after, until):
+        """(date, instance summary) of the series' first visible instance in after..until, or None."""
+        # Remembered per window until the series changes: the same search is usually repeated
+        if entry["next"] is not None and entry["next"][:2] == (after, until):
+            return entry["next"][2]
+        found = self._find_next_occurrence(entry, after, until)
+        entry["next"] = (after, until, found)
+        return found
+
+    def _find_next_occurrence(self, entry, after, until):
+        base = self.docs[entry["base"]]
+        dtstart = entry["start"]
+        if entry["end"] is not None:
+            until = min(until, entry["end"])
+        exceptions = {original: self.docs[event_id] for original, event_id in entry["members"].items()}
+
+        # Moved instances can land anywhere, so they are checked directly
+        best = None
+        for exception in exceptions.values():
+            day = _day(exception.get("date"))
+            if not exception.get("isDeleted") and day is not None and after <= day <= until:
+                if best is None or (day, exception.get("startTime") or "") < (best[0], best[1].get("startTime") or ""):
+                    best = (day, {**base, **exception})
+
+        # Then the first date the rule produces that no exception or ghost replaces,
+        # looking a month ahead first and a year at a time after that
+        cache = get_occurrence_cache()
+        window_start, span = max(after, dtstart), 31
+        while window_start <= until and (best is None or window_start <= best[0]):
+            window_end = min(until, window_start + timedelta(days=span))
+            day = next((day for day in cache.dates(base, dtstart, window_start, window_end)
+                        if day.isoformat() not in exceptions), None)
+            if day is not None:
+                if best is None or day < best[0]:
+                    best = (day, {**base, "id": f"{base['id']}-{day.isoformat()}", "date": day.isoformat()})
+                break
+            window_start, span = window_end + timedelta(days=1), 366
+        if best is None:
+            return None
+        return best[0], {key: best[1].get(key) for key in ("id", "title", "date", "startTime", "endTime", "location")}
+
+    def search(self, query, start=None, end=None, limit=50, today=None):
+        """
+        (results, total) for the query, soonest first. Single events are
+        filtered to start..end; a recurring series matched through its base or
+        any exception is reported once, with its next occurrence on or after
+        start (else today) and within end, and left out when a range is given
+        and it has none there. Only the returned page is copied out.
+        """
+        start_key = start.isoformat() if start else None
+        end_key = end.isoformat() if end else None
+        ranked = []           # (date, startTime, id) of every hit
+        matched_series = set()
+        for event_id in self.match(query):
+            key = self.singles.get(event_id)
+            if key is not None:
+                if (start_key is None or key[0] >= start_key) and (end_key is None or key[0] <= end_key):
+                    ranked.append(key)
+                continue
+            recurrence_id = self.docs[event_id].get("recurrenceId")
+            if recurrence_id:
+                matched_series.add(recurrence_id)
+
+        upcoming = {}         # base id -> next occurrence summary
+        after = start or today or date.today()
+        until = end or after + timedelta(days=NEXT_OCCURRENCE_HORIZON_DAYS)
+        for recurrence_id in matched_series:
+            entry = self.series.get(recurrence_id)
+            if entry is None or entry["base"] is None or entry["start"] is None:
+                continue
+            found = self._next_occurrence(entry, after, until)
+            if found is not None:
+                upcoming[entry["base"]] = found[1]
+                ranked.append((found[0].isoformat(), found[1].get("startTime") or "", entry["base"]))
+            elif start is None and end is None:
+                # Over, or nothing left within the horizon: listed after everything dated
+                upcoming[entry["base"]] = None
+                ranked.append(("9999", "", entry["base"]))
+
+        results = []
+        for _, _, event_id in heapq.nsmallest(limit, ranked):
+            doc = self.docs[event_id]
+            if event_id in upcoming:
+                results.append({**doc, "isSeries": True, "nextOccurrence": upcoming[event_id]})
+            else:
+                results.append(dict(doc))
+        return results, len(ranked)
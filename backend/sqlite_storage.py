@@ -0,0 +1,460 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+import uuid
+from storage import DATA_DIR, Storage, event_year
+from locks import reentrant_file_lock
+import changes
+
+log = logging.getLogger(__name__)
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(DATA_DIR, "calendar.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    date TEXT,
+    original_date TEXT,
+    recurrence_id TEXT,
+    is_base INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_events_user_date ON events (user_id, date);
+CREATE INDEX IF NOT EXISTS idx_events_user_original_date ON events (user_id, original_date);
+CREATE INDEX IF NOT EXISTS idx_events_user_recurrence ON events (user_id, recurrence_id);
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    user_id TEXT NOT NULL,
+    store TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (user_id, store)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    user_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    op TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT,
+    PRIMARY KEY (user_id, seq)
+);
+CREATE TABLE IF NOT EXISTS search_indexes (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    user_id TEXT NOT NULL,
+    year TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, year)
+);
+"""
+
+def _event_row(user_id, event):
+    """Splits out the indexed columns; the full event is kept as JSON in `data`."""
+    return (
+        user_id,
+        event["id"],
+        event.get("date"),
+        event.get("originalDate"),
+        event.get("recurrenceId"),
+        1 if event.get("isBaseEvent") else 0,
+        json.dumps(event),
+    )
+
+class SqliteStorage(Storage):
+    """
+    Single-file SQLite store (WAL mode) with indexes on user, date, originalDate
+    and recurrenceId, so range reads and single-event writes are index lookups.
+    Events without an id are given one on write, since id is the row key.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Events ---
+
+    def get_all_events(self, user_id):
+        return list(self.iter_all_events(user_id))
+
+    def iter_all_events(self, user_id):
+        # Rows are decoded as the cursor steps, so a streamed response never holds them all
+        rows = self._conn().execute(
+            "SELECT data FROM events WHERE user_id = ? ORDER BY rowid", (user_id,)
+        )
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def get_events_for_range(self, user_id, start_date, end_date):
+        return list(self.iter_events_for_range(user_id, start_date, end_date))
+
+    def iter_events_for_range(self, user_id, start_date, end_date):
+        start, end = start_date.isoformat(), end_date.isoformat()
+        rows = self._conn().execute(
+            """
+            SELECT data FROM events WHERE user_id = ? AND recurrence_id IS NULL AND date BETWEEN ? AND ?
+            UNION ALL
+            SELECT data FROM events WHERE user_id = ? AND recurrence_id IS NOT NULL AND is_base = 1 AND date <= ?
+            UNION ALL
+            SELECT data FROM events WHERE user_id = ? AND recurrence_id IS NOT NULL AND is_base = 0
+                AND original_date BETWEEN ? AND ?
+            """,
+            (user_id, start, end, user_id, end, user_id, start, end),
+        )
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def get_event(self, user_id, event_id):
+        row = self._conn().execute(
+            "SELECT data FROM events WHERE user_id = ? AND id = ?", (user_id, event_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_series(self, user_id, recurrence_id):
+        rows = self._conn().execute(
+            "SELECT data FROM events WHERE user_id = ? AND recurrence_id = ? ORDER BY rowid",
+            (user_id, recurrence_id),
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def save_all_events(self, user_id, all_events):
+        new_events = {}
+        for event in all_events:
+            # A copy, so the caller's dicts aren't given ids behind their back
+            event = {"id": f"evt-{uuid.uuid4()}", **event} if "id" not in event else event
+            new_events[event["id"]] = event
+
+        conn = self._conn()
+        try:
+            with conn:
+                existing = {
+                    event_id: (data, event_year(json.loads(data)))
+                    for event_id, data in conn.execute(
+                        "SELECT id, data FROM events WHERE user_id = ?", (user_id,)
+                    )
+                }
+                touched = set()
+                delete_ids = [event_id for event_id in existing if event_id not in new_events]
+                for event_id in delete_ids:
+                    touched.add(existing[event_id][1])
+                upserts = []
+                for event_id, event in new_events.items():
+                    old = existing.get(event_id)
+                    # Compare parsed, so the same event with its keys reordered isn't a change
+                    if old is None or json.loads(old[0]) != event:
+                        upserts.append(event)
+                        touched.add(event_year(event))
+                        if old is not None:
+                            touched.add(old[1])
+                self._write(conn, user_id, upserts, delete_ids)
+        except sqlite3.Error as e:
+            log.error("Error saving events for %s: %s", user_id, e)
+            return None
+        changes.notify(user_id)
+        return sorted(year for year in touched if year)
+
+    def apply_event_changes(self, user_id, upserts, delete_ids):
+        conn = self._conn()
+        try:
+            with conn:
+                touched = set()
+                for event_id in set(delete_ids) | {event["id"] for event in upserts}:
+                    old = conn.execute(
+                        "SELECT data FROM events WHERE user_id = ? AND id = ?", (user_id, event_id)
+                    ).fetchone()
+                    if old:
+                        touched.add(event_year(json.loads(old[0])))
+                touched.update(event_year(event) for event in upserts)
+                self._write(conn, user_id, upserts, delete_ids)
+        except sqlite3.Error as e:
+            log.error("Error applying event changes for %s: %s", user_id, e)
+            return None
+        changes.notify(user_id)
+        return sorted(year for year in touched if year)
+
+    def _write(self, conn, user_id, upserts, delete_ids):
+        if upserts or delete_ids:
+            self._bump_revision(conn, user_id, "events")
+        entries = []
+        for event in upserts:
+            old = conn.execute(
+                "SELECT data FROM events WHERE user_id = ? AND id = ?", (user_id, event["id"])
+            ).fetchone()
+            if old is None or json.loads(old[0]) != event:
+                entries.append({"type": "event", "op": "create" if old is None else "update",
+                                "id": event["id"], "data": event})
+        for event_id in delete_ids:
+            if conn.execute("SELECT 1 FROM events WHERE user_id = ? AND id = ?", (user_id, event_id)).fetchone():
+                entries.append({"type": "event", "op": "delete", "id": event_id, "data": None})
+        self._append_changes(conn, user_id, entries)
+
+        conn.executemany(
+            "DELETE FROM events WHERE user_id = ? AND id = ?",
+            [(user_id, event_id) for event_id in delete_ids],
+        )
+        # DELETE + INSERT rather than REPLACE-in-place, so a changed event moves to
+        # the end like it does in the JSON shards
+        conn.executemany(
+            "DELETE FROM events WHERE user_id = ? AND id = ?",
+            [(user_id, event["id"]) for event in upserts],
+        )
+        conn.executemany(
+            "INSERT INTO events (user_id, id, date, original_date, recurrence_id, is_base, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [_event_row(user_id, event) for event in upserts],
+        )
+
+    # --- Locking ---
+
+    def user_lock(self, user_id):
+        # A write transaction only covers one storage call; this spans a whole
+        # read-modify-write, so it is a lock file next to the database
+        directory = os.path.dirname(os.path.abspath(self.path))
+        return reentrant_file_lock(os.path.join(directory, ".locks", f"{user_id}.lock"))
+
+    # --- Revisions ---
+
+    def _bump_revision(self, conn, user_id, store):
+        # Same transaction as the write it describes
+        conn.execute(
+            "INSERT INTO revisions (user_id, store, value) VALUES (?, ?, 1) "
+            "ON CONFLICT (user_id, store) DO UPDATE SET value = value + 1",
+            (user_id, store),
+        )
+
+    def get_revision(self, user_id, store):
+        row = self._conn().execute(
+            "SELECT value FROM revisions WHERE user_id = ? AND store = ?", (user_id, store)
+        ).fetchone()
+        return row[0] if row else 0
+
+    # --- Change log ---
+
+    def _append_changes(self, conn, user_id, entries):
+        """
+        Appends to the change log inside the caller's write transaction. Callers
+        write (bump the revision) first, so the seq is read under the write lock.
+        """
+        if not entries:
+            return
+        row = conn.execute("SELECT value FROM sequences WHERE name = ?", (f"changes:{user_id}",)).fetchone()
+        first = (row[0] if row else 0) + 1
+        conn.executemany(
+            "INSERT INTO changes (user_id, seq, type, op, id, data) VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, first + offset, entry["type"], entry["op"], entry["id"],
+              None if entry["data"] is None else json.dumps(entry["data"]))
+             for offset, entry in enumerate(entries)],
+        )
+        last = first + len(entries) - 1
+        conn.execute(
+            "INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (f"changes:{user_id}", last)
+        )
+        if last // changes.CHANGE_LOG_COMPACT_EVERY != (first - 1) // changes.CHANGE_LOG_COMPACT_EVERY:
+            self._compact_changes(conn, user_id)
+
+    def _compact_changes(self, conn, user_id):
+        entries, floor = self._read_changes(conn, user_id)
+        kept, floor = changes.compact(entries, floor)
+        if len(kept) == len(entries):
+            return
+        kept_seqs = {entry["seq"] for entry in kept}
+        conn.executemany(
+            "DELETE FROM changes WHERE user_id = ? AND seq = ?",
+            [(user_id, entry["seq"]) for entry in entries if entry["seq"] not in kept_seqs],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (f"changes_floor:{user_id}", floor)
+        )
+
+    def _read_changes(self, conn, user_id, since=0):
+        row = conn.execute("SELECT value FROM sequences WHERE name = ?", (f"changes_floor:{user_id}",)).fetchone()
+        floor = row[0] if row else 0
+        entries = [
+            {"seq": seq, "type": type_, "op": op, "id": id_, "data": None if data is None else json.loads(data)}
+            for seq, type_, op, id_, data in conn.execute(
+                "SELECT seq, type, op, id, data FROM changes WHERE user_id = ? AND seq > ? ORDER BY seq",
+                (user_id, since),
+            )
+        ]
+        return entries, floor
+
+    def get_changes(self, user_id, since):
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM sequences WHERE name = ?", (f"changes:{user_id}",)).fetchone()
+        cursor = row[0] if row else 0
+        entries, floor = self._read_changes(conn, user_id, max(since, 0))
+        return changes.select(entries, since, cursor, floor)
+
+    # --- Tasks ---
+
+    def get_tasks(self, user_id, year):
+        try:
+            row = self._conn().execute(
+                "SELECT data FROM tasks WHERE user_id = ? AND year = ?", (user_id, str(year))
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.error("Error getting tasks for %s, %s: %s", user_id, year, e)
+            return None
+        return json.loads(row[0]) if row else {}
+
+    def save_tasks(self, user_id, year, tasks_data):
+        try:
+            with self._conn() as conn:
+                self._bump_revision(conn, user_id, f"tasks:{year}")
+                conn.execute(
+                    "INSERT OR REPLACE INTO tasks (user_id, year, data) VALUES (?, ?, ?)",
+                    (user_id, str(year), json.dumps(tasks_data)),
+                )
+                self._append_changes(conn, user_id, [changes.tasks_change(year, tasks_data)])
+            changes.notify(user_id)
+            return True
+        except sqlite3.Error as e:
+            log.error("Error saving tasks for %s, %s: %s", user_id, year, e)
+            return False
+
+    # --- Search index ---
+
+    def load_search_index(self, user_id):
+        try:
+            row = self._conn().execute(
+                "SELECT data FROM search_indexes WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.error("Error reading search index %s: %s", user_id, e)
+            return None
+        return json.loads(row[0]) if row is not None else None
+
+    def save_search_index(self, user_id, data):
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO search_indexes (user_id, data) VALUES (?, ?)",
+                    (user_id, json.dumps(data)),
+                )
+        except sqlite3.Error as e:
+            log.error("Error saving search index %s: %s", user_id, e)
+
+    # --- Profile ---
+
+    def get_profile(self, user_id):
+        try:
+            row = self._conn().execute(
+                "SELECT data FROM profiles WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.error("Error reading profile %s: %s", user_id, e)
+            return None
+        if row is None:
+            # This shouldn't happen if registration worked
+            return {"username": "Error", "photoUrl": ""}
+        return json.loads(row[0])
+
+    def save_profile(self, user_id, profile_data):
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO profiles (user_id, data) VALUES (?, ?)",
+                    (user_id, json.dumps(profile_data)),
+                )
+            return True
+        except sqlite3.Error as e:
+            log.error("Error saving profile %s: %s", user_id, e)
+            return False
+
+    def user_exists(self, user_id):
+        try:
+            return self._conn().execute(
+                "SELECT 1 FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone() is not None
+        except sqlite3.Error as e:
+            log.error("Error looking up user %s: %s", user_id, e)
+            return False
+
+    # --- Users ---
+
+    def get_users(self):
+        rows = self._conn().execute("SELECT username, data FROM users ORDER BY rowid")
+        return {username: json.loads(data) for username, data in rows}
+
+    def save_users(self, users):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany(
+                "INSERT INTO users (username, user_id, data) VALUES (?, ?, ?)",
+                [(username, user["id"], json.dumps(user)) for username, user in users.items()],
+            )
+
+    def get_user(self, username):
+        row = self._conn().execute(
+            "SELECT data FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_user(self, username, user):
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, user_id, data) VALUES (?, ?, ?)",
+                    (username, user["id"], json.dumps(user)),
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def allocate_user_id(self):
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes can't read the same value
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM sequences WHERE name = 'user_id'").fetchone()
+            if row is None:
+                # First allocation: continue after the highest existing id
+                last_id = max(
+                    (int(user_id.split("_")[-1]) for (user_id,) in conn.execute("SELECT user_id FROM users")
+                     if user_id.split("_")[-1].isdigit()),
+                    default=0,
+                )
+            else:
+                last_id = row[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO sequences (name, value) VALUES ('user_id', ?)", (last_id + 1,)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return f"user_{last_id + 1}"
+
+    def init_user(self, user_id, username):
+        self.save_profile(user_id, {"username": username, "photoUrl": ""})
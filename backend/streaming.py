@@ -0,0 +1,54 @@
+import os
+import json
+from flask import Response
+
+# Event lists can run to many megabytes. Instead of jsonify(), which builds the
+# whole list and then the whole encoded body, responses are encoded item by
+# item from an iterator and sent as a chunked body once they get big, so a
+# request holds about one chunk (plus one shard on the storage side) at a time.
+
+# Bodies that end below this are buffered and sent whole (with a Content-Length,
+# compressed in one go); past it the rest is streamed
+STREAM_MIN_BYTES = int(os.getenv("STREAM_MIN_BYTES", 256 * 1024))
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", 64 * 1024))
+
+def iter_json_array(items, chunk_bytes=STREAM_CHUNK_BYTES):
+    """Encodes an iterable as one JSON array, yielded in chunks of about chunk_bytes."""
+    # Same output as jsonify outside debug mode (compact, sorted keys)
+    encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=True, sort_keys=True).encode
+    parts = [b"["]
+    size = 1
+    first = True
+    for item in items:
+        encoded = encode(item).encode("utf-8")
+        if not first:
+            parts.append(b",")
+            size += 1
+        parts.append(encoded)
+        size += len(encoded)
+        first = False
+        if size >= chunk_bytes:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+    parts.append(b"]\n")
+    yield b"".join(parts)
+
+def json_array_response(items, min_stream_bytes=STREAM_MIN_BYTES):
+    """
+    200 response with the JSON array of items. Small results come back as a
+    normal response; once the encoded body passes min_stream_bytes, the
+    chunks read so far and the rest of the iterator are streamed.
+    """
+    chunks = iter_json_array(items)
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= min_stream_bytes:
+            def generate():
+                yield from buffered
+                yield from chunks
+            return Response(generate(), mimetype="application/json")
+    return Response(b"".join(buffered), mimetype="application/json")
@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+# The backend modules import each other as top-level modules (run from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def client():
+    """A Flask test client; use auth_headers(user_id) for the Authorization header."""
+    from app import app
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def auth_headers():
+    from app import app
+    from flask_jwt_extended import create_access_token
+    def headers(user_id, **extra):
+        with app.app_context():
+            token = create_access_token(identity=user_id)
+        return {"Authorization": f"Bearer {token}", **extra}
+    return headers
@@ -0,0 +1,37 @@
+import threading
+from ai_jobs import JobQueue
+
+def test_job_is_visible_from_another_worker(tmp_path):
+    release = threading.Event()
+    def job(value):
+        release.wait(5)
+        return {"value": value}, 200
+
+    worker_a = JobQueue(workers=1, directory=str(tmp_path))
+    worker_b = JobQueue(workers=1, directory=str(tmp_path))
+    job_id = worker_a.submit("user_1", "parse_image", job, 42)
+
+    assert worker_b.get(job_id, "user_1")["status"] in ("queued", "running")
+    assert worker_b.get(job_id, "user_2") is None
+    assert worker_b.get("job-../../users", "user_1") is None
+
+    release.set()
+    view = worker_b.wait(job_id, "user_1", 5)
+    assert view["status"] == "done"
+    assert view["result"] == {"value": 42}
+    assert view["statusCode"] == 200
+    assert "userId" not in view
+
+def test_wait_times_out_on_another_workers_job(tmp_path):
+    release = threading.Event()
+    worker_a = JobQueue(workers=1, directory=str(tmp_path))
+    worker_b = JobQueue(workers=1, directory=str(tmp_path))
+    job_id = worker_a.submit("user_1", "schedule_event", lambda: (release.wait(5), ({}, 200))[1])
+    assert worker_b.wait(job_id, "user_1", 0.2)["status"] in ("queued", "running")
+    release.set()
+
+def test_memory_only_queue():
+    queue = JobQueue(workers=1, directory="")
+    job_id = queue.submit("user_1", "parse_image", lambda: ({"ok": True}, 200))
+    assert queue.wait(job_id, "user_1", 5)["result"] == {"ok": True}
+    assert JobQueue(workers=1, directory="").get(job_id, "user_1") is None
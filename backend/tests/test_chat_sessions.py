@@ -0,0 +1,46 @@
+import os
+import chat_sessions
+from chat_sessions import SessionStore
+
+def test_session_continues_on_another_worker(tmp_path):
+    worker_a = SessionStore(directory=str(tmp_path))
+    worker_b = SessionStore(directory=str(tmp_path))
+    session = worker_a.create("user_1", [{"sender": "user", "text": "Lunch with Sam on Friday"}])
+
+    assert worker_b.add_turn("user_1", session.id, "ai", "What time?")
+    assert worker_a.add_turn("user_1", session.id, "user", "Noon")
+    window, summary, accounting = worker_b.context("user_1", session.id)
+    assert [turn["text"] for turn in window] == ["Lunch with Sam on Friday", "What time?", "Noon"]
+    assert summary is None
+    assert accounting["turns"] == 3
+
+def test_sessions_are_per_user(tmp_path):
+    store = SessionStore(directory=str(tmp_path))
+    session = store.create("user_1", [{"sender": "user", "text": "hi"}])
+    assert not store.add_turn("user_2", session.id, "user", "hijack")
+    assert store.context("user_2", session.id) is None
+    assert store.context("user_1", "../../etc/passwd") is None
+
+def test_expired_session_is_removed(tmp_path):
+    store = SessionStore(ttl=0, directory=str(tmp_path))
+    session = store.create("user_1", [{"sender": "user", "text": "hi"}])
+    assert store.context("user_1", session.id) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), f"{session.id}.json"))
+    assert store.stats()["expired"] == 1
+
+def test_folded_summary_is_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_sessions, "CHAT_CONTEXT_TOKENS", 20)
+    worker_a = SessionStore(directory=str(tmp_path))
+    worker_b = SessionStore(directory=str(tmp_path))
+    history = [{"sender": "user" if n % 2 == 0 else "ai", "text": f"turn {n} " + "x" * 40} for n in range(4)]
+    session = worker_a.create("user_1", history)
+
+    window, summary, accounting = worker_a.context("user_1", session.id)
+    assert accounting["summarizedTurns"] == 3
+    assert worker_b.context("user_1", session.id)[1] == summary
+
+def test_memory_only_store():
+    store = SessionStore(directory="")
+    session = store.create("user_1", [{"sender": "user", "text": "hi"}])
+    assert store.add_turn("user_1", session.id, "ai", "hello")
+    assert store.stats()["sessions"] == 1
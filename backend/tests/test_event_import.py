@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+import pytest
+import event_manager
+from event_manager import _weekly_groups, import_events
+from storage import JsonStorage, get_storage, set_storage
+
+USER = "user_1"
+
+def lecture(day, title="Lecture", start="09:00", end="10:00"):
+    return {"title": title, "date": day.isoformat(), "startTime": start, "endTime": end, "recurrenceRule": "NONE"}
+
+def timetable(weeks=10, first_monday=date(2025, 9, 1)):
+    """Four weekly slots over `weeks` weeks: 40 single events for the default 10."""
+    slots = [(0, "Algebra", "09:00", "10:00"), (0, "Physics", "11:00", "12:00"),
+             (2, "Algebra", "09:00", "10:00"), (3, "Chemistry", "14:00", "16:00")]
+    return [lecture(first_monday + timedelta(weeks=week, days=weekday), title, start, end)
+            for week in range(weeks) for weekday, title, start, end in slots]
+
+@pytest.fixture
+def storage(tmp_path):
+    previous = get_storage()
+    storage = JsonStorage(str(tmp_path))
+    storage.init_user(USER, "alice")
+    set_storage(storage)
+    yield storage
+    set_storage(previous)
+    event_manager._search_indexes.clear()
+
+def test_same_date_copies_are_not_collapsed():
+    copy = lecture(date(2025, 9, 1))
+    series, leftover = _weekly_groups([(0, dict(copy)), (1, dict(copy))])
+    assert series == []
+    assert [position for position, _ in leftover] == [0, 1]
+
+def test_uneven_spacing_is_not_collapsed():
+    days = [date(2025, 9, 1), date(2025, 9, 8), date(2025, 9, 22)]
+    series, leftover = _weekly_groups(list(enumerate(lecture(day) for day in days)))
+    assert series == []
+    assert len(leftover) == 3
+
+def test_fortnightly_slot_gets_an_interval():
+    days = [date(2025, 9, 1) + timedelta(weeks=2 * n) for n in range(3)]
+    series, leftover = _weekly_groups(list(enumerate(lecture(day) for day in days)))
+    assert [rule for rule, _ in series] == ["FREQ=WEEKLY;INTERVAL=2;COUNT=3"]
+    assert leftover == []
+
+def test_timetable_collapses_into_one_series_per_slot():
+    events = timetable()
+    assert len(events) == 40
+    series, leftover = _weekly_groups(list(enumerate(events)))
+    assert leftover == []
+    assert [rule for rule, _ in series] == ["FREQ=WEEKLY;COUNT=10"] * 4
+    assert sorted(p for _, members in series for p, _ in members) == list(range(40))
+
+def test_import_collapses_timetable(storage):
+    body, status = import_events(USER, timetable(), collapse_weekly=True)
+    assert status == 201
+    assert len(body["created"]) == 4
+    assert all(event["recurrenceRule"] == "FREQ=WEEKLY;COUNT=10" for event in body["created"])
+    instances = event_manager.get_events_in_range(USER, date(2025, 9, 1), date(2025, 12, 31))
+    assert len(instances) == 40
+
+def test_import_keeps_same_date_copies_without_dedupe(storage):
+    copy = lecture(date(2025, 9, 1))
+    body, status = import_events(USER, [copy, dict(copy)], collapse_weekly=True, skip_duplicates=False)
+    assert status == 201
+    assert [event["recurrenceRule"] for event in body["created"]] == ["NONE", "NONE"]
+    instances = event_manager.get_events_in_range(USER, date(2025, 9, 1), date(2025, 12, 31))
+    assert [instance["date"] for instance in instances] == ["2025-09-01", "2025-09-01"]
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import pytest
+from event_manager import create_event, get_free_busy, shares_free_busy_with, update_profile, user_exists
+from storage import JsonStorage, get_storage, set_storage
+
+@pytest.fixture
+def storage(tmp_path):
+    previous = get_storage()
+    storage = JsonStorage(str(tmp_path))
+    for n, username in enumerate(["alice", "bob", "carol"], start=1):
+        storage.init_user(f"user_{n}", username)
+    set_storage(storage)
+    yield storage
+    set_storage(previous)
+
+def test_user_exists(storage):
+    assert user_exists("user_1")
+    assert not user_exists("user_99")
+    assert not user_exists("../user_1")
+    assert not user_exists(7)
+
+def test_busy_times_are_private_by_default(storage):
+    assert shares_free_busy_with("user_1", "user_1")
+    assert not shares_free_busy_with("user_1", "user_2")
+
+def test_sharing_with_listed_users_or_everyone(storage):
+    update_profile("user_1", {"freeBusySharedWith": ["user_2"]})
+    assert shares_free_busy_with("user_1", "user_2")
+    assert not shares_free_busy_with("user_1", "user_3")
+
+    update_profile("user_1", {"freeBusySharedWith": "*"})
+    assert shares_free_busy_with("user_1", "user_3")
+
+def test_common_free_slots(storage):
+    create_event("user_1", {"title": "Standup", "date": "2025-03-10", "startTime": "09:00", "endTime": "10:00"})
+    create_event("user_2", {"title": "Lunch", "date": "2025-03-10", "startTime": "10:30", "endTime": "11:00"})
+    start, end = datetime(2025, 3, 10, 9), datetime(2025, 3, 10, 12)
+    busy, slots = get_free_busy(["user_1", "user_2"], start, end, timedelta(minutes=30))
+    assert busy["user_1"] == [(datetime(2025, 3, 10, 9), datetime(2025, 3, 10, 10))]
+    assert slots == [(datetime(2025, 3, 10, 10), datetime(2025, 3, 10, 10, 30)),
+                     (datetime(2025, 3, 10, 11), datetime(2025, 3, 10, 12))]
+
+WINDOW = {"start": "2025-03-10T09:00", "end": "2025-03-10T12:00"}
+
+@pytest.mark.parametrize("field, value", [
+    ("userIds", 5), ("userIds", "user_1"), ("userIds", {"user_1": True}), ("userIds", ["user_1", 2]),
+    ("usernames", 5), ("usernames", "alice"), ("usernames", {"alice": True}), ("usernames", [None]),
+])
+def test_endpoint_rejects_non_list_user_fields(storage, client, auth_headers, field, value):
+    response = client.post("/api/freebusy", json={**WINDOW, field: value}, headers=auth_headers("user_1"))
+    assert response.status_code == 400
+    assert field in response.get_json()["msg"]
+
+@pytest.mark.parametrize("field, value", [("limit", "abc"), ("limit", None), ("limit", True), ("duration", True)])
+def test_endpoint_rejects_bad_numbers(storage, client, auth_headers, field, value):
+    response = client.post("/api/freebusy", json={**WINDOW, field: value}, headers=auth_headers("user_1"))
+    assert response.status_code == 400
+
+def test_endpoint_requires_sharing_and_reports_unknown_ids(storage, client, auth_headers):
+    body = {**WINDOW, "userIds": ["user_1", "user_2", "user_99"], "usernames": ["nobody"]}
+    response = client.post("/api/freebusy", json=body, headers=auth_headers("user_1"))
+    assert response.status_code == 403
+    assert response.get_json()["notShared"] == ["user_2"]
+
+    update_profile("user_2", {"freeBusySharedWith": ["user_1"]})
+    response = client.post("/api/freebusy", json=body, headers=auth_headers("user_1"))
+    assert response.status_code == 200
+    data = response.get_json()
+    assert set(data["busy"]) == {"user_1", "user_2"}
+    assert data["unknownUserIds"] == ["user_99"]
+    assert data["unknownUsernames"] == ["nobody"]
@@ -0,0 +1,91 @@
+import os
+import json
+from journal_storage import JournalStorage
+
+USER = "user_1"
+
+def make_event(n, date="2025-03-10"):
+    return {"id": f"evt-{n}", "title": f"Event {n}", "date": date, "startTime": "09:00", "endTime": "10:00"}
+
+def write_journal(storage, lines):
+    os.makedirs(os.path.dirname(storage.journal_path(USER)), exist_ok=True)
+    with open(storage.journal_path(USER), 'wb') as f:
+        f.write(b"".join(lines))
+
+def op_line(op):
+    return (json.dumps(op, separators=(",", ":")) + "\n").encode("utf-8")
+
+def test_replay_stops_at_truncated_tail(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_ops=1000)
+    torn = op_line({"seq": 3, "put": make_event(3)})[:-10]
+    write_journal(storage, [
+        op_line({"seq": 1, "put": make_event(1)}),
+        op_line({"seq": 2, "put": make_event(2)}),
+        torn,
+    ])
+
+    ids = [event["id"] for event in storage.get_all_events(USER)]
+    assert ids == ["evt-1", "evt-2"]
+
+def test_replay_stops_at_complete_but_invalid_line(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_ops=1000)
+    write_journal(storage, [
+        op_line({"seq": 1, "put": make_event(1)}),
+        b'{"seq":2,"put":{"id"\n',
+    ])
+
+    assert [event["id"] for event in storage.get_all_events(USER)] == ["evt-1"]
+
+def test_next_append_truncates_torn_tail(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_ops=1000)
+    complete = op_line({"seq": 1, "put": make_event(1)})
+    write_journal(storage, [complete, op_line({"seq": 2, "put": make_event(2)})[:-5]])
+
+    assert storage.apply_event_changes(USER, [make_event(3)], []) == ["2025"]
+
+    with open(storage.journal_path(USER), 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    assert lines[0] == complete
+    assert [json.loads(line) for line in lines[1:]] == [{"seq": 2, "put": make_event(3)}]
+
+    # A fresh process replaying the repaired journal sees the same events
+    fresh = JournalStorage(str(tmp_path), compact_ops=1000)
+    assert [event["id"] for event in fresh.get_all_events(USER)] == ["evt-1", "evt-3"]
+
+def test_crash_between_snapshot_and_journal_reset_skips_covered_ops(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_ops=1000)
+    storage.apply_event_changes(USER, [make_event(1), make_event(2)], [])
+    storage.apply_event_changes(USER, [], ["evt-1"])
+    with open(storage.journal_path(USER), 'rb') as f:
+        journal = f.read()
+
+    storage.compact(USER)
+    # Simulate a crash after the snapshot was written but before the journal
+    # was emptied: the old ops are back on disk next to the new snapshot
+    with open(storage.journal_path(USER), 'wb') as f:
+        f.write(journal)
+    with open(storage.snapshot_path(USER)) as f:
+        assert json.load(f)["seq"] == 3
+
+    fresh = JournalStorage(str(tmp_path), compact_ops=1000)
+    state = fresh._state(USER)
+    assert state["seq"] == 3
+    assert state["ops"] == 0  # nothing replayed on top of the snapshot
+    assert [event["id"] for event in fresh.get_all_events(USER)] == ["evt-2"]
+
+    # New ops continue after the snapshot's seq and are applied exactly once
+    fresh.apply_event_changes(USER, [{**make_event(2), "title": "Renamed"}], [])
+    fresh.apply_event_changes(USER, [make_event(4)], [])
+    reread = JournalStorage(str(tmp_path), compact_ops=1000)
+    events = reread.get_all_events(USER)
+    assert [event["id"] for event in events] == ["evt-2", "evt-4"]
+    assert events[0]["title"] == "Renamed"
+    assert reread._state(USER)["seq"] == 5
+
+def test_save_all_events_leaves_callers_events_alone(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_ops=1000)
+    new_event = {"title": "No id yet", "date": "2025-03-10"}
+    storage.save_all_events(USER, [new_event])
+
+    assert new_event == {"title": "No id yet", "date": "2025-03-10"}
+    assert storage.get_all_events(USER)[0]["id"].startswith("evt-")
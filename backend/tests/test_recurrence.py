@@ -0,0 +1,141 @@
+from datetime import date, time
+import pytest
+from recurrence import expand_events, iter_instances, occurrences, parse_rrule, series_end
+
+def dates(rule, dtstart, range_start, range_end, start_time=None):
+    return [day.isoformat() for day in occurrences(parse_rrule(rule), dtstart, range_start, range_end, start_time)]
+
+def base(recurrence_id, day, rule, **extra):
+    return {"id": f"evt-{recurrence_id}", "title": "Series", "date": day, "startTime": "09:00", "endTime": "10:00",
+            "recurrenceRule": rule, "recurrenceId": recurrence_id, "isBaseEvent": True, **extra}
+
+# --- Rule parsing ---
+
+def test_parse_rrule():
+    rule = parse_rrule("RRULE:FREQ=MONTHLY;INTERVAL=2;BYDAY=-1FR,2TU;WKST=SU;UNTIL=20251231T235959Z")
+    assert rule["freq"] == "MONTHLY"
+    assert rule["interval"] == 2
+    assert rule["byday"] == [(-1, 4), (2, 1)]
+    assert rule["wkst"] == 6
+    assert rule["until"].date() == date(2025, 12, 31)
+    assert parse_rrule("NONE") is None
+    assert parse_rrule("FREQ=HOURLY") is None
+    assert parse_rrule("FREQ=DAILY;COUNT=x") is None
+
+# --- COUNT and UNTIL ---
+
+def test_count_is_counted_from_dtstart_across_years():
+    rule = "FREQ=WEEKLY;COUNT=5"
+    start = date(2024, 12, 16)
+    assert dates(rule, start, date(2024, 1, 1), date(2026, 12, 31)) == [
+        "2024-12-16", "2024-12-23", "2024-12-30", "2025-01-06", "2025-01-13"]
+    # A window in the next year still only sees the occurrences left after 2024's three
+    assert dates(rule, start, date(2025, 1, 1), date(2025, 12, 31)) == ["2025-01-06", "2025-01-13"]
+
+def test_counted_series_expands_the_same_through_year_windows():
+    event = base("rec-count-years", "2024-12-16", "FREQ=WEEKLY;COUNT=5")
+    whole = [i["date"] for i in expand_events([event], date(2024, 12, 1), date(2025, 1, 31))]
+    split = [i["date"] for i in expand_events([event], date(2024, 12, 1), date(2024, 12, 31))] + \
+            [i["date"] for i in expand_events([event], date(2025, 1, 1), date(2025, 1, 31))]
+    assert whole == split == ["2024-12-16", "2024-12-23", "2024-12-30", "2025-01-06", "2025-01-13"]
+    assert series_end(event) == date(2025, 1, 13)
+
+def test_until_date_across_years():
+    assert dates("FREQ=DAILY;UNTIL=20250102", date(2024, 12, 30), date(2024, 1, 1), date(2025, 12, 31)) == [
+        "2024-12-30", "2024-12-31", "2025-01-01", "2025-01-02"]
+
+def test_until_datetime_before_start_time_excludes_that_day():
+    rule = "FREQ=DAILY;UNTIL=20250102T080000Z"
+    start = date(2024, 12, 31)
+    assert dates(rule, start, start, date(2025, 1, 31), start_time=time(9, 0)) == ["2024-12-31", "2025-01-01"]
+    assert dates(rule, start, start, date(2025, 1, 31), start_time=time(7, 0)) == [
+        "2024-12-31", "2025-01-01", "2025-01-02"]
+
+def test_open_ended_series_from_a_late_window():
+    assert dates("FREQ=WEEKLY;INTERVAL=2", date(2020, 1, 6), date(2025, 1, 1), date(2025, 1, 31)) == [
+        "2025-01-13", "2025-01-27"]
+
+# --- BYDAY / BYMONTHDAY / WKST ---
+
+@pytest.mark.parametrize("wkst, expected", [
+    # RFC 5545 section 3.3.10: WKST changes which days share a week with DTSTART
+    ("MO", ["1997-08-05", "1997-08-10", "1997-08-19", "1997-08-24"]),
+    ("SU", ["1997-08-05", "1997-08-17", "1997-08-19", "1997-08-31"]),
+])
+def test_weekly_byday_with_wkst(wkst, expected):
+    rule = f"FREQ=WEEKLY;INTERVAL=2;COUNT=4;BYDAY=TU,SU;WKST={wkst}"
+    assert dates(rule, date(1997, 8, 5), date(1997, 1, 1), date(1997, 12, 31)) == expected
+
+def test_monthly_bymonthday_skips_short_months_and_counts_from_the_end():
+    assert dates("FREQ=MONTHLY;BYMONTHDAY=31", date(2025, 1, 31), date(2025, 1, 1), date(2025, 6, 30)) == [
+        "2025-01-31", "2025-03-31", "2025-05-31"]
+    assert dates("FREQ=MONTHLY;BYMONTHDAY=-1", date(2024, 1, 31), date(2024, 1, 1), date(2024, 4, 30)) == [
+        "2024-01-31", "2024-02-29", "2024-03-31", "2024-04-30"]
+
+def test_monthly_byday_ordinals():
+    assert dates("FREQ=MONTHLY;BYDAY=-1FR", date(2025, 1, 31), date(2025, 1, 1), date(2025, 3, 31)) == [
+        "2025-01-31", "2025-02-28", "2025-03-28"]
+    assert dates("FREQ=MONTHLY;BYDAY=2TU", date(2025, 1, 14), date(2025, 1, 1), date(2025, 3, 31)) == [
+        "2025-01-14", "2025-02-11", "2025-03-11"]
+
+def test_monthly_byday_and_bymonthday_intersect():
+    # Friday the 13th
+    assert dates("FREQ=MONTHLY;BYDAY=FR;BYMONTHDAY=13", date(2025, 1, 1), date(2025, 1, 1), date(2026, 12, 31)) == [
+        "2025-06-13", "2026-02-13", "2026-03-13", "2026-11-13"]
+
+def test_yearly_byday_ordinal_within_the_year():
+    # RFC 5545: the 20th Monday of the year
+    assert dates("FREQ=YEARLY;BYDAY=20MO", date(1997, 5, 19), date(1997, 1, 1), date(1999, 12, 31)) == [
+        "1997-05-19", "1998-05-18", "1999-05-17"]
+
+def test_yearly_leap_day_only_in_leap_years():
+    assert dates("FREQ=YEARLY", date(2024, 2, 29), date(2024, 1, 1), date(2028, 12, 31)) == [
+        "2024-02-29", "2028-02-29"]
+
+def test_impossible_rule_terminates():
+    assert dates("FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=30", date(2025, 1, 1), date(2025, 1, 1), date(2030, 12, 31)) == []
+
+# --- Exceptions and ghosts ---
+
+def series_with_exceptions(recurrence_id):
+    series = base(recurrence_id, "2025-03-03", "FREQ=WEEKLY;COUNT=4")  # Mondays 3, 10, 17, 24 March
+    moved = {"id": "evt-moved", "recurrenceId": recurrence_id, "originalDate": "2025-03-10",
+             "date": "2025-03-12", "startTime": "14:00", "isException": True, "isBaseEvent": False}
+    moved_out = {"id": "evt-moved-out", "recurrenceId": recurrence_id, "originalDate": "2025-03-24",
+                 "date": "2025-04-02", "isException": True, "isBaseEvent": False}
+    ghost = {"id": "evt-ghost", "recurrenceId": recurrence_id, "originalDate": "2025-03-17",
+             "isDeleted": True, "isBaseEvent": False}
+    single = {"id": "evt-single", "title": "Dentist", "date": "2025-03-05", "recurrenceRule": "NONE"}
+    outside = {"id": "evt-outside", "title": "Later", "date": "2025-05-01", "recurrenceRule": "NONE"}
+    return [moved, series, ghost, single, moved_out, outside]
+
+def test_expand_applies_exceptions_and_ghosts():
+    instances = expand_events(series_with_exceptions("rec-merge"), date(2025, 3, 1), date(2025, 3, 31))
+    by_id = {instance["id"]: instance for instance in instances}
+    assert set(by_id) == {"evt-single", "evt-rec-merge-2025-03-03", "evt-moved"}
+
+    plain = by_id["evt-rec-merge-2025-03-03"]
+    assert (plain["date"], plain["originalDate"], plain["isInstance"], plain["isException"]) == (
+        "2025-03-03", "2025-03-03", True, False)
+
+    moved = by_id["evt-moved"]
+    # Exception fields win over the base's; the rest is inherited
+    assert (moved["date"], moved["startTime"], moved["endTime"], moved["title"]) == ("2025-03-12", "14:00", "10:00", "Series")
+    assert moved["isInstance"] and moved["isException"] and moved["isBaseEvent"] is False
+
+def test_exception_is_shown_only_where_it_was_moved_to():
+    events = series_with_exceptions("rec-moved-out")
+    # The 24 March occurrence was moved to 2 April, outside this window
+    march = [i["id"] for i in expand_events(events, date(2025, 3, 20), date(2025, 3, 31))]
+    assert march == []
+    # Like the frontend, a moved instance is only found through its original
+    # date, so a window that holds just the new date doesn't show it either
+    april = [i["id"] for i in expand_events(events, date(2025, 4, 1), date(2025, 4, 30))]
+    assert april == []
+
+def test_iter_instances_reads_a_one_shot_iterator():
+    events = series_with_exceptions("rec-iter")
+    expected = expand_events(events, date(2025, 3, 1), date(2025, 3, 31))
+    assert list(iter_instances(iter(events), date(2025, 3, 1), date(2025, 3, 31))) == expected
+    # Single events are yielded before the series are expanded
+    assert next(iter_instances(iter(events), date(2025, 3, 1), date(2025, 3, 31)))["id"] == "evt-single"
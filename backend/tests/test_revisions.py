@@ -0,0 +1,56 @@
+import pytest
+from storage import JsonStorage, get_storage, set_storage
+
+TASKS = [{"id": "t1", "text": "Pay rent", "done": False}]
+
+@pytest.fixture
+def storage(tmp_path):
+    previous = get_storage()
+    storage = JsonStorage(str(tmp_path))
+    storage.init_user("user_1", "alice")
+    storage.init_user("user_2", "bob")
+    set_storage(storage)
+    yield storage
+    set_storage(previous)
+
+def tasks_etag(client, auth_headers, user_id="user_1", year=2025):
+    return client.get(f"/api/tasks/{year}", headers=auth_headers(user_id)).headers["ETag"]
+
+def save_tasks(client, auth_headers, if_match, year=2025):
+    headers = auth_headers("user_1", **({"If-Match": if_match} if if_match is not None else {}))
+    return client.post(f"/api/tasks/{year}", json=TASKS, headers=headers)
+
+def test_current_tag_saves(storage, client, auth_headers):
+    response = save_tasks(client, auth_headers, tasks_etag(client, auth_headers))
+    assert response.status_code == 200
+
+def test_no_header_or_star_saves(storage, client, auth_headers):
+    assert save_tasks(client, auth_headers, None).status_code == 200
+    assert save_tasks(client, auth_headers, "*").status_code == 200
+
+def test_stale_tag_is_rejected(storage, client, auth_headers):
+    stale = tasks_etag(client, auth_headers)
+    assert save_tasks(client, auth_headers, stale).status_code == 200
+    response = save_tasks(client, auth_headers, stale)
+    assert response.status_code == 412
+    assert response.get_json()["revision"] == 1
+
+@pytest.mark.parametrize("foreign", ["other store", "other user", "malformed"])
+def test_foreign_tag_is_rejected(storage, client, auth_headers, foreign):
+    tag = {
+        "other store": lambda: tasks_etag(client, auth_headers, year=2024),
+        "other user": lambda: tasks_etag(client, auth_headers, user_id="user_2"),
+        "malformed": lambda: '"bogus"',
+    }[foreign]()
+    response = save_tasks(client, auth_headers, tag)
+    assert response.status_code == 412
+    assert storage.get_tasks("user_1", 2025) != TASKS
+
+def test_foreign_tag_is_rejected_for_event_writes(storage, client, auth_headers):
+    event = {"title": "Standup", "date": "2025-03-10", "startTime": "09:00", "endTime": "10:00"}
+    tag = tasks_etag(client, auth_headers)
+    response = client.post("/api/events", json=event, headers=auth_headers("user_1", **{"If-Match": tag}))
+    assert response.status_code == 412
+    events_tag = client.get("/api/events/all", headers=auth_headers("user_1")).headers["ETag"]
+    response = client.post("/api/events", json=event, headers=auth_headers("user_1", **{"If-Match": events_tag}))
+    assert response.status_code == 201
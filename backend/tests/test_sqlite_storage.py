@@ -0,0 +1,23 @@
+from sqlite_storage import SqliteStorage
+
+USER = "user_1"
+
+def make_event(n, date="2025-03-10"):
+    return {"id": f"evt-{n}", "title": f"Event {n}", "date": date, "startTime": "09:00", "endTime": "10:00"}
+
+def test_reordered_keys_are_not_a_change(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "calendar.db"))
+    storage.save_all_events(USER, [make_event(1), make_event(2)])
+    revision = storage.get_revision(USER, "events")
+
+    reordered = [dict(reversed(list(event.items()))) for event in storage.get_all_events(USER)]
+    assert storage.save_all_events(USER, reordered) == []
+    assert storage.get_revision(USER, "events") == revision
+
+def test_save_all_events_leaves_callers_events_alone(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "calendar.db"))
+    new_event = {"title": "No id yet", "date": "2025-03-10"}
+    storage.save_all_events(USER, [new_event])
+
+    assert new_event == {"title": "No id yet", "date": "2025-03-10"}
+    assert storage.get_all_events(USER)[0]["id"].startswith("evt-")
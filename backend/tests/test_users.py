@@ -0,0 +1,61 @@
+import os
+import json
+from storage import JsonStorage
+
+def user(n):
+    return {"id": f"user_{n}", "password_hash": f"pw{n}"}
+
+def test_registrations_append_without_rewriting_users_json(tmp_path):
+    storage = JsonStorage(str(tmp_path))
+    storage.save_users({"alice": user(1)})
+    before = os.stat(storage.users_file)
+
+    assert storage.add_user("bob", user(2))
+    assert storage.add_user("carol", user(3))
+    assert not storage.add_user("bob", user(4))
+
+    after = os.stat(storage.users_file)
+    assert (after.st_mtime_ns, after.st_size) == (before.st_mtime_ns, before.st_size)
+    with open(storage.users_journal_file) as f:
+        assert [json.loads(line)["username"] for line in f] == ["bob", "carol"]
+    assert storage.get_user("carol") == user(3)
+    assert set(storage.get_users()) == {"alice", "bob", "carol"}
+
+def test_other_process_reads_only_new_journal_lines(tmp_path, monkeypatch):
+    writer = JsonStorage(str(tmp_path))
+    reader = JsonStorage(str(tmp_path))
+    writer.save_users({"alice": user(1)})
+    assert reader.get_user("alice") == user(1)
+
+    loads = []
+    real_load = json.load
+    monkeypatch.setattr(json, "load", lambda f: loads.append(f.name) or real_load(f))
+    writer.add_user("bob", user(2))
+    assert reader.get_user("bob") == user(2)
+    assert loads == []  # users.json not re-parsed
+
+def test_journal_is_folded_into_users_json(tmp_path):
+    storage = JsonStorage(str(tmp_path), users_journal_compact_entries=3)
+    other = JsonStorage(str(tmp_path))
+    for n in range(1, 5):
+        assert storage.add_user(f"user{n}", user(n))
+        assert other.get_user(f"user{n}") == user(n)
+
+    with open(storage.users_file) as f:
+        assert set(json.load(f)) == {"user1", "user2", "user3"}
+    with open(storage.users_journal_file) as f:
+        assert [json.loads(line)["username"] for line in f] == ["user4"]
+    assert set(JsonStorage(str(tmp_path)).get_users()) == {"user1", "user2", "user3", "user4"}
+    assert not other.add_user("user3", user(9))
+
+def test_torn_journal_tail_is_ignored_then_truncated(tmp_path):
+    storage = JsonStorage(str(tmp_path))
+    storage.add_user("alice", user(1))
+    with open(storage.users_journal_file, 'ab') as f:
+        f.write(b'{"username":"bob","user":{"id":"us')
+
+    fresh = JsonStorage(str(tmp_path))
+    assert set(fresh.get_users()) == {"alice"}
+    assert fresh.add_user("bob", user(2))
+    with open(fresh.users_journal_file) as f:
+        assert [json.loads(line)["username"] for line in f] == ["alice", "bob"]
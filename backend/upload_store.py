@@ -0,0 +1,134 @@
+import os
+import re
+import hashlib
+import logging
+import tempfile
+from image_ingest import preprocess_image, make_thumbnail, InvalidImageError
+
+log = logging.getLogger(__name__)
+
+# Profile photos are stored under their content hash,
+#
+#     uploads/<user_id>/<hash>.jpg          the photo, normalized by preprocess_image
+#     uploads/<user_id>/<hash>-<size>.jpg   square thumbnails, made at upload time
+#
+# so a name always means the same bytes: files are served as immutable, the same
+# photo uploaded twice is stored once, and everything a user's profile no longer
+# points at can be deleted after each upload.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 5 * 1024 * 1024))
+UPLOAD_MAX_DIMENSION = int(os.getenv("UPLOAD_MAX_DIMENSION", 1024))
+# Thumbnail edge lengths in pixels: 2x the 32px header avatar and the 96px profile preview
+UPLOAD_THUMBNAIL_SIZES = tuple(
+    int(size) for size in os.getenv("UPLOAD_THUMBNAIL_SIZES", "64,192").split(",") if size.strip())
+# Cache lifetime for content-addressed files; they never change, so a year
+UPLOAD_MAX_AGE = int(os.getenv("UPLOAD_MAX_AGE", 365 * 24 * 3600))
+
+HASH_CHARS = 32
+_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+_STORED_NAME = re.compile(r"^([0-9a-f]{%d})(?:-(\d+))?\.(jpg|png|gif|webp)$" % HASH_CHARS)
+_IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8")
+
+def _looks_like_image(data):
+    # Checked even with Pillow, which would otherwise open formats we don't serve
+    return data.startswith(_IMAGE_SIGNATURES) or (data[:4] == b"RIFF" and data[8:12] == b"WEBP")
+
+def parse_stored_name(filename):
+    """(hash, thumbnail size or None) for a content-addressed file name, else None."""
+    match = _STORED_NAME.match(filename)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2)) if match.group(2) else None
+
+class UploadStore:
+    """Content-addressed profile photos under `root` (see module comment)."""
+
+    def __init__(self, root, thumbnail_sizes=UPLOAD_THUMBNAIL_SIZES):
+        self.root = root
+        self.thumbnail_sizes = thumbnail_sizes
+
+    def user_dir(self, user_id):
+        return os.path.join(self.root, user_id)
+
+    def url(self, user_id, filename):
+        return f"/uploads/{user_id}/{filename}"
+
+    def _find(self, user_id, digest):
+        """The stored photo's file name for this hash, or None."""
+        for extension in _EXTENSIONS.values():
+            filename = f"{digest}.{extension}"
+            if os.path.exists(os.path.join(self.user_dir(user_id), filename)):
+                return filename
+        return None
+
+    def save_photo(self, user_id, image_bytes):
+        """
+        Stores an uploaded photo and its thumbnails unless the same bytes are
+        already stored. Returns {"hash", "photoUrl", "photoThumbnails": {size: url}}.
+        Raises InvalidImageError / ImageTooLargeError.
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()[:HASH_CHARS]
+        filename = self._find(user_id, digest)
+        if filename is None:
+            if not _looks_like_image(image_bytes):
+                raise InvalidImageError("Photo must be a JPEG, PNG, GIF or WebP image")
+            photo, mime_type = preprocess_image(image_bytes, max_dimension=UPLOAD_MAX_DIMENSION)
+            filename = f"{digest}.{_EXTENSIONS.get(mime_type, 'jpg')}"
+            # Thumbnails first: the photo itself appearing marks the set complete
+            for size in self.thumbnail_sizes:
+                thumbnail = make_thumbnail(photo, size)
+                if thumbnail is not None:
+                    self._write(user_id, f"{digest}-{size}.jpg", thumbnail)
+            self._write(user_id, filename, photo)
+        return self.describe(user_id, filename)
+
+    def describe(self, user_id, filename):
+        """Profile fields for a stored photo. Sizes without a thumbnail (no Pillow) use the photo."""
+        digest = parse_stored_name(filename)[0]
+        photo_url = self.url(user_id, filename)
+        thumbnails = {}
+        for size in self.thumbnail_sizes:
+            name = f"{digest}-{size}.jpg"
+            exists = os.path.exists(os.path.join(self.user_dir(user_id), name))
+            thumbnails[str(size)] = self.url(user_id, name) if exists else photo_url
+        return {"hash": digest, "photoUrl": photo_url, "photoThumbnails": thumbnails}
+
+    def _write(self, user_id, filename, data):
+        directory = self.user_dir(user_id)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(directory, filename))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def prune(self, user_id, keep_hash):
+        """
+        Deletes the user's files that don't belong to keep_hash: earlier photos,
+        their thumbnails and files from before uploads were content-addressed.
+        Call under the user's lock, after the profile points at keep_hash.
+        """
+        removed = 0
+        try:
+            entries = list(os.scandir(self.user_dir(user_id)))
+        except OSError:
+            return 0
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            stored = parse_stored_name(entry.name)
+            if stored is not None and stored[0] == keep_hash:
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError as e:
+                log.warning("Could not remove old upload %s: %s", entry.path, e)
+        if removed:
+            log.info("Removed %d old upload(s) for %s", removed, user_id)
+        return removed
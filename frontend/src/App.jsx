@@ -1,7 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Routes, Route, Navigate } from 'react-router-dom';
 import { useAuth } from './contexts/AuthContext';
-import { v4 as uuidv4 } from 'uuid';
 import toast, { Toaster } from 'react-hot-toast';
 import {
   startOfWeek,
@@ -15,7 +14,6 @@ import {
 
 // API & Services
 import api from './services/api';
-import { generateRecurringInstances } from './services/recurrence';
 
 // Core Components
 import Login from './components/auth/Login';
@@ -64,10 +62,10 @@ const AppLayout = () => {
   const [view, setView] =useState('week');
   const [selectedDate, setSelectedDate] = useState(new Date());
 
-  // Data State (Master List)
-  const [allEvents, setAllEvents] = useState([]); // Raw events from DB
-  const [displayEvents, setDisplayEvents] = useState([]); // Generated instances for view
+  // Data State
+  const [displayEvents, setDisplayEvents] = useState([]); // Instances in the visible range, expanded by the server
   const [loading, setLoading] = useState(true);
+  const [reloadKey, setReloadKey] = useState(0); // Bumped after each save to refetch
 
   // Modal State
   const [isChecklistOpen, setIsChecklistOpen] = useState(false);
@@ -83,20 +81,10 @@ const AppLayout = () => {
   const [notifiedEventIds, setNotifiedEventIds] = useState(new Set()); // Prevents re-notifying
 
   // --- Data Fetching ---
-  useEffect(() => {
-    setLoading(true);
-    api.getAllEvents()
-      .then(response => {
-        setAllEvents(response.data);
-      })
-      .catch(err => {
-        console.error("Failed to load events", err);
-        toast.error("Could not load events.");
-      })
-      .finally(() => setLoading(false));
-  }, []);
-
-  // --- Event Instance Generation ---
+  // Only the visible week/month is fetched, already expanded into instances
+  // (recurring occurrences, exceptions and deleted instances applied).
+  // `loading` starts true and only covers the first load, so a refetch after a
+  // save or a page change doesn't blank the view.
   useEffect(() => {
     let startDate, endDate;
     if (view === 'week') {
@@ -106,10 +94,19 @@ const AppLayout = () => {
       startDate = startOfWeek(startOfMonth(selectedDate), { weekStartsOn: 1 });
       endDate = endOfWeek(endOfMonth(selectedDate), { weekStartsOn: 1 });
     }
-    
-    const instances = generateRecurringInstances(allEvents, startDate, endDate);
-    setDisplayEvents(instances);
-  }, [allEvents, view, selectedDate]);
+
+    let cancelled = false; // A newer range was requested meanwhile
+    api.getEventsInRange(format(startDate, 'yyyy-MM-dd'), format(endDate, 'yyyy-MM-dd'))
+      .then(response => {
+        if (!cancelled) setDisplayEvents(response.data);
+      })
+      .catch(err => {
+        console.error("Failed to load events", err);
+        toast.error("Could not load events.");
+      })
+      .finally(() => setLoading(false));
+    return () => { cancelled = true; };
+  }, [view, selectedDate, reloadKey]);
 
   // --- Notification Check Timer ---
   useEffect(() => {
@@ -135,16 +132,18 @@ const AppLayout = () => {
   }, [displayEvents, notifiedEventIds]);
 
   // --- Save Handler ---
-  const saveAllEventsToBackend = (updatedMasterList, showToast = true) => {
-      setAllEvents(updatedMasterList); // Optimistic UI
-      
-      api.saveAllEvents(updatedMasterList)
+  // Each edit sends only the change (one event, one exception/ghost, or a
+  // batch of ops), then refetches; the server assigns ids.
+  const sendEventChange = (request, successMessage) => {
+      request
         .then(() => {
-          if (showToast) {
-            toast.success("Calendar saved!");
+          if (successMessage) {
+            toast.success(successMessage);
           }
+          setReloadKey(key => key + 1);
         })
         .catch(err => {
+          console.error("Failed to save event change", err);
           toast.error("Save failed. Please try again.");
         });
     };
@@ -193,65 +192,52 @@ const AppLayout = () => {
 
   // --- Core Data Logic (CRUD) ---
   const saveEvent = (formData, editMode = 'series') => {
-    let updatedMasterList = [...allEvents];
-    
     if (editMode === 'instance') {
-      const exceptionEvent = {
-        ...formData,
-        id: uuidv4(),
+      sendEventChange(api.updateRecurrence({
         recurrenceId: formData.recurrenceId,
         originalDate: formData.originalDate,
-        isBaseEvent: false,
-        isException: true,
-      };
-      updatedMasterList.push(exceptionEvent);
-      toast.success("Event instance updated!");
-      
+        mode: 'instance',
+        action: 'save',
+        event: formData,
+      }), "Event instance updated!");
+
     } else if (editMode === 'series') {
       if (formData.isInstance || formData.isException) {
-        updatedMasterList = updatedMasterList.map(e => 
-          e.recurrenceId === formData.recurrenceId && e.isBaseEvent ? { ...formData, id: e.id, isBaseEvent: true, recurrenceId: e.recurrenceId } : e
-        );
-        toast.success("Event series updated!");
+        sendEventChange(api.updateRecurrence({
+          recurrenceId: formData.recurrenceId,
+          mode: 'series',
+          action: 'save',
+          event: formData,
+        }), "Event series updated!");
       } else if (formData.id) {
-        updatedMasterList = updatedMasterList.map(e => e.id === formData.id ? formData : e);
-        toast.success("Event updated!");
+        sendEventChange(api.updateEvent(formData.id, formData), "Event updated!");
       } else {
-        const newEvent = { ...formData, id: uuidv4() };
-        if (newEvent.recurrenceRule !== 'NONE') {
-          newEvent.recurrenceId = `rec-${uuidv4()}`;
-          newEvent.isBaseEvent = true;
-        }
-        updatedMasterList.push(newEvent);
-        toast.success("Event created!");
+        const { id, ...newEvent } = formData;
+        sendEventChange(api.createEvent(newEvent), "Event created!");
       }
     }
-    saveAllEventsToBackend(updatedMasterList);
   };
 
   const deleteEvent = (eventData, editMode) => {
-    let updatedMasterList = [...allEvents];
-    
     if (editMode === 'instance') {
-      const ghostEvent = {
-        id: uuidv4(),
+      sendEventChange(api.updateRecurrence({
         recurrenceId: eventData.recurrenceId,
         originalDate: eventData.originalDate,
-        isDeleted: true,
-        isBaseEvent: false,
-      };
-      updatedMasterList.push(ghostEvent);
-      toast.success("Event instance deleted!");
-      
+        mode: 'instance',
+        action: 'delete',
+      }), "Event instance deleted!");
+
     } else if (editMode === 'series') {
       if (eventData.recurrenceId) {
-        updatedMasterList = updatedMasterList.filter(e => e.recurrenceId !== eventData.recurrenceId);
+        sendEventChange(api.updateRecurrence({
+          recurrenceId: eventData.recurrenceId,
+          mode: 'series',
+          action: 'delete',
+        }), "Event series deleted!");
       } else {
-        updatedMasterList = updatedMasterList.filter(e => e.id !== eventData.id);
+        sendEventChange(api.deleteEvent(eventData.id), "Event series deleted!");
       }
-      toast.success("Event series deleted!");
     }
-    saveAllEventsToBackend(updatedMasterList);
   };
 
   // --- Checklist Task Handler (FIX 2: Added to handle saving tasks from the modal) ---
@@ -272,15 +258,13 @@ const AppLayout = () => {
   };
 
   const handleAddSuggestedEvents = (events) => {
-    const newEventsWithIds = events.map(e => ({
-      ...e,
-      id: uuidv4(),
-      recurrenceRule: 'NONE' // AI events are single-instance
+    const ops = events.map(({ id, ...e }) => ({
+      op: 'create',
+      event: { ...e, recurrenceRule: 'NONE' } // AI events are single-instance
     }));
-    
-    const updatedMasterList = [...allEvents, ...newEventsWithIds];
-    // Call the save function, but with the toast disabled
-    saveAllEventsToBackend(updatedMasterList, false);
+
+    // One all-or-nothing batch, with the toast disabled
+    if (ops.length > 0) sendEventChange(api.patchEvents(ops));
 
     // We can still switch the view, that's fine
     setView('week');
@@ -356,7 +340,7 @@ const AppLayout = () => {
             onClick={() => setIsProfileModalOpen(true)}
             className="flex items-center space-x-2 p-1 rounded-lg hover:bg-gray-100"
           >
-            <Avatar src={profile.photoUrl} />
+            <Avatar src={profile.photoThumbnails?.['64'] || profile.photoUrl} />
             <span className="font-semibold">{profile.username}</span>
           </button>
           <button onClick={logout} className="text-red-500 hover:underline">Logout</button>
@@ -9,6 +9,8 @@ const Chatbot = ({ onClose, onAddSuggestedEvents }) => {
   const [imagePreview, setImagePreview] = useState(null);
   const [base64Image, setBase64Image] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
+  // Server-side chat session; null until the first reply
+  const sessionIdRef = useRef(null);
   
   const messagesEndRef = useRef(null);
 
@@ -93,8 +95,16 @@ const Chatbot = ({ onClose, onAddSuggestedEvents }) => {
     // --- Text Scheduling Path (This is the main change) ---
     else if (prompt) {
       try {
-        // Call the agentic endpoint *with the full history*
-        const response = await api.scheduleEventFromText(newHistory);
+        // Only the new message goes up once a session exists; if the server has
+        // dropped it (expired, restarted), start a new one from the full history
+        let response;
+        try {
+          response = await api.scheduleEventFromText(newHistory, sessionIdRef.current);
+        } catch (err) {
+          if (!sessionIdRef.current || err.response?.status !== 404) throw err;
+          response = await api.scheduleEventFromText(newHistory, null);
+        }
+        sessionIdRef.current = response.data.sessionId || null;
         
         if (response.data.status === 'success') {
           const event = response.data.newEvent;
@@ -14,7 +14,7 @@ const ProfileModal = ({ onClose }) => {
   const { profile, refreshProfile } = useAuth();
   const [username, setUsername] = useState(profile.username);
   const [selectedFile, setSelectedFile] = useState(null);
-  const [preview, setPreview] = useState(profile.photoUrl);
+  const [preview, setPreview] = useState(profile.photoThumbnails?.['192'] || profile.photoUrl);
   const [isSaving, setIsSaving] = useState(false);
 
   const handleFileChange = (e) => {
@@ -36,7 +36,11 @@ export const AuthProvider = ({ children }) => {
 
             setProfile({
                 ...userData,
-                photoUrl: getFullPhotoUrl(userData.photo_url || userData.photoUrl)
+                photoUrl: getFullPhotoUrl(userData.photo_url || userData.photoUrl),
+                // Small pre-made versions for avatars, keyed by edge length ("64", "192")
+                photoThumbnails: Object.fromEntries(
+                    Object.entries(userData.photoThumbnails || {}).map(([size, url]) => [size, getFullPhotoUrl(url)])
+                )
             });
 
             // Set user with actual data on successful load
@@ -43,12 +43,47 @@ export const updateProfile = (formData) =>
 export const getAllEvents = () => 
     api.get('/api/events/all');
 
+// Expanded instances for a date range only (start/end are 'yyyy-MM-dd')
+export const getEventsInRange = (start, end) => 
+    api.get('/api/events', { params: { start, end } });
+
+// Instances overlapping a time window (start/end are 'yyyy-MM-ddTHH:mm')
+export const getOverlappingEvents = (start, end) => 
+    api.get('/api/events/overlaps', { params: { start, end } });
+
+// Earliest free slot of `duration` minutes; params: { after, until, day_start, day_end }
+export const getNextFreeSlot = (duration, params = {}) => 
+    api.get('/api/events/next_free', { params: { duration, ...params } });
+
 export const saveAllEvents = (events) => 
     api.post('/api/events/save_all', events);
 
 export const updateRecurrence = (data) => 
     api.put('/api/events/recurrence', data);
 
+// Single-event changes (only the affected year files are rewritten)
+export const createEvent = (event) => 
+    api.post('/api/events', event);
+
+export const updateEvent = (eventId, changes) => 
+    api.put(`/api/events/${eventId}`, changes);
+
+export const deleteEvent = (eventId, scope = 'series') => 
+    api.delete(`/api/events/${eventId}`, { params: { scope } });
+
+export const patchEvents = (ops) => 
+    api.patch('/api/events', { ops });
+
+// Team scheduling: busy blocks per user and common free slots
+// body: { userIds | usernames, start, end, duration, dayStart, dayEnd, limit }
+export const getFreeBusy = (body) => 
+    api.post('/api/freebusy', body);
+
+// Changes since `cursor` (long-polls up to `wait` seconds). On resync: true,
+// reload everything and continue from the returned cursor.
+export const getChanges = (since, wait = 25) => 
+    api.get('/api/changes', { params: { since, wait } });
+
 
 // --- Task / Checklist Service ---
 export const loadTasks = () => 
@@ -68,9 +103,24 @@ export const updateTask = (taskId, data) =>
 export const parseImage = (base64Image, prompt) => 
     api.post('/api/chat/parse_image', { image: base64Image, prompt });
 
-// Agentic Scheduling (Takes full history)
-export const scheduleEventFromText = (history) => 
-    api.post('/api/chat/schedule_event', { history });
+// Sends the File/Blob as multipart instead of a base64 JSON string (~25% smaller)
+export const parseImageFile = (file, prompt) => {
+    const formData = new FormData();
+    formData.append('image', file);
+    if (prompt) formData.append('prompt', prompt);
+    return api.post('/api/chat/parse_image', formData);
+};
+
+// Agentic Scheduling: the server keeps the conversation, so a turn posts just
+// { sessionId, message }. Without a sessionId the full history starts a session.
+export const scheduleEventFromText = (history, sessionId) => 
+    sessionId
+        ? api.post('/api/chat/schedule_event', { sessionId, message: history[history.length - 1].text })
+        : api.post('/api/chat/schedule_event', { history });
+
+// Queued AI jobs: post with { async: true }, then poll (long-polls up to `wait` seconds)
+export const getAiJob = (jobId, wait = 25) => 
+    api.get(`/api/chat/jobs/${jobId}`, { params: { wait } });
 
 
 // 4. Default Export (For backward compatibility)
@@ -80,14 +130,25 @@ const exportedApi = {
     getProfile,
     updateProfile,
     getAllEvents,
+    getEventsInRange,
+    getOverlappingEvents,
+    getNextFreeSlot,
     saveAllEvents,
     updateRecurrence,
+    createEvent,
+    updateEvent,
+    deleteEvent,
+    patchEvents,
+    getFreeBusy,
+    getChanges,
     loadTasks,
     saveTask,
     deleteTask,
     updateTask,
     parseImage,
+    parseImageFile,
     scheduleEventFromText,
+    getAiJob,
 };
 
 export default exportedApi;
\ No newline at end of file